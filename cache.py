@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LruCache:
+    """Кэш, ограниченный числом записей и суммарным объемом.
+
+    При переполнении вытесняются давно не использованные записи. Если задан
+    ttl, записи старше ttl секунд считаются отсутствующими.
+    """
+
+    def __init__(
+            self,
+            max_entries: int,
+            max_bytes: Optional[int] = None,
+            sizeof: Optional[Callable[[Any], int]] = None,
+            ttl: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.ttl = ttl
+        self.bytes = 0
+        self._data = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+
+        if item is None:
+            return default
+
+        if item[2] is not None and item[2] <= time.monotonic():
+            self.pop(key)
+            return default
+
+        self._data.move_to_end(key)
+
+        return item[0]
+
+    def set(
+            self,
+            key: Hashable,
+            value: Any,
+            ttl: Optional[float] = None,
+    ) -> None:
+        """Сохранит значение; ttl записи заменяет ttl кэша."""
+        size = self.sizeof(value)
+        ttl = ttl or self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        self.pop(key)
+
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        self._data[key] = (value, size, expires_at)
+        self.bytes += size
+        self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+
+        if item is None:
+            return default
+
+        self.bytes -= item[1]
+
+        return item[0]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+
+    def _evict(self) -> None:
+        while (
+                len(self._data) > self.max_entries
+                or (self.max_bytes and self.bytes > self.max_bytes)
+        ):
+            _, (_, size, _) = self._data.popitem(last=False)
+            self.bytes -= size
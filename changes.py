@@ -0,0 +1,204 @@
+import asyncio
+from collections import defaultdict
+from typing import Awaitable, Callable, Iterable, Optional
+
+import sqlalchemy as db
+
+from constants import DbConstant
+from logger import run_logger
+
+logger = run_logger('changes')
+
+WATCHED_TABLES = ('chats',)
+
+# Прежние версии ставили триггеры и на messages, хотя их никто не слушал.
+STALE_TRIGGERS = ('messages',)
+
+# Канал передается триггеру аргументом: у каждого владельца он свой.
+POSTGRES_DDL = (
+    """
+    CREATE OR REPLACE FUNCTION public.vk_tg_notify_change()
+    RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify(TG_ARGV[0], TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS chats_notify_change ON {prefix}chats',
+    """
+    CREATE TRIGGER chats_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON {prefix}chats
+    FOR EACH ROW EXECUTE PROCEDURE public.vk_tg_notify_change('{channel}')
+    """,
+) + tuple(
+    f'DROP TRIGGER IF EXISTS {table}_notify_change ON {{prefix}}{table}'
+    for table in STALE_TRIGGERS
+)
+
+SQLITE_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS change_versions (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    INSERT OR IGNORE INTO change_versions (table_name, version)
+    VALUES ('chats', 0)
+    """,
+) + tuple(
+    f'DROP TRIGGER IF EXISTS {table}_{operation}_version'
+    for table in STALE_TRIGGERS
+    for operation in ('insert', 'update', 'delete')
+) + tuple(
+    f"DELETE FROM change_versions WHERE table_name = '{table}'"
+    for table in STALE_TRIGGERS
+) + tuple(
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_version
+    AFTER {operation} ON {table}
+    BEGIN
+        UPDATE change_versions SET version = version + 1
+        WHERE table_name = '{table}';
+    END
+    """
+    for table in WATCHED_TABLES
+    for operation in ('INSERT', 'UPDATE', 'DELETE')
+)
+
+
+class ChangeNotifier:
+    """Оповещает процессы об изменениях таблицы chats.
+
+    В PostgreSQL изменения приходят через LISTEN/NOTIFY, в SQLite
+    отслеживаются опросом счетчиков версий, которые увеличивают триггеры.
+    Блокирующие обращения к БД выполняются в отдельном потоке, чтобы не
+    задерживать общий цикл событий.
+    """
+
+    def __init__(
+            self,
+            engine: db.Engine,
+            schema: Optional[str] = None,
+            channel: str = DbConstant.CHANGES_CHANNEL.value,
+    ):
+        self.engine = engine
+        self.schema = schema
+        self.channel = channel
+        self.subscribers = defaultdict(list)
+
+    def install(self) -> None:
+        """Создаст триггеры, сообщающие об изменениях."""
+        if DbConstant.USE_POSTGRES.value:
+            prefix = f'{self.schema}.' if self.schema else ''
+            statements = [
+                statement.format(channel=self.channel, prefix=prefix)
+                for statement in POSTGRES_DDL
+            ]
+        else:
+            statements = SQLITE_DDL
+
+        with self.engine.begin() as connection:
+            for statement in statements:
+                connection.execute(db.text(statement))
+
+    def subscribe(
+            self,
+            table: str,
+            callback: Callable[[], Awaitable[None]],
+    ) -> None:
+        self.subscribers[table].append(callback)
+
+    async def dispatch(self, tables: Iterable[str]) -> None:
+        for table in tables:
+            logger.debug(f'Таблица {table} изменена.')
+
+            for callback in self.subscribers.get(table, []):
+                await callback()
+
+    def connect_postgres(self, dsn: str):
+        """Откроет соединение и подпишется на канал изменений."""
+        import psycopg2
+
+        connection = psycopg2.connect(
+            dsn,
+            connect_timeout=DbConstant.CHANGES_CONNECT_TIMEOUT.value,
+        )
+        connection.autocommit = True
+        connection.cursor().execute(f'LISTEN {self.channel}')
+
+        return connection
+
+    def get_versions(self) -> dict[str, int]:
+        with self.engine.connect() as connection:
+            return dict(
+                connection.execute(db.text(
+                    'SELECT table_name, version FROM change_versions'
+                )).all()
+            )
+
+    async def listen(self) -> None:
+        if DbConstant.USE_POSTGRES.value:
+            await self.listen_postgres()
+        else:
+            await self.poll_sqlite()
+
+    async def listen_postgres(self) -> None:
+        """Получит уведомления об изменениях через LISTEN/NOTIFY."""
+        import psycopg2
+
+        loop = asyncio.get_running_loop()
+        dsn = self.engine.url.set(drivername='postgresql').render_as_string(
+            hide_password=False,
+        )
+
+        while True:
+            try:
+                connection = await asyncio.to_thread(
+                    self.connect_postgres, dsn,
+                )
+
+                readable = asyncio.Event()
+                loop.add_reader(connection.fileno(), readable.set)
+
+                # Пока соединения не было, уведомления могли быть потеряны.
+                await self.dispatch(tables=WATCHED_TABLES)
+
+                try:
+                    while True:
+                        await readable.wait()
+                        readable.clear()
+
+                        connection.poll()
+                        tables = {
+                            notify.payload for notify in connection.notifies
+                        }
+                        connection.notifies.clear()
+
+                        await self.dispatch(tables=tables)
+                finally:
+                    loop.remove_reader(connection.fileno())
+                    connection.close()
+
+            except psycopg2.Error as error:
+                logger.error(f'Потеряно соединение LISTEN: {error}')
+
+            await asyncio.sleep(DbConstant.CHANGES_RECONNECT_INTERVAL.value)
+
+    async def poll_sqlite(self) -> None:
+        """Отследит изменения по счетчикам версий таблиц."""
+        versions = dict()
+
+        while True:
+            current_versions = await asyncio.to_thread(self.get_versions)
+
+            changed_tables = [
+                table for table, version in current_versions.items()
+                if versions.get(table) != version
+            ]
+            versions = current_versions
+
+            await self.dispatch(tables=changed_tables)
+
+            await asyncio.sleep(DbConstant.CHANGES_POLL_INTERVAL.value)
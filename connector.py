@@ -1,21 +1,30 @@
 import asyncio
-import multiprocessing
 import os
 import signal
 import sys
+from contextlib import AsyncExitStack
+from datetime import datetime
 from pprint import pformat
 
 from requests.exceptions import ConnectionError
 from urllib3.exceptions import NameResolutionError
 
-import db
 import tgbot
 import vkapi
 from constants import ConnectorConstant as ConnConst
-from constants import DbConstant, TgConstant
-from exceptions import (LongPollConnectionError, LongPollResponseError,
-                        VkApiConnectionError, VkApiError)
+from constants import DbConstant, TgConstant, VkEventKind
+from db import Database
+from exceptions import (LeadershipLostError, LongPollConnectionError,
+                        LongPollResponseError, VkApiConnectionError,
+                        VkApiError, WorkerError)
+from leader import LeaderElection
 from logger import run_logger
+from media import downloader
+from metrics import log_metrics
+from sources import create_event_source
+from tenants import current_tenant, load_tenants
+from webhook import webhook_server
+from workers import ShardPool
 
 logger = run_logger(os.path.basename(sys.argv[0]))
 
@@ -23,12 +32,27 @@ logger = run_logger(os.path.basename(sys.argv[0]))
 class VkTgConnector(vkapi.VkApi):
     """Обработает обновления от API Vk и передаст их Telegram-боту."""
 
-    def __init__(self):
+    def __init__(self, tenant, database, shards=None, election=None):
         super().__init__()
+        self.tenant = tenant
+        self.db = database
+        self.bot_app = tgbot.TgBotApp(token=tenant.bot_token).app
+        self.notificator = tgbot.TgBotNotification(
+            app=self.bot_app, database=database,
+        )
+        self.sender = tgbot.VkTgMessage(app=self.bot_app, database=database)
+        self.typing = tgbot.TgBotTypingForwarder(
+            app=self.bot_app, database=database,
+        )
+        self.source = create_event_source(api=self, tenant=tenant)
+        self.shards = shards
+        self.election = election
+        self.saved_timestamp = None
 
     async def manager(self):
         logger.info(
-            'Запуск vk-tg connector v0.1.8a. '
+            'Запуск vk-tg connector v0.1.8a '
+            f'для владельца {self.tenant.tenant_id}. '
             f'База данных подключена ({DbConstant.DB_ENGINE.value}).'
         )
 
@@ -36,23 +60,42 @@ class VkTgConnector(vkapi.VkApi):
             await asyncio.sleep(ConnConst.MANAGER_INTERVAL.value)
 
             try:
-                if not self.timestamp:
+                if not self.source.timestamp:
                     logger.info('Получаем новый Vk LongPoll-сервер.')
 
-                    params = self.get_vk_long_pol_server()
-                    self.update_params(params=params)
+                    # Продолжим с места, где остановился прежний лидер.
+                    await asyncio.to_thread(
+                        self.source.connect,
+                        timestamp=self.saved_timestamp,
+                    )
+                    self.saved_timestamp = None
 
                     logger.info('Vk LongPoll-сервер получен. Ждем обновлений.')
 
-                response = self.connect_vk_long_poll_server(
-                    wait=ConnConst.LONG_POLL_INTERVAL.value
+                # Запрос длится до LONG_POLL_INTERVAL секунд и не должен
+                # останавливать обработку обновлений бота в том же цикле.
+                updates = await asyncio.to_thread(
+                    self.source.check,
+                    wait=ConnConst.LONG_POLL_INTERVAL.value,
                 )
-                self.timestamp = response.get('ts')
-                updates = response.get('updates')
 
-                if updates:
+                if updates and self.election:
+                    await self.election.confirm()
+
+                if updates and self.shards:
+                    await self.shards.dispatch(
+                        tenant_id=self.tenant.tenant_id,
+                        updates=updates,
+                    )
+                elif updates:
                     await self.processing_updates(updates=updates)
 
+                if self.election:
+                    await self.election.save_ts(ts=self.source.timestamp)
+
+            except (LeadershipLostError, WorkerError):
+                raise
+
             except (
                     ConnectionError,
                     NameResolutionError,
@@ -68,15 +111,15 @@ class VkTgConnector(vkapi.VkApi):
             except LongPollResponseError as error:
                 logger.warning(f'LongPollResponseError: {error}')
 
-                self.timestamp = None
+                self.source.timestamp = None
 
             except VkApiError as error:
                 error = str(error)
 
                 logger.error(msg=error)
 
-                await bot.app.bot.send_message(
-                    chat_id=TgConstant.TELEGRAM_CHAT_ID.value,
+                await self.bot_app.bot.send_message(
+                    chat_id=self.tenant.tg_chat_id,
                     text=error,
                 )
 
@@ -87,51 +130,88 @@ class VkTgConnector(vkapi.VkApi):
 
                 await asyncio.sleep(ConnConst.EXCEPTION_TRY_INTERVAL.value)
 
+    async def prefetch_messages(self, events):
+        """Дополнит новые сообщения пачки полными данными.
+
+        Сообщения, которые источник передал без данных, запрашиваются
+        разом, затем разом запрашиваются видео всех сообщений.
+        """
+        new_messages = [
+            event for event in events
+            if event.kind == VkEventKind.NEW_MESSAGE
+        ]
+        message_ids = [
+            event.message_id for event in new_messages if event.item is None
+        ]
+
+        if message_ids:
+            messages_data = await asyncio.to_thread(
+                self.get_messages_by_ids, message_ids=message_ids,
+            )
+
+            for event in new_messages:
+                if event.item is None and event.message_id in messages_data:
+                    event.item = (
+                        messages_data[event.message_id]['response']['items'][0]
+                    )
+
+        await self.prefetch_videos(
+            items=[event.item for event in new_messages if event.item],
+        )
+
     async def processing_updates(self, updates):
         logger.debug(pformat(f'Update: {updates}'))
 
-        for element in updates:
-            event_code = element[0]
-
-            if event_code == 7:
-                vk_message_id = element[2]
-                vk_user_id = element[1]
+        await self.prefetch_messages(events=updates)
 
-                await notificator.send_read_notification(
-                    vk_user_id=vk_user_id,
-                    vk_message_id=vk_message_id
+        for event in updates:
+            if event.kind == VkEventKind.READ:
+                await self.notificator.read(
+                    vk_user_id=event.peer_id,
+                    vk_message_id=event.message_id,
                 )
-            elif (
-                event_code == ConnConst.NEW_MSG_CODE.value
-                and element[2] not in ConnConst.OUTGOING_MSG_CODE.value
-            ):
+            elif event.kind == VkEventKind.NEW_MESSAGE:
                 logger.info(
                     'Новое входящее сообщение. Подготавливаем пересылку.'
                 )
 
-                await self.handle_incoming_message(update=element)
+                self.typing.message_received(vk_user_id=event.peer_id)
+                await self.handle_incoming_message(event=event)
+            elif (
+                event.kind == VkEventKind.TYPING
+                and TgConstant.TYPING_FORWARDING.value
+            ):
+                self.typing.typing(vk_user_id=event.peer_id)
 
-    async def handle_incoming_message(self, update):
-        logger.debug(pformat(update))
+    async def handle_incoming_message(self, event):
+        logger.debug(pformat(event))
 
-        message_id = update[1]
-        sender_id = update[3]
-        short_msg_data = update[6]
+        sender_id = event.peer_id
 
-        message_data = self.get_message_by_id(message_id=message_id,)
-        message = self.get_message(
+        if event.item:
+            message_data = {'response': {'items': [event.item]}}
+        else:
+            message_data = await asyncio.to_thread(
+                self.get_message_by_id, message_id=event.message_id,
+            )
+
+        item = message_data['response']['items'][0]
+        message = await self.get_message(message_data=message_data)
+
+        await self.archive_message(
+            sender_id=sender_id,
             message_data=message_data,
-            short_msg_data=(
-                short_msg_data if 'sticker' in short_msg_data.values()
-                else None
-            ),
+            message=message,
         )
 
-        if 'reply' in short_msg_data.keys():
+        if item.get('reply_message'):
             reply_orig_msg_id = self.get_reply_orig_msg_id(
                 message_data=message_data,
             )
-            msg_in_db = db.get_message(vk_message_id=reply_orig_msg_id)
+            msg_in_db = await self.db.get_message(
+                vk_user_id=sender_id,
+                vk_message_id=reply_orig_msg_id,
+            )
 
             if msg_in_db:
                 reply_orig_message_tg_id = msg_in_db.tg_message_id
@@ -142,7 +222,7 @@ class VkTgConnector(vkapi.VkApi):
                     reply_orig_message_tg_id=reply_orig_message_tg_id,
                 )
             else:
-                reply_orig_message = self.get_reply_original_message(
+                reply_orig_message = await self.get_reply_original_message(
                     message_data=message_data,
                 )
 
@@ -152,10 +232,11 @@ class VkTgConnector(vkapi.VkApi):
                     reply_orig_message=reply_orig_message,
                 )
 
-        elif 'wall' in short_msg_data.values():
-            attachments = message_data['response']['items'][0]['attachments']
-            post = self.get_wall(attachments=attachments)
-            post['message_id'] = message_id
+        elif any(
+            attachment['type'] == 'wall'
+            for attachment in item.get('attachments', [])
+        ):
+            post = await self.get_wall(attachments=item['attachments'])
 
             await self.send_wall(
                 post_comment=message,
@@ -163,35 +244,52 @@ class VkTgConnector(vkapi.VkApi):
                 sender_id=sender_id,
             )
         else:
-            message['text'] = self.text_for_tg(**message)
-
-            await sender_vk_tg.send_msg_vk_tg(
+            await self.sender.send_msg_vk_tg(
                 vk_sender_id=sender_id,
+                vk_message_id=message.message_id,
                 message=message,
             )
 
+    async def archive_message(self, sender_id, message_data, message):
+        item = message_data['response']['items'][0]
+
+        await self.db.archive_message(
+            vk_user_id=sender_id,
+            vk_message_id=item['id'],
+            sender_id=item['from_id'],
+            sender_name=message.sender.name,
+            date=datetime.utcfromtimestamp(item['date']),
+            text=item.get('text', ''),
+            attachments=self.describe_attachments(
+                attachments=item.get('attachments', []),
+            ),
+        )
+
     async def send_wall(self, sender_id, post_comment, post):
         ids = {'post_comment_id': None, 'post_id': None}
-        post_comment_exists = self.content_exists(message=post_comment,)
+        post_comment_exists = post_comment.has_content()
 
         if post_comment_exists:
-            post_comment['text'] = self.text_for_tg(**post_comment,)
-            ids['post_comment_id'] = await sender_vk_tg.send_msg_vk_tg(
+            ids['post_comment_id'] = await self.sender.send_msg_vk_tg(
                 vk_sender_id=sender_id,
+                vk_message_id=post_comment.message_id,
                 message=post_comment,
             )
 
-        sender_signature = self.get_signature(**post_comment)
-        post['text'] = self.text_for_tg(
-            head_signature=(
-                sender_signature if not post_comment_exists else None
-            ), **post,
-        )
-        ids['post_id'] = await sender_vk_tg.send_msg_vk_tg(
+        ids['post_id'] = await self.sender.send_msg_vk_tg(
             vk_sender_id=sender_id,
+            vk_message_id=post_comment.message_id,
             message=post,
+            text=post.text_for_tg(
+                head_signature=(
+                    post_comment.sender.signature()
+                    if not post_comment_exists else None
+                ),
+            ),
         )
 
+        self.update_cached_wall(post=post)
+
         return ids
 
     async def send_reply(
@@ -201,19 +299,13 @@ class VkTgConnector(vkapi.VkApi):
             reply_orig_message=None,
             reply_orig_message_tg_id=None,
     ):
-        reply['text'] = self.text_for_tg(**reply)
-
         if reply_orig_message_tg_id:
             tg_msg_id_for_reply = reply_orig_message_tg_id
-        elif 'wall' in reply_orig_message:
-            post = reply_orig_message['wall']
-            post['message_id'] = reply_orig_message['message_id']
-            post_comment = reply_orig_message
-
+        elif reply_orig_message.wall:
             messages_id = await self.send_wall(
                 sender_id=sender_id,
-                post_comment=post_comment,
-                post=post,
+                post_comment=reply_orig_message,
+                post=reply_orig_message.wall,
             )
 
             if messages_id.get('post_comment_id'):
@@ -222,112 +314,290 @@ class VkTgConnector(vkapi.VkApi):
                 tg_msg_id_for_reply = messages_id.get('post_id')
 
         else:
-            reply_orig_message['text'] = self.text_for_tg(
-                **reply_orig_message,
-            )
-            tg_msg_id_for_reply = await sender_vk_tg.send_msg_vk_tg(
+            tg_msg_id_for_reply = await self.sender.send_msg_vk_tg(
                 vk_sender_id=sender_id,
+                vk_message_id=reply_orig_message.message_id,
                 message=reply_orig_message,
             )
 
-        await sender_vk_tg.send_msg_vk_tg(
+        await self.sender.send_msg_vk_tg(
             vk_sender_id=sender_id,
+            vk_message_id=reply.message_id,
             message=reply,
             reply_to_message_id=tg_msg_id_for_reply,
         )
 
-    def content_exists(self, message):
-        return (
-            message['text'] != ''
-            or len(message['images']) > 0
-            or len(message['videos']['video_urls']) > 0
+
+def create_connector(tenant, prepare_schema=True, shards=None):
+    """Создаст коннектор владельца с собственными ботом и БД."""
+    database = Database(tenant=tenant, prepare_schema=prepare_schema)
+    election = None
+
+    if ConnConst.LEADER_ELECTION.value and prepare_schema:
+        election = LeaderElection(database=database)
+
+    return VkTgConnector(
+        tenant=tenant,
+        database=database,
+        shards=shards,
+        election=election,
+    )
+
+
+def create_connectors(tenants, prepare_schema=True, shards=None):
+    """Создаст коннектор для каждого владельца."""
+    return {
+        tenant.tenant_id: create_connector(
+            tenant=tenant,
+            prepare_schema=prepare_schema,
+            shards=shards,
         )
+        for tenant in tenants
+    }
 
-    def text_for_tg(self, head_signature=None, **kwargs):
-        if kwargs.get('message_type') == 'wall':
-            wall_signature = self.get_signature(wall=True, **kwargs)
 
-            if head_signature:
-                text = (
-                    f'<b>{head_signature}</b>\n\n'
-                    f'<b>Переслано от {wall_signature}</b>\n'
-                )
-            else:
-                text = f'<b>Переслано от {wall_signature}</b>\n'
-        else:
-            signature = self.get_signature(**kwargs)
-            text = f'{signature}\n'
+def run_worker(shard, events):
+    """Точка входа процесса-обработчика событий Vk."""
+    # Процесс останавливает родитель через очередь.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-        if kwargs.get('text'):
-            msg_text = kwargs.get('text')
-            text += f'{msg_text}\n'
+    connectors = create_connectors(
+        tenants=load_tenants(), prepare_schema=False,
+    )
 
-        videos = kwargs.get('videos', {}).get('video_urls')
+    asyncio.run(
+        process_shard(shard=shard, events=events, connectors=connectors),
+    )
 
-        if videos:
-            formatted_videos = '\n\n'.join(videos)
-            text += f'\n<b>Видео:</b>\n{formatted_videos}'
 
-        return text
+async def process_shard(shard, events, connectors):
+    """Обработает события своей доли собеседников по порядку."""
+    logger.info(f'Процесс-обработчик {shard} запущен.')
 
-    def get_signature(self, wall=False, **kwargs):
-        author_type = kwargs.get('type')
+    tasks = [asyncio.create_task(log_metrics())]
 
-        if author_type == 'user':
-            user_id = kwargs.get('user_id')
-            name = f'{kwargs.get("first_name")} {kwargs.get("last_name")}'
+    for connector in connectors.values():
+        current_tenant.set(connector.tenant)
+        tasks.append(asyncio.create_task(connector.db.listen_changes()))
 
-            if wall:
-                post_id = kwargs.get('post_id')
-                url = f'https://vk.com/wall{user_id}_{post_id}'
-            else:
-                url = f'https://vk.com/im?sel={user_id}'
-        else:
-            group_id = kwargs.get('group_id')
-            name = kwargs.get('group_name')
+    try:
+        async with AsyncExitStack() as stack:
+            for connector in connectors.values():
+                await stack.enter_async_context(connector.bot_app.bot)
 
-            if wall:
-                post_id = kwargs.get('post_id')
-                url = f'https://vk.com/wall-{group_id}_{post_id}'
-            else:
-                url = f'https://vk.com/club{group_id}'
+            while True:
+                item = await asyncio.to_thread(events.get)
 
-        signature = (
-            f'<a href="{url}"><b>{name}</b></a>'
-        )
+                if item is None:
+                    break
 
-        return signature
+                tenant_id, updates = item
+                connector = connectors[tenant_id]
+                current_tenant.set(connector.tenant)
 
+                try:
+                    await connector.processing_updates(updates=updates)
+                except Exception as error:
+                    logger.exception(f'Что-то пошло не так: {error}')
 
-def signal_handler(sig, frame):
-    logger.info('Завершаем программу...')
-    sys.exit(0)
+            for connector in connectors.values():
+                current_tenant.set(connector.tenant)
+                await connector.notificator.flush_read_notifications()
+    finally:
+        for task in tasks:
+            task.cancel()
 
+        for connector in connectors.values():
+            await connector.db.close()
 
-async def set_commands_and_run_manager():
-    bot_task = bot.set_commands()
-    connector_task = connector.manager()
+        await downloader.close()
 
-    await asyncio.gather(bot_task, connector_task)
+        logger.info(f'Процесс-обработчик {shard} остановлен.')
 
 
-if __name__ == '__main__':
-    signal.signal(signal.SIGINT, signal_handler)
+async def lead(connector, bot):
+    """Принимает обновления Vk и Telegram, пока реплика остается лидером.
+
+    Резервная реплика держит бота и соединения с БД открытыми и ждет
+    лидерства, после чего продолжает чтение LongPoll с сохраненного ts.
+    """
+    election = connector.election
+
+    while True:
+        await election.acquire()
+
+        connector.source.timestamp = None
+        connector.saved_timestamp = await election.load_ts()
+
+        await bot.start_updates()
+
+        manager = asyncio.create_task(connector.manager())
+        heartbeat = asyncio.create_task(election.heartbeat())
+
+        try:
+            await asyncio.wait(
+                {manager, heartbeat},
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            manager.cancel()
+            heartbeat.cancel()
+            await asyncio.gather(manager, heartbeat, return_exceptions=True)
+
+            await bot.stop_updates()
+            await election.release()
+
+        if manager.done() and not manager.cancelled():
+            error = manager.exception()
 
-    db = db.Database()
+            if not isinstance(error, LeadershipLostError):
+                raise error
 
-    bot_app_builder = tgbot.TgBotApp(token=TgConstant.TELEGRAM_BOT_TOKEN.value)
-    bot_app = bot_app_builder.app
-    bot = tgbot.TgBot(app=bot_app, database=db)
 
+async def receive_updates(connector, bot):
+    if connector.election:
+        await lead(connector=connector, bot=bot)
+    else:
+        await bot.start_updates()
+        await connector.manager()
+
+
+async def serve(connector):
+    """Запустит бота и коннектор владельца.
+
+    Сначала инициализируется бот, затем начинается прием обновлений и
+    работа коннектора. Завершение идет в обратном порядке: прием
+    обновлений, фоновые задачи, обработчики бота, запись в БД.
+    """
+    current_tenant.set(connector.tenant)
+
+    bot_app = connector.bot_app
+    bot = tgbot.TgBot(app=bot_app, database=connector.db)
     bot.add_handlers()
 
-    notificator = tgbot.TgBotNotification(app=bot_app, database=db)
-    sender_vk_tg = tgbot.VkTgMessage(app=bot_app, database=db)
+    try:
+        async with bot_app:
+            await bot_app.start()
+
+            tasks = asyncio.gather(
+                bot.set_commands(),
+                receive_updates(connector=connector, bot=bot),
+                connector.db.run_retention(),
+                connector.db.listen_changes(),
+            )
+
+            try:
+                await tasks
+            finally:
+                await bot.stop_updates()
+
+                tasks.cancel()
+                await asyncio.gather(tasks, return_exceptions=True)
+
+                await connector.notificator.flush_read_notifications()
+
+                if bot_app.running:
+                    await bot_app.stop()
+    finally:
+        await connector.db.close()
+
+
+async def supervise(connector):
+    """Обслуживает владельца и перезапускает его после сбоев.
+
+    Сбой одного владельца не затрагивает остальных: его коннектор
+    создается заново после паузы, которая удваивается с каждым сбоем
+    подряд. Ошибка общих процессов-обработчиков завершает программу.
+    """
+    tenant = connector.tenant
+    shards = connector.shards
+    loop = asyncio.get_running_loop()
+    delay = ConnConst.TENANT_RESTART_MIN_DELAY.value
+
+    while True:
+        started = loop.time()
+
+        try:
+            if connector is None:
+                connector = await asyncio.to_thread(
+                    create_connector, tenant=tenant, shards=shards,
+                )
+
+            await serve(connector=connector)
+            logger.error(f'Владелец {tenant.tenant_id} остановился.')
+        except WorkerError:
+            raise
+        except Exception as error:
+            logger.exception(f'Сбой владельца {tenant.tenant_id}: {error}')
+
+        connector = None
+
+        # Владелец долго работал без сбоев: начинаем паузы заново.
+        if loop.time() - started > ConnConst.TENANT_RESTART_MAX_DELAY.value:
+            delay = ConnConst.TENANT_RESTART_MIN_DELAY.value
+
+        logger.info(
+            f'Перезапуск владельца {tenant.tenant_id} через {delay} с.'
+        )
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, ConnConst.TENANT_RESTART_MAX_DELAY.value)
+
+
+async def run(connectors, shards=None):
+    """Запустит ботов и коннекторы всех владельцев в одном цикле событий.
+
+    Владельцы используют общие пулы HTTP-соединений, кэши и, в
+    PostgreSQL, пул соединений с БД. Упавший владелец перезапускается,
+    не останавливая остальных.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    if shards:
+        shards.start()
+
+    serving = [
+        asyncio.create_task(supervise(connector=connector))
+        for connector in connectors.values()
+    ]
+    background = [
+        asyncio.create_task(log_metrics()),
+        asyncio.create_task(stop.wait()),
+    ]
+
+    try:
+        done, _ = await asyncio.wait(
+            serving + background[-1:],
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    finally:
+        logger.info('Завершаем программу...')
+
+        for task in serving + background:
+            task.cancel()
+
+        await asyncio.gather(*serving, return_exceptions=True)
+
+        if shards:
+            await asyncio.to_thread(shards.stop)
+
+        await webhook_server.stop()
+        await downloader.close()
+
+    for task in done:
+        if task in serving and not task.cancelled() and task.exception():
+            raise task.exception()
+
+
+if __name__ == '__main__':
+    shards = None
 
-    bot_polling = multiprocessing.Process(target=bot.run_polling)
-    bot_polling.start()
+    if ConnConst.WORKERS.value:
+        shards = ShardPool(workers=ConnConst.WORKERS.value, target=run_worker)
 
-    connector = VkTgConnector()
+    connectors = create_connectors(tenants=load_tenants(), shards=shards)
 
-    asyncio.run(set_commands_and_run_manager())
+    asyncio.run(run(connectors=connectors, shards=shards))
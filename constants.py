@@ -28,11 +28,36 @@ class DbConstant(Enum):
         DB_URL = 'sqlite:///chats.sqlite3'
         DB_ENGINE = 'SQLite'
 
-    MAX_MESSAGES_PER_USER = 200
+    SQLITE_TUNED = os.getenv('SQLITE_TUNED', 'True').lower() == 'true'
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    }
+
+    MAX_MESSAGES_PER_USER = int(os.getenv('MAX_MESSAGES_PER_USER', 200))
+    MESSAGE_MAX_AGE_DAYS = int(os.getenv('MESSAGE_MAX_AGE_DAYS', 0))
+    PRUNE_INTERVAL = int(os.getenv('PRUNE_INTERVAL', 600))
+    POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    POOL_RECYCLE = 1800
+    STATEMENT_CACHE_SIZE = 500
+    ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'False').lower() == 'true'
+    ARCHIVE_TS_CONFIG = os.getenv('ARCHIVE_TS_CONFIG', 'russian')
+    ARCHIVE_COMPRESS_LEVEL = 6
+    FLUSH_ROWS = int(os.getenv('DB_FLUSH_ROWS', 100))
+    FLUSH_INTERVAL = int(os.getenv('DB_FLUSH_INTERVAL_MS', 200)) / 1000
+    CHANGES_CHANNEL = 'vk_tg_changes'
+    CHANGES_POLL_INTERVAL = 0.2
+    CHANGES_RECONNECT_INTERVAL = 5
+    CHANGES_CONNECT_TIMEOUT = 10
 
 
 class ConnectorConstant(Enum):
-    VK_ID = int(os.getenv('VK_ID'))
+    VK_ID = int(os.getenv('VK_ID', 0))
     MANAGER_INTERVAL = 0.5
     LONG_POLL_INTERVAL = 25
     CONN_ER_INTERVAL = 30
@@ -40,20 +65,105 @@ class ConnectorConstant(Enum):
     EXCEPTION_TRY_INTERVAL = 60
     OUTGOING_MSG_CODE = (51, 35, 19, 2097203, 2097187)
     NEW_MSG_CODE = 4
+    READ_MSG_CODE = 7
+    TYPING_CODES = (61, 63)
+    WORKERS = int(os.getenv('CONNECTOR_WORKERS', 0))
+    WORKER_QUEUE_SIZE = 1000
+    WORKER_STOP_TIMEOUT = 10
+    WORKER_PUT_TIMEOUT = int(os.getenv('CONNECTOR_WORKER_PUT_TIMEOUT', 60))
+    WORKER_MAX_RESTARTS = 3
+    TENANT_RESTART_MIN_DELAY = 5
+    TENANT_RESTART_MAX_DELAY = 300
+    LEADER_ELECTION = os.getenv('LEADER_ELECTION', 'False').lower() == 'true'
+    LEADER_LOCK_NAMESPACE = 0x766B7467
+    LEADER_RETRY_INTERVAL = 1
+    LEADER_HEARTBEAT_INTERVAL = 1
+    LEADER_LEASE_TIMEOUT = int(os.getenv('LEADER_LEASE_TIMEOUT', 5))
 
 
 class TgConstant(Enum):
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    TELEGRAM_CHAT_ID = int(os.getenv('TELEGRAM_CHAT_ID'))
+    TELEGRAM_CHAT_ID = int(os.getenv('TELEGRAM_CHAT_ID', 0))
     READ_NOTIFICATION_MODE = int(os.getenv('READ_NOTIFICATION_MODE'))
+    READ_NOTIFICATION_DEBOUNCE = (
+        int(os.getenv('READ_NOTIFICATION_DEBOUNCE_MS', 3000)) / 1000
+    )
+    BOT_API_URL = os.getenv(
+        'TELEGRAM_BOT_API_URL', 'https://api.telegram.org',
+    ).rstrip('/')
+    UPDATE_MODE = os.getenv('TELEGRAM_UPDATE_MODE', 'polling').lower()
+    WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+    WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
+    WEBHOOK_LISTEN = os.getenv('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('TELEGRAM_WEBHOOK_PORT', 8080))
     SEND_MSG_CONN_TIMEOUT = 120
     READ_TIMEOUT = 60
+    SEND_NOTIFICATION_MODE = int(os.getenv('SEND_NOTIFICATION_MODE', 2))
     DEL_NOTIFICATION_OF_SEND = 2
+    NOTICE_BATCH_WINDOW = 0.5
+    TYPING_FORWARDING = (
+        os.getenv('TYPING_FORWARDING', 'True').lower() == 'true'
+    )
+    # Примерно столько Telegram показывает действие typing.
+    TYPING_INTERVAL = 5
+    TYPING_QUEUE_SIZE = 100
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 64))
+    SEARCH_PAGE_SIZE = 5
+    SEARCH_SNIPPET_LENGTH = 300
+
+
+class MediaConstant(Enum):
+    MAX_TRANSFER_SIZE = (
+        int(os.getenv('MEDIA_MAX_TRANSFER_SIZE_MB', 50)) * 1024 * 1024
+    )
+    MAX_BYTES_IN_FLIGHT = (
+        int(os.getenv('MEDIA_MAX_BYTES_IN_FLIGHT_MB', 100)) * 1024 * 1024
+    )
+    PER_HOST_CONCURRENCY = int(os.getenv('MEDIA_PER_HOST_CONCURRENCY', 4))
+    MAX_CONNECTIONS = int(os.getenv('MEDIA_MAX_CONNECTIONS', 20))
+    CHUNK_SIZE = 64 * 1024
+    # Резерв бюджета для файла, размер которого до ответа неизвестен.
+    INITIAL_RESERVE = 512 * 1024
+    CONNECT_TIMEOUT = 10
+    TRANSFER_TIMEOUT = 120
+    TG_UPLOAD_METHODS = {
+        'document': ('sendDocument', 'document'),
+        'voice': ('sendVoice', 'voice'),
+        'audio': ('sendAudio', 'audio'),
+    }
+
+
+class MetricsConstant(Enum):
+    LOG_INTERVAL = int(os.getenv('METRICS_LOG_INTERVAL', 300))
+    WINDOW = 1000
+
+
+class TenantConstant(Enum):
+    FILE = os.getenv('TENANTS_FILE', '')
+    DEFAULT_ID = 'default'
 
 
-def get_vk_token():
-    token = os.getenv('VK_ACCESS_TOKEN')
+class StateConstant(Enum):
+    BACKEND = os.getenv('BOT_STATE_BACKEND', 'memory').lower()
+    MAX_ENTRIES = int(os.getenv('BOT_STATE_MAX_ENTRIES', 10000))
+    TTL = int(os.getenv('BOT_STATE_TTL', 86400))
+    # Бот может удалять свои сообщения только в течение 48 часов.
+    READ_NOTIFICATION_TTL = 48 * 3600
+    WAIT_ID_TTL = 3600
+    CHATS_WAIT_ID = 'chats_wait_id'
+    INTERFACES = 'interfaces'
+    READ_NOTIFICATIONS = 'read_notifications'
 
+
+class CacheConstant(Enum):
+    WALL_MAX_ENTRIES = int(os.getenv('WALL_CACHE_MAX_ENTRIES', 256))
+    WALL_MAX_BYTES = int(os.getenv('WALL_CACHE_MAX_MB', 32)) * 1024 * 1024
+    VIDEO_MAX_ENTRIES = 4096
+    VIDEO_TTL = int(os.getenv('VIDEO_CACHE_TTL', 3600))
+
+
+def parse_vk_token(token):
+    """Извлечет токен из ссылки, если указана ссылка целиком."""
     if 'https' in token:
         parsed_url = urlparse(token)
         fragment = parsed_url.fragment
@@ -63,18 +173,33 @@ def get_vk_token():
     return token
 
 
+class VkEventKind(Enum):
+    NEW_MESSAGE = 'new_message'
+    READ = 'read'
+    TYPING = 'typing'
+
+
 class VkConstant(Enum):
-    ACCESS_TOKEN = get_vk_token()
+    ACCESS_TOKEN = parse_vk_token(os.getenv('VK_ACCESS_TOKEN', ''))
+    EVENT_SOURCE = os.getenv('VK_EVENT_SOURCE', 'user').lower()
+    GROUP_ID = int(os.getenv('VK_GROUP_ID', 0))
     NEED_PTS = 0
     LP_VERSION = 3
     API_VERSION = 5.199
     LONG_POLL_MODE = 2
     LONG_POLL_VERSION = 2
+    MESSAGES_GET_BATCH = 100
+    CONNECT_TIMEOUT = 10
+    READ_TIMEOUT = int(os.getenv('VK_READ_TIMEOUT', 30))
+    VIDEO_GET_BATCH = 200
 
     ENDPOINTS = {
         'get_lp_server': (
             'https://api.vk.com/method/messages.getLongPollServer'
         ),
+        'get_group_lp_server': (
+            'https://api.vk.com/method/groups.getLongPollServer'
+        ),
         'get_users': 'https://api.vk.com/method/users.get',
         'get_group': 'https://api.vk.com/method/groups.getById',
         'get_video': 'https://api.vk.com/method/video.get',
@@ -91,4 +216,8 @@ class VkConstant(Enum):
         'save_messages_photo': (
             'https://api.vk.com/method/photos.saveMessagesPhoto'
         ),
+        'get_doc_upload_server': (
+            'https://api.vk.com/method/docs.getMessagesUploadServer'
+        ),
+        'save_doc': 'https://api.vk.com/method/docs.save',
     }
@@ -1,13 +1,49 @@
+import asyncio
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+
 import sqlalchemy as db
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
-from sqlalchemy.sql.operators import and_
+from sqlalchemy.orm import deferred, relationship, sessionmaker
 
+from changes import ChangeNotifier
 from constants import DbConstant
+from logger import run_logger
+from metrics import metrics
+from state import create_state_store
+from tenants import default_tenant
+
+logger = run_logger('db')
 
 Base = declarative_base()
 
 
+class utcnow(db.sql.expression.FunctionElement):
+    """Текущее время UTC на стороне БД.
+
+    now() в PostgreSQL при записи в TIMESTAMP без часового пояса дает
+    местное время сервера, а сроки хранения считаются в UTC.
+    """
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, 'postgresql')
+def compile_utcnow_postgresql(element, compiler, **kwargs):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow)
+def compile_utcnow(element, compiler, **kwargs):
+    # В SQLite CURRENT_TIMESTAMP всегда в UTC.
+    return 'CURRENT_TIMESTAMP'
+
+
 class Chat(Base):
     __tablename__ = 'chats'
 
@@ -20,6 +56,21 @@ class Chat(Base):
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index(
+            'uq_messages_tg_chat_message',
+            'tg_chat_id',
+            'tg_message_id',
+            unique=True,
+        ),
+        db.Index(
+            'ix_messages_vk_user_message',
+            'vk_user_id',
+            'vk_message_id',
+        ),
+        db.Index('ix_messages_vk_user_id_id', 'vk_user_id', 'id'),
+        db.Index('ix_messages_created_at', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     vk_user_id = db.Column(
@@ -29,98 +80,779 @@ class Message(Base):
     tg_message_id = db.Column(db.Integer)
     vk_message_id = db.Column(db.Integer)
     tg_chat_id = db.Column(db.BigInteger)
+    created_at = db.Column(
+        db.DateTime, default=utcnow(), server_default=utcnow(),
+    )
 
 
-class Database:
+class ArchivedMessage(Base):
+    """Сообщение в архиве для поиска по переписке.
+
+    Текст и описания вложений хранятся в поле body в виде сжатого zlib JSON,
+    а для поиска используется индекс: FTS5 в SQLite, tsvector в PostgreSQL.
+    """
+    __tablename__ = 'archive'
+    __table_args__ = (
+        db.Index(
+            'uq_archive_vk_user_message',
+            'vk_user_id',
+            'vk_message_id',
+            unique=True,
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    vk_user_id = db.Column(db.BigInteger, nullable=False)
+    vk_message_id = db.Column(db.Integer, nullable=False)
+    sender_id = db.Column(db.BigInteger)
+    sender_name = db.Column(db.String)
+    date = db.Column(db.DateTime)
+    body = db.Column(db.LargeBinary)
+
+    if DbConstant.USE_POSTGRES.value:
+        search_vector = deferred(db.Column(postgresql.TSVECTOR))
+
+        __table_args__ += (
+            db.Index(
+                'ix_archive_search_vector',
+                'search_vector',
+                postgresql_using='gin',
+            ),
+        )
+
+    @property
+    def content(self):
+        return unpack_body(self.body)
+
+
+class LongPollState(Base):
+    """Состояние чтения LongPoll аккаунта Vk.
+
+    term увеличивается при каждой смене лидера. Записи с устаревшим term
+    отклоняются, поэтому прежний лидер не может перезаписать ts.
+    """
+    __tablename__ = 'long_poll_state'
+
+    vk_id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    term = db.Column(db.Integer, nullable=False, default=0)
+    ts = db.Column(db.BigInteger)
+    leader = db.Column(db.String)
+    heartbeat_at = db.Column(db.DateTime)
+
+
+class BotState(Base):
+    """Состояние интерфейса бота для хранилища BOT_STATE_BACKEND=db."""
+    __tablename__ = 'bot_state'
+
+    namespace = db.Column(db.String, primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    value = db.Column(db.JSON)
+    expires_at = db.Column(db.DateTime, index=True)
+
+
+SQLITE_ARCHIVE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5("
+    "text, content='', tokenize='unicode61 remove_diacritics 2')"
+)
+
+
+def pack_body(text, attachments):
+    return zlib.compress(
+        json.dumps(
+            {'text': text, 'attachments': attachments},
+            ensure_ascii=False,
+        ).encode(),
+        DbConstant.ARCHIVE_COMPRESS_LEVEL.value,
+    )
+
+
+def unpack_body(body):
+    return json.loads(zlib.decompress(body))
+
+
+def search_text(text, attachments):
+    """Вернет текст, по которому сообщение будет находиться в поиске."""
+    titles = [
+        attachment['title'] for attachment in attachments
+        if attachment.get('title')
+    ]
+
+    return ' '.join([text or ''] + titles)
+
+
+def fts_query(query):
+    """Превратит запрос пользователя в запрос FTS5 из слов в кавычках."""
+    words = [word.replace('"', '""') for word in query.split()]
+
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def insert(table):
+    """Вернет INSERT с поддержкой ON CONFLICT для текущей СУБД."""
+    if DbConstant.USE_POSTGRES.value:
+        return postgresql.insert(table)
+
+    return sqlite.insert(table)
+
+
+def migrate(engine, schema=None):
+    """Приведет существующую базу к актуальной схеме.
+
+    Добавляет колонки и индексы таблицы messages, которых не было в ранних
+    версиях. Перед созданием уникального индекса удаляет дубли связей,
+    оставляя самую свежую запись.
+    """
+    inspector = db.inspect(engine)
+    existing_columns = {
+        column['name']
+        for column in inspector.get_columns('messages', schema=schema)
+    }
+    existing_indexes = {
+        index['name']
+        for index in inspector.get_indexes('messages', schema=schema)
+    }
+    messages = f'{schema}.messages' if schema else 'messages'
+
+    with engine.begin() as connection:
+        if 'created_at' not in existing_columns:
+            logger.info('Миграция: добавляем колонку messages.created_at.')
+
+            connection.execute(db.text(
+                f'ALTER TABLE {messages} ADD COLUMN created_at TIMESTAMP'
+            ))
+
+        if engine.dialect.name == 'postgresql':
+            # Прежнее значение по умолчанию now() давало местное время.
+            connection.execute(db.text(
+                f'ALTER TABLE {messages} ALTER COLUMN created_at '
+                "SET DEFAULT TIMEZONE('utc', CURRENT_TIMESTAMP)"
+            ))
+
+        if 'uq_messages_tg_chat_message' not in existing_indexes:
+            logger.info('Миграция: удаляем дубли связей сообщений.')
+
+            connection.execute(db.text(
+                f'DELETE FROM {messages} '
+                'WHERE tg_message_id IS NOT NULL AND id NOT IN ('
+                f'SELECT MAX(id) FROM {messages} '
+                'GROUP BY tg_chat_id, tg_message_id)'
+            ))
+
+        for index in Message.__table__.indexes:
+            if index.name not in existing_indexes:
+                logger.info(f'Миграция: создаем индекс {index.name}.')
+
+                index.create(connection, checkfirst=True)
+
+        if engine.dialect.name == 'sqlite':
+            connection.execute(db.text(SQLITE_ARCHIVE_DDL))
+
+
+class ChatIndex:
+    """Двусторонний индекс связей vk_user_id <-> tg_chat_id в памяти.
+
+    Обратный индекс (tg_chat_id -> vk_user_id) содержит только чаты,
+    которые владелец связал с собеседником вручную.
+    """
+
     def __init__(self):
-        engine_args = {'url': DbConstant.DB_URL.value, }
+        self.by_vk_user_id = {}
+        self.by_tg_chat_id = {}
 
-        if DbConstant.USE_POSTGRES.value:
-            engine_args['echo'] = DbConstant.ECHO.value
+    def load(self, chats):
+        self.by_vk_user_id.clear()
+        self.by_tg_chat_id.clear()
 
-        engine = db.create_engine(**engine_args)
-        self.Session = sessionmaker(bind=engine)
+        for chat in chats:
+            self.put(chat=chat)
 
-        Base.metadata.create_all(engine)
+    def put(self, chat):
+        self.discard(vk_user_id=chat.vk_user_id)
 
-    def add_or_update_chat(self, vk_user, vk_user_id, tg_chat_id):
-        with self.Session() as session:
-            chat = session.query(Chat).filter_by(vk_user_id=vk_user_id).first()
-
-            if chat:
-                chat.vk_user_id = vk_user_id
-                chat.vk_user = vk_user
-                chat.tg_chat_id = tg_chat_id
-            else:
-                chat = Chat(
-                    vk_user=vk_user,
-                    vk_user_id=vk_user_id,
-                    tg_chat_id=tg_chat_id,
-                )
-                session.add(chat)
+        chat = Chat(
+            vk_user_id=chat.vk_user_id,
+            vk_user=chat.vk_user,
+            tg_chat_id=chat.tg_chat_id,
+        )
+        self.by_vk_user_id[chat.vk_user_id] = chat
 
-            session.commit()
+        if chat.vk_user is not None:
+            self.by_tg_chat_id[chat.tg_chat_id] = chat
 
-    def get_chat(self, vk_user_id=None, tg_chat_id=None):
-        with self.Session() as session:
-            if vk_user_id:
-                return session.query(Chat).filter_by(
-                    vk_user_id=vk_user_id
-                ).first()
-            elif tg_chat_id:
-                return session.query(Chat).filter_by(
-                    tg_chat_id=tg_chat_id
-                ).first()
-
-    def delete_chat(self, tg_chat_id):
+    def discard(self, vk_user_id):
+        chat = self.by_vk_user_id.pop(vk_user_id, None)
+
+        if chat and self.by_tg_chat_id.get(chat.tg_chat_id) is chat:
+            del self.by_tg_chat_id[chat.tg_chat_id]
+
+    def get(self, vk_user_id=None, tg_chat_id=None):
+        if vk_user_id:
+            return self.by_vk_user_id.get(vk_user_id)
+        elif tg_chat_id:
+            return self.by_tg_chat_id.get(tg_chat_id)
+
+
+class MessageBuffer:
+    """Связи сообщений, еще не записанные в базу.
+
+    Ключ - (tg_chat_id, tg_message_id), как у уникального индекса, поэтому
+    повторная связь для того же сообщения Telegram заменяет прежнюю.
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, row):
+        key = (row['tg_chat_id'], row['tg_message_id'])
+        self.rows.pop(key, None)
+        self.rows[key] = row
+
+    def take(self):
+        rows = list(self.rows.values())
+        self.rows.clear()
+
+        return rows
+
+    def restore(self, rows):
+        """Вернет в буфер строки, которые не удалось записать."""
+        pending = self.rows
+        self.rows = {}
+
+        for row in rows:
+            self.add(row=row)
+
+        self.rows.update(pending)
+
+    def find(self, **filters):
+        """Вернет самую свежую связь, подходящую под все фильтры."""
+        filters = {key: value for key, value in filters.items() if value}
+
+        for row in reversed(self.rows.values()):
+            if all(row[key] == value for key, value in filters.items()):
+                return Message(**row)
+
+    def discard(self, vk_user_id):
+        self.rows = {
+            key: row for key, row in self.rows.items()
+            if row['vk_user_id'] != vk_user_id
+        }
+
+
+def async_url(url):
+    """Вернет URL базы с асинхронным драйвером."""
+    url = db.engine.make_url(url)
+
+    if url.get_backend_name() == 'postgresql':
+        return url.set(
+            drivername='postgresql+asyncpg',
+            query={
+                'prepared_statement_cache_size': str(
+                    DbConstant.STATEMENT_CACHE_SIZE.value
+                ),
+            },
+        )
+
+    return url.set(drivername='sqlite+aiosqlite')
+
+
+def tune_sqlite(engine):
+    """Применит SQLITE_PRAGMAS к каждому новому соединению движка."""
+
+    @db.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+
+        for pragma, value in DbConstant.SQLITE_PRAGMAS.value.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+
+        cursor.close()
+
+
+ENGINES = {}
+
+
+def tenant_url(url, tenant):
+    """Вернет URL базы владельца.
+
+    В SQLite у каждого владельца, кроме владельца по умолчанию, свой файл
+    рядом с основным. В PostgreSQL база общая, владельцы различаются схемой.
+    """
+    url = db.engine.make_url(url)
+
+    if tenant.is_default or url.get_backend_name() != 'sqlite':
+        return url
+
+    root, extension = os.path.splitext(url.database)
+
+    return url.set(database=f'{root}.{tenant.tenant_id}{extension}')
+
+
+def create_engines(url, tuned_sqlite):
+    """Создаст синхронный, асинхронный и пишущий движки.
+
+    Движки PostgreSQL создаются один раз на URL: базы всех владельцев
+    работают через общий пул соединений.
+    """
+    key = url.render_as_string(hide_password=False)
+
+    if key in ENGINES:
+        return ENGINES[key]
+
+    engine_args = {'url': url, }
+    async_engine_args = {
+        'url': async_url(url),
+        'pool_size': DbConstant.POOL_SIZE.value,
+        'max_overflow': DbConstant.MAX_OVERFLOW.value,
+        'pool_recycle': DbConstant.POOL_RECYCLE.value,
+        'pool_pre_ping': True,
+        'query_cache_size': DbConstant.STATEMENT_CACHE_SIZE.value,
+        # aiosqlite по умолчанию открывает соединение на каждый запрос.
+        'poolclass': db.pool.AsyncAdaptedQueuePool,
+    }
+
+    if DbConstant.USE_POSTGRES.value:
+        engine_args['echo'] = DbConstant.ECHO.value
+        async_engine_args['echo'] = DbConstant.ECHO.value
+        async_engine_args['connect_args'] = {
+            'statement_cache_size': DbConstant.STATEMENT_CACHE_SIZE.value,
+        }
+
+    engine = db.create_engine(**engine_args)
+    async_engine = create_async_engine(**async_engine_args)
+    write_engine = async_engine
+
+    if engine.dialect.name == 'sqlite' and tuned_sqlite:
+        # Все записи процесса идут через одно соединение: в режиме WAL
+        # читатели не мешают писателю, а писатели не ждут друг друга.
+        write_engine = create_async_engine(
+            url=async_engine_args['url'],
+            poolclass=db.pool.AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+        )
+
+        for sync_engine in (
+                engine,
+                async_engine.sync_engine,
+                write_engine.sync_engine,
+        ):
+            tune_sqlite(sync_engine)
+
+    engines = (engine, async_engine, write_engine)
+
+    if engine.dialect.name == 'postgresql':
+        ENGINES[key] = engines
+
+    return engines
+
+
+class Database:
+    def __init__(
+            self,
+            url=DbConstant.DB_URL.value,
+            tuned_sqlite=DbConstant.SQLITE_TUNED.value,
+            prepare_schema=True,
+            tenant=None,
+    ):
+        self.tenant = tenant or default_tenant()
+        self.engine, self.async_engine, self.write_engine = create_engines(
+            url=tenant_url(url=url, tenant=self.tenant),
+            tuned_sqlite=tuned_sqlite,
+        )
+        self.schema = None
+
+        if self.engine.dialect.name == 'postgresql' and self.tenant.schema:
+            self.schema = self.tenant.schema
+            options = {'schema_translate_map': {None: self.schema}}
+
+            self.engine = self.engine.execution_options(**options)
+            self.async_engine = self.async_engine.execution_options(**options)
+            self.write_engine = self.async_engine
+
+        self.Session = sessionmaker(bind=self.engine)
+        self.AsyncSession = async_sessionmaker(
+            bind=self.async_engine,
+            expire_on_commit=False,
+        )
+        self.WriteSession = async_sessionmaker(
+            bind=self.write_engine,
+            expire_on_commit=False,
+        )
+
+        # Процессы-обработчики запускаются после основного процесса,
+        # который уже подготовил схему.
+        if prepare_schema:
+            if self.schema:
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        db.schema.CreateSchema(self.schema, if_not_exists=True)
+                    )
+
+            Base.metadata.create_all(self.engine)
+            migrate(self.engine, schema=self.schema)
+
+        self.chats = ChatIndex()
+        self.reload_chats()
+
+        self.state = create_state_store(database=self)
+
+        self.pending_messages = MessageBuffer()
+        self.pending_archive = []
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+
+        channel = DbConstant.CHANGES_CHANNEL.value
+
+        if not self.tenant.is_default:
+            channel = f'{channel}_{self.tenant.tenant_id}'
+
+        self.changes = ChangeNotifier(
+            engine=self.engine,
+            schema=self.schema,
+            channel=channel,
+        )
+
+        if prepare_schema:
+            self.changes.install()
+        self.changes.subscribe(table='chats', callback=self.refresh_chats)
+
+    async def close(self):
+        """Запишет отложенные связи сообщений и закроет соединения."""
+        await self.flush_messages()
+        await self.async_engine.dispose()
+        await self.write_engine.dispose()
+        self.engine.dispose()
+
+    def query_chats(self):
         with self.Session() as session:
-            chat = session.query(Chat).filter_by(tg_chat_id=tg_chat_id).first()
+            return session.query(Chat).all()
+
+    def reload_chats(self):
+        """Загрузит связи чатов в индекс в памяти."""
+        self.chats.load(chats=self.query_chats())
+
+    async def refresh_chats(self):
+        """Перечитает связи чатов в потоке и обновит индекс в цикле."""
+        self.chats.load(chats=await asyncio.to_thread(self.query_chats))
+
+    async def listen_changes(self):
+        """Обновляет кэши при изменениях, сделанных другими процессами."""
+        await self.changes.listen()
+
+    async def add_or_update_chat(self, vk_user, vk_user_id, tg_chat_id):
+        statement = insert(Chat).values(
+            vk_user=vk_user,
+            vk_user_id=vk_user_id,
+            tg_chat_id=tg_chat_id,
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['vk_user_id'],
+            set_={
+                'vk_user': statement.excluded.vk_user,
+                'tg_chat_id': statement.excluded.tg_chat_id,
+            },
+        )
+
+        async with self.WriteSession() as session:
+            await session.execute(statement)
+            await session.commit()
+
+        self.chats.put(
+            chat=Chat(
+                vk_user=vk_user,
+                vk_user_id=vk_user_id,
+                tg_chat_id=tg_chat_id,
+            ),
+        )
+
+    async def get_chat(self, vk_user_id=None, tg_chat_id=None):
+        chat = self.chats.get(vk_user_id=vk_user_id, tg_chat_id=tg_chat_id)
+
+        if chat:
+            return chat
+
+        if vk_user_id:
+            query = db.select(Chat).where(Chat.vk_user_id == vk_user_id)
+        elif tg_chat_id:
+            query = db.select(Chat).where(
+                Chat.tg_chat_id == tg_chat_id,
+                Chat.vk_user.isnot(None),
+            )
+        else:
+            return None
+
+        async with self.AsyncSession() as session:
+            chat = (await session.execute(query.limit(1))).scalar()
+
+        if chat:
+            self.chats.put(chat=chat)
+
+        return chat
+
+    async def delete_chat(self, tg_chat_id):
+        chat = await self.get_chat(tg_chat_id=tg_chat_id)
+
+        if not chat:
+            return
+
+        async with self.WriteSession() as session:
+            await session.execute(
+                db.delete(Message).where(
+                    Message.vk_user_id == chat.vk_user_id,
+                )
+            )
+            await session.execute(
+                db.delete(Chat).where(Chat.vk_user_id == chat.vk_user_id)
+            )
+            await session.commit()
 
-            if chat:
-                session.delete(chat)
-                session.commit()
+        self.chats.discard(vk_user_id=chat.vk_user_id)
+        self.pending_messages.discard(vk_user_id=chat.vk_user_id)
 
-    def add_message(
+    async def add_message(
             self,
             vk_user_id,
             tg_message_id,
             vk_message_id,
             tg_chat_id,
     ):
-        with self.Session() as session:
-            chat = session.query(Chat).filter_by(vk_user_id=vk_user_id).first()
+        """Отложит запись связи сообщений.
+
+        Связи накапливаются и записываются одним запросом, когда их
+        становится FLUSH_ROWS или проходит FLUSH_INTERVAL секунд.
+        """
+        self.pending_messages.add(
+            row={
+                'vk_user_id': vk_user_id,
+                'tg_message_id': tg_message_id,
+                'vk_message_id': vk_message_id,
+                'tg_chat_id': tg_chat_id,
+            },
+        )
+
+        if not self.chats.get(vk_user_id=vk_user_id):
+            self.chats.put(
+                chat=Chat(vk_user_id=vk_user_id, tg_chat_id=tg_chat_id),
+            )
 
-            if not chat:
-                chat = Chat(vk_user_id=vk_user_id, tg_chat_id=tg_chat_id)
-                session.add(chat)
-                session.commit()
+        await self.schedule_flush()
 
-            messages = session.query(Message).filter_by(
-                vk_user_id=vk_user_id
-            ).order_by(Message.id).all()
+    async def archive_message(
+            self,
+            vk_user_id,
+            vk_message_id,
+            sender_id,
+            sender_name,
+            date,
+            text,
+            attachments,
+    ):
+        """Отложит запись сообщения в архив вместе со связями сообщений."""
+        if not DbConstant.ARCHIVE_ENABLED.value:
+            return
+
+        self.pending_archive.append({
+            'vk_user_id': vk_user_id,
+            'vk_message_id': vk_message_id,
+            'sender_id': sender_id,
+            'sender_name': sender_name,
+            'date': date,
+            'body': pack_body(text=text, attachments=attachments),
+            'text': search_text(text=text, attachments=attachments),
+        })
+
+        await self.schedule_flush()
+
+    async def schedule_flush(self):
+        pending = len(self.pending_messages) + len(self.pending_archive)
+
+        if pending >= DbConstant.FLUSH_ROWS.value:
+            await self.flush_messages()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        try:
+            await asyncio.sleep(DbConstant.FLUSH_INTERVAL.value)
+        finally:
+            self.flush_task = None
+
+        await self.flush_messages()
+
+    async def flush_messages(self):
+        """Запишет накопленные связи и архив сообщений в одной транзакции."""
+        async with self.flush_lock:
+            rows = self.pending_messages.take()
+            archive_rows = self.pending_archive
+            self.pending_archive = []
+
+            if not rows and not archive_rows:
+                return
+
+            try:
+                async with self.WriteSession() as session:
+                    if rows:
+                        await self.write_messages(session=session, rows=rows)
+                    if archive_rows:
+                        await self.write_archive(
+                            session=session, rows=archive_rows,
+                        )
+
+                    await session.commit()
+
+            except db.exc.SQLAlchemyError as error:
+                logger.error(f'Ошибка записи связей сообщений: {error}')
+
+                self.pending_messages.restore(rows=rows)
+                self.pending_archive[:0] = archive_rows
+                return
+
+            metrics.increment('db_flushed_messages', len(rows))
+            metrics.increment('db_archived_messages', len(archive_rows))
+
+    @staticmethod
+    async def write_messages(session, rows):
+        chats = {
+            row['vk_user_id']: {
+                'vk_user_id': row['vk_user_id'],
+                'tg_chat_id': row['tg_chat_id'],
+            }
+            for row in rows
+        }
+        statement = insert(Message).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=['tg_chat_id', 'tg_message_id'],
+            set_={
+                'vk_user_id': statement.excluded.vk_user_id,
+                'vk_message_id': statement.excluded.vk_message_id,
+            },
+        )
+
+        await session.execute(
+            insert(Chat).values(
+                list(chats.values()),
+            ).on_conflict_do_nothing(index_elements=['vk_user_id'])
+        )
+        await session.execute(statement)
+
+    @staticmethod
+    async def write_archive(session, rows):
+        rows = {
+            (row['vk_user_id'], row['vk_message_id']): row for row in rows
+        }
 
-            if len(messages) >= DbConstant.MAX_MESSAGES_PER_USER.value:
-                oldest_message = messages[0]
-                session.delete(oldest_message)
-                session.commit()
+        if DbConstant.USE_POSTGRES.value:
+            config = db.cast(
+                DbConstant.ARCHIVE_TS_CONFIG.value, postgresql.REGCONFIG,
+            )
+            values = [
+                dict(
+                    {
+                        key: value for key, value in row.items()
+                        if key != 'text'
+                    },
+                    search_vector=db.func.to_tsvector(config, row['text']),
+                )
+                for row in rows.values()
+            ]
 
-            message = Message(
-                vk_user_id=vk_user_id,
-                tg_message_id=tg_message_id,
-                vk_message_id=vk_message_id,
-                tg_chat_id=tg_chat_id,
+            await session.execute(
+                insert(ArchivedMessage).values(values).on_conflict_do_nothing(
+                    index_elements=['vk_user_id', 'vk_message_id'],
+                )
+            )
+            return
+
+        values = [
+            {key: value for key, value in row.items() if key != 'text'}
+            for row in rows.values()
+        ]
+        inserted = await session.execute(
+            insert(ArchivedMessage).values(values).on_conflict_do_nothing(
+                index_elements=['vk_user_id', 'vk_message_id'],
+            ).returning(
+                ArchivedMessage.id,
+                ArchivedMessage.vk_user_id,
+                ArchivedMessage.vk_message_id,
             )
+        )
+        fts_rows = [
+            {
+                'id': archive_id,
+                'text': rows[(vk_user_id, vk_message_id)]['text'],
+            }
+            for archive_id, vk_user_id, vk_message_id in inserted.all()
+        ]
+
+        if fts_rows:
+            await session.execute(
+                db.text(
+                    'INSERT INTO archive_fts (rowid, text) VALUES (:id, :text)'
+                ),
+                fts_rows,
+            )
+
+    async def search_archive(self, query, vk_user_id=None, offset=0, limit=5):
+        """Найдет сообщения архива, упорядоченные по релевантности.
 
-            session.add(message)
-            session.commit()
+        Вернет не больше limit сообщений и признак того, что есть еще.
+        """
+        if DbConstant.USE_POSTGRES.value:
+            ts_query = db.func.websearch_to_tsquery(
+                db.cast(
+                    DbConstant.ARCHIVE_TS_CONFIG.value, postgresql.REGCONFIG,
+                ),
+                query,
+            )
+            rank = db.func.ts_rank(ArchivedMessage.search_vector, ts_query)
+            statement = db.select(ArchivedMessage).where(
+                ArchivedMessage.search_vector.op('@@')(ts_query),
+            ).order_by(rank.desc(), ArchivedMessage.date.desc())
+        else:
+            match = fts_query(query)
+
+            if not match:
+                return [], False
+
+            fts = db.table('archive_fts', db.column('rowid'))
+            statement = db.select(ArchivedMessage).join(
+                fts, fts.c.rowid == ArchivedMessage.id,
+            ).where(
+                db.text('archive_fts MATCH :match').bindparams(match=match),
+            ).order_by(db.text('bm25(archive_fts)'))
 
-    def get_message(
+        if vk_user_id:
+            statement = statement.where(
+                ArchivedMessage.vk_user_id == vk_user_id,
+            )
+
+        async with self.AsyncSession() as session:
+            found = (await session.execute(
+                statement.offset(offset).limit(limit + 1)
+            )).scalars().all()
+
+        return found[:limit], len(found) > limit
+
+    async def get_message(
             self,
             vk_user_id=None,
             tg_message_id=None,
             vk_message_id=None,
             tg_chat_id=None,
     ):
+        message = self.pending_messages.find(
+            vk_user_id=vk_user_id,
+            tg_message_id=tg_message_id,
+            vk_message_id=vk_message_id,
+            tg_chat_id=tg_chat_id,
+        )
+
+        if message:
+            return message
+
         filters = list()
 
         if vk_user_id:
@@ -132,24 +864,122 @@ class Database:
         if tg_chat_id:
             filters.append(Message.tg_chat_id == tg_chat_id)
 
-        with self.Session() as session:
-            if len(filters) == 1:
-                query = session.query(Message).filter(filters[0])
-            elif len(filters) > 1:
-                query = session.query(Message).filter(and_(*filters))
-            else:
-                query = session.query(Message)
+        query = db.select(Message).where(*filters)
 
-            return query.first()
+        async with self.AsyncSession() as session:
+            return (await session.execute(query.limit(1))).scalar()
 
-    def delete_messages(self, vk_user_id):
-        with self.Session() as session:
-            messages = session.query(Message).filter_by(
-                vk_user_id=vk_user_id,
-            ).all()
+    async def delete_messages(self, vk_user_id):
+        self.pending_messages.discard(vk_user_id=vk_user_id)
+
+        async with self.WriteSession() as session:
+            await session.execute(
+                db.delete(Message).where(Message.vk_user_id == vk_user_id)
+            )
+            await session.commit()
+
+    async def prune_messages(self):
+        """Удалит устаревшие связи сообщений.
+
+        Для каждого пользователя остается не больше MAX_MESSAGES_PER_USER
+        последних связей; если задан MESSAGE_MAX_AGE_DAYS, удаляются и связи
+        старше этого срока. Вернет число удаленных строк.
+        """
+        max_messages = DbConstant.MAX_MESSAGES_PER_USER.value
+        max_age_days = DbConstant.MESSAGE_MAX_AGE_DAYS.value
+        deleted = 0
+
+        async with self.WriteSession() as session:
+            overflowed_users = (await session.execute(
+                db.select(Message.vk_user_id)
+                .group_by(Message.vk_user_id)
+                .having(db.func.count() > max_messages)
+            )).scalars().all()
+
+            for vk_user_id in overflowed_users:
+                cutoff_id = (await session.execute(
+                    db.select(Message.id)
+                    .where(Message.vk_user_id == vk_user_id)
+                    .order_by(Message.id.desc())
+                    .offset(max_messages)
+                    .limit(1)
+                )).scalar()
+                deleted += (await session.execute(
+                    db.delete(Message).where(
+                        Message.vk_user_id == vk_user_id,
+                        Message.id <= cutoff_id,
+                    )
+                )).rowcount
+
+            if max_age_days:
+                cutoff_date = datetime.utcnow() - timedelta(days=max_age_days)
+                deleted += (await session.execute(
+                    db.delete(Message).where(Message.created_at < cutoff_date)
+                )).rowcount
+
+            await session.commit()
+
+        return deleted
+
+    async def get_state(self, namespace, key):
+        query = db.select(BotState.value).where(
+            BotState.namespace == namespace,
+            BotState.key == key,
+            BotState.expires_at > datetime.utcnow(),
+        )
+
+        async with self.AsyncSession() as session:
+            return await session.scalar(query)
+
+    async def set_state(self, namespace, key, value, ttl):
+        statement = insert(BotState).values(
+            namespace=namespace,
+            key=key,
+            value=value,
+            expires_at=datetime.utcnow() + timedelta(seconds=ttl),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['namespace', 'key'],
+            set_={
+                'value': statement.excluded.value,
+                'expires_at': statement.excluded.expires_at,
+            },
+        )
+
+        async with self.WriteSession() as session:
+            await session.execute(statement)
+            await session.commit()
+
+    async def delete_state(self, namespace, key):
+        async with self.WriteSession() as session:
+            await session.execute(
+                db.delete(BotState).where(
+                    BotState.namespace == namespace,
+                    BotState.key == key,
+                )
+            )
+            await session.commit()
+
+    async def prune_state(self):
+        """Удалит истекшее состояние бота. Вернет число удаленных строк."""
+        async with self.WriteSession() as session:
+            deleted = (await session.execute(
+                db.delete(BotState).where(
+                    BotState.expires_at <= datetime.utcnow(),
+                )
+            )).rowcount
+            await session.commit()
+
+        return deleted
+
+    async def run_retention(self):
+        """Периодически удаляет устаревшие связи сообщений и состояние."""
+        while True:
+            await asyncio.sleep(DbConstant.PRUNE_INTERVAL.value)
+
+            deleted = await self.prune_messages()
 
-            if messages:
-                for message in messages:
-                    session.delete(message)
+            if deleted:
+                logger.info(f'Удалено устаревших связей сообщений: {deleted}.')
 
-                session.commit()
+            await self.prune_state()
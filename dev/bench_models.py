@@ -0,0 +1,187 @@
+"""Замер стоимости подготовки сообщений: словари против объектов models.
+
+Прежний вариант собирает словарь сообщения, несколько раз проходит по
+вложениям и передает его в рендеринг через **kwargs. Текущий разбирает
+вложения за один проход в объекты со __slots__ и рендерит текст лениво.
+Запросы к Vk не выполняются: данные автора подставляются заранее.
+
+Запуск из корня проекта:
+
+    python dev/bench_models.py --messages 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--messages', type=int, default=20000)
+args = parser.parse_args()
+
+for name, value in {
+    'VK_ID': '0',
+    'VK_ACCESS_TOKEN': 'bench',
+    'TELEGRAM_CHAT_ID': '0',
+    'READ_NOTIFICATION_MODE': '0',
+    'USE_POSTGRES': 'False',
+    'LOG_LEVEL': 'WARNING',
+}.items():
+    os.environ.setdefault(name, value)
+
+import vkapi  # noqa: E402
+
+SENDER_INFO = {
+    'type': 'user',
+    'user_id': 1,
+    'first_name': 'Павел',
+    'last_name': 'Дуров',
+    'avatar': 'https://sun9-1.userapi.com/avatar.jpg',
+}
+
+
+def message_item(number):
+    return {
+        'id': number,
+        'from_id': 1,
+        'text': f'Сообщение номер {number}, в котором есть немного текста.',
+        'attachments': [
+            {
+                'type': 'photo',
+                'photo': {
+                    'sizes': [
+                        {'height': 130, 'width': 97, 'url': 'https://a/s'},
+                        {'height': 604, 'width': 453, 'url': 'https://a/m'},
+                        {'height': 1280, 'width': 960, 'url': 'https://a/x'},
+                    ],
+                },
+            },
+            {
+                'type': 'doc',
+                'doc': {
+                    'title': 'отчет',
+                    'ext': 'pdf',
+                    'url': 'https://vk.com/doc1_2',
+                    'size': 1024,
+                },
+            },
+        ],
+    }
+
+
+class BenchVkApi(vkapi.VkApi):
+    def get_user_or_group_info(self, user_or_group_id, name_case='nom'):
+        return SENDER_INFO
+
+
+async def legacy_get_message(api, item):
+    message = dict()
+    message['message_id'] = item['id']
+    message.update(api.get_user_or_group_info(user_or_group_id=1))
+    message['text'] = item['text']
+
+    images = list()
+    for attachment in item['attachments']:
+        if attachment['type'] == 'photo':
+            images.append(api.largest_image(attachment['photo'].get('sizes')))
+    message['images'] = images
+
+    # Прежний get_video_url_and_frame вызывался и для сообщений без видео.
+    await api.cache_videos(
+        videos_data=api.video_attachments(item['attachments']),
+    )
+    await asyncio.gather()
+    message['videos'] = {'video_urls': [], 'video_frames': []}
+    message['files'] = [
+        api.get_file(attachment=attachment)
+        for attachment in item['attachments']
+        if attachment['type'] in ('doc', 'audio_message', 'audio')
+    ]
+
+    return message
+
+
+def legacy_get_signature(**kwargs):
+    name = f'{kwargs.get("first_name")} {kwargs.get("last_name")}'
+    url = f'https://vk.com/im?sel={kwargs.get("user_id")}'
+
+    return f'<a href="{url}"><b>{name}</b></a>'
+
+
+def legacy_render_text(**kwargs):
+    text = f'{legacy_get_signature(**kwargs)}\n'
+
+    if kwargs.get('text'):
+        text += f'{kwargs.get("text")}\n'
+
+    videos = kwargs.get('videos', {}).get('video_urls')
+
+    if videos:
+        text += '\n<b>Видео:</b>\n' + '\n\n'.join(videos)
+
+    return text
+
+
+async def legacy(api, items):
+    messages = list()
+
+    for item in items:
+        message = await legacy_get_message(api=api, item=item)
+        message['text'] = legacy_render_text(**message)
+        messages.append(message)
+
+    return messages
+
+
+async def current(api, items):
+    messages = list()
+
+    for item in items:
+        message = await api.get_message(
+            message_data={'response': {'items': [item]}},
+        )
+        message.rendered_text
+        messages.append(message)
+
+    return messages
+
+
+def measure(build, api, items):
+    started = time.perf_counter()
+    asyncio.run(build(api=api, items=items))
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    messages = asyncio.run(build(api=api, items=items))
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+
+    return elapsed / len(items), retained / len(items), peak / len(items)
+
+
+def main():
+    api = BenchVkApi()
+    items = [message_item(number) for number in range(args.messages)]
+
+    before = measure(build=legacy, api=api, items=items)
+    after = measure(build=current, api=api, items=items)
+
+    print('                          словари       models')
+    print(
+        f'Время на сообщение, мкс {before[0] * 1e6:10.1f} '
+        f'{after[0] * 1e6:12.1f}'
+    )
+    print(
+        f'Память на сообщение, Б  {before[1]:10.0f} {after[1]:12.0f}'
+    )
+    print(
+        f'Пик на сообщение, Б     {before[2]:10.0f} {after[2]:12.0f}'
+    )
+
+
+if __name__ == '__main__':
+    main()
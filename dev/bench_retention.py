@@ -0,0 +1,111 @@
+"""Замер скорости добавления связей сообщений.
+
+Сравнивает прежний add_message (чтение всей истории пользователя и удаление
+самой старой связи при каждой вставке) с текущим (отложенная запись пачками,
+очистка фоновой задачей prune_messages).
+
+Запуск из корня проекта:
+
+    python dev/bench_retention.py --inserts 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--inserts', type=int, default=5000)
+parser.add_argument('--users', type=int, default=20)
+args = parser.parse_args()
+
+for name, value in {
+    'VK_ID': '0',
+    'VK_ACCESS_TOKEN': 'bench',
+    'TELEGRAM_CHAT_ID': '0',
+    'READ_NOTIFICATION_MODE': '0',
+    'USE_POSTGRES': 'False',
+    'LOG_LEVEL': 'WARNING',
+}.items():
+    os.environ.setdefault(name, value)
+
+import db  # noqa: E402
+from constants import DbConstant  # noqa: E402
+
+
+def legacy_add_message(
+        database,
+        vk_user_id,
+        tg_message_id,
+        vk_message_id,
+        tg_chat_id,
+):
+    with database.Session() as session:
+        chat = session.query(db.Chat).filter_by(vk_user_id=vk_user_id).first()
+
+        if not chat:
+            chat = db.Chat(vk_user_id=vk_user_id, tg_chat_id=tg_chat_id)
+            session.add(chat)
+            session.commit()
+
+        messages = session.query(db.Message).filter_by(
+            vk_user_id=vk_user_id
+        ).order_by(db.Message.id).all()
+
+        if len(messages) >= DbConstant.MAX_MESSAGES_PER_USER.value:
+            session.delete(messages[0])
+            session.commit()
+
+        session.add(db.Message(
+            vk_user_id=vk_user_id,
+            tg_message_id=tg_message_id,
+            vk_message_id=vk_message_id,
+            tg_chat_id=tg_chat_id,
+        ))
+        session.commit()
+
+
+async def run(add_message, flush=None):
+    started = time.perf_counter()
+
+    for number in range(args.inserts):
+        await add_message(
+            vk_user_id=number % args.users + 1,
+            tg_message_id=number,
+            vk_message_id=number,
+            tg_chat_id=-(number % args.users + 1),
+        )
+
+    if flush:
+        await flush()
+
+    return args.inserts / (time.perf_counter() - started)
+
+
+async def main():
+    legacy = db.Database(url=f'sqlite:///{tempfile.mkdtemp()}/legacy.sqlite3')
+    async def legacy_add(**kwargs):
+        legacy_add_message(legacy, **kwargs)
+
+    legacy_rate = await run(add_message=legacy_add)
+
+    current = db.Database(url=f'sqlite:///{tempfile.mkdtemp()}/new.sqlite3')
+    current_rate = await run(
+        add_message=current.add_message,
+        flush=current.flush_messages,
+    )
+
+    started = time.perf_counter()
+    deleted = await current.prune_messages()
+    prune_time = time.perf_counter() - started
+
+    print(f'Прежняя вставка: {legacy_rate:8.0f} связей/с')
+    print(f'Текущая вставка: {current_rate:8.0f} связей/с')
+    print(f'prune_messages: удалено {deleted} за {prune_time * 1000:.1f} мс')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
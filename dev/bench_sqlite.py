@@ -0,0 +1,124 @@
+"""Замер записи и поиска связей сообщений в SQLite.
+
+Сравнивает настройки SQLite по умолчанию (журнал отката, synchronous=FULL,
+общий пул для чтения и записи) с профилем SQLITE_PRAGMAS (WAL,
+synchronous=NORMAL, кэш, mmap и отдельное соединение для записи).
+
+Запуск из корня проекта:
+
+    python dev/bench_sqlite.py --inserts 2000 --lookups 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--inserts', type=int, default=2000)
+parser.add_argument('--lookups', type=int, default=5000)
+parser.add_argument('--users', type=int, default=100)
+parser.add_argument('--readers', type=int, default=8)
+args = parser.parse_args()
+
+for name, value in {
+    'VK_ID': '0',
+    'VK_ACCESS_TOKEN': 'bench',
+    'TELEGRAM_CHAT_ID': '0',
+    'READ_NOTIFICATION_MODE': '0',
+    'USE_POSTGRES': 'False',
+    'LOG_LEVEL': 'WARNING',
+    'MAX_MESSAGES_PER_USER': '1000000',
+}.items():
+    os.environ.setdefault(name, value)
+
+import db  # noqa: E402
+
+
+async def insert(database, offset, flush_every):
+    started = time.perf_counter()
+
+    for number in range(offset, offset + args.inserts):
+        await database.add_message(
+            vk_user_id=number % args.users + 1,
+            tg_message_id=number,
+            vk_message_id=number,
+            tg_chat_id=-(number % args.users + 1),
+        )
+
+        if number % flush_every == 0:
+            await database.flush_messages()
+
+    await database.flush_messages()
+
+    return args.inserts / (time.perf_counter() - started)
+
+
+async def lookup(database):
+    numbers = [
+        random.randrange(args.inserts * 2) for _ in range(args.lookups)
+    ]
+    chunk = len(numbers) // args.readers + 1
+
+    async def reader(part):
+        for number in part:
+            await database.get_message(
+                tg_chat_id=-(number % args.users + 1),
+                tg_message_id=number,
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        reader(numbers[offset:offset + chunk])
+        for offset in range(0, len(numbers), chunk)
+    ))
+
+    return args.lookups / (time.perf_counter() - started)
+
+
+async def run(tuned_sqlite):
+    database = db.Database(
+        url=f'sqlite:///{tempfile.mkdtemp()}/bench.sqlite3',
+        tuned_sqlite=tuned_sqlite,
+    )
+
+    single = await insert(database=database, offset=0, flush_every=1)
+    batched = await insert(
+        database=database, offset=args.inserts, flush_every=args.inserts,
+    )
+    lookups = await lookup(database=database)
+    mixed_inserts, mixed_lookups = await asyncio.gather(
+        insert(database=database, offset=args.inserts * 2, flush_every=1),
+        lookup(database=database),
+    )
+
+    await database.close()
+
+    return single, batched, lookups, mixed_inserts, mixed_lookups
+
+
+async def main():
+    default = await run(tuned_sqlite=False)
+    tuned = await run(tuned_sqlite=True)
+
+    print('                          по умолчанию     WAL-профиль')
+    for title, before, after in zip(
+            (
+                'Запись по одной, связей/с',
+                'Запись пачками, связей/с ',
+                'Поиск, запросов/с        ',
+                'Запись во время поиска   ',
+                'Поиск во время записи    ',
+            ),
+            default,
+            tuned,
+    ):
+        print(f'{title} {before:12.0f} {after:15.0f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
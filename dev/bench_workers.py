@@ -0,0 +1,178 @@
+"""Замер пропускной способности обработки событий Vk процессами-обработчиками.
+
+Каждое событие проходит разбор сообщения в объекты models, рендеринг
+текста и подготовку изображения через PIL - ту часть работы
+processing_updates, которая нагружает процессор. Запросы к Vk и Telegram
+не выполняются. События распределяются по процессам через ShardPool так же,
+как в режиме CONNECTOR_WORKERS, и сравниваются с обработкой в одном процессе.
+
+Запуск из корня проекта:
+
+    python dev/bench_workers.py --events 2000 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import functools
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--events', type=int, default=2000)
+parser.add_argument('--users', type=int, default=100)
+parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+args = parser.parse_args()
+
+for name, value in {
+    'VK_ID': '0',
+    'VK_ACCESS_TOKEN': 'bench',
+    'TELEGRAM_CHAT_ID': '0',
+    'READ_NOTIFICATION_MODE': '0',
+    'USE_POSTGRES': 'False',
+    'LOG_LEVEL': 'WARNING',
+}.items():
+    os.environ.setdefault(name, value)
+
+from PIL import Image  # noqa: E402
+
+import vkapi  # noqa: E402
+import workers  # noqa: E402
+from constants import VkEventKind  # noqa: E402
+from models import VkEvent  # noqa: E402
+
+SENDER_INFO = {
+    'type': 'user',
+    'user_id': 1,
+    'first_name': 'Павел',
+    'last_name': 'Дуров',
+    'avatar': 'https://sun9-1.userapi.com/avatar.jpg',
+}
+
+
+class BenchVkApi(vkapi.VkApi):
+    def get_user_or_group_info(self, user_or_group_id, name_case='nom'):
+        return SENDER_INFO
+
+
+def image_bytes():
+    buffer = io.BytesIO()
+    Image.effect_noise((512, 512), 64).convert('RGB').save(buffer, 'PNG')
+
+    return buffer.getvalue()
+
+
+IMAGE = image_bytes()
+
+
+def event(number):
+    return VkEvent(
+        kind=VkEventKind.NEW_MESSAGE,
+        peer_id=number % args.users + 1,
+        message_id=number,
+    )
+
+
+def message_item(number):
+    return {
+        'id': number,
+        'from_id': number,
+        'text': f'Сообщение номер {number}, в котором есть немного текста.',
+        'attachments': [
+            {
+                'type': 'photo',
+                'photo': {
+                    'sizes': [
+                        {'height': 604, 'width': 453, 'url': 'https://a/m'},
+                        {'height': 1280, 'width': 960, 'url': 'https://a/x'},
+                    ],
+                },
+            },
+        ],
+    }
+
+
+async def process(api, updates):
+    for element in updates:
+        message = await api.get_message(
+            message_data={
+                'response': {'items': [message_item(element.message_id)]},
+            },
+        )
+        message.rendered_text
+
+        image = Image.open(io.BytesIO(IMAGE))
+        image.thumbnail((128, 128))
+        image.save(io.BytesIO(), 'JPEG', quality=85)
+
+
+def run_worker(ready, shard, events):
+    api = BenchVkApi()
+    ready.put(shard)
+
+    async def consume():
+        while True:
+            item = await asyncio.to_thread(events.get)
+
+            if item is None:
+                break
+
+            _, updates = item
+            await process(api=api, updates=updates)
+
+    asyncio.run(consume())
+
+
+def in_process(updates):
+    started = time.perf_counter()
+    asyncio.run(process(api=BenchVkApi(), updates=updates))
+
+    return len(updates) / (time.perf_counter() - started)
+
+
+def sharded(updates, count):
+    ready = workers.multiprocessing.get_context('spawn').Queue()
+    pool = workers.ShardPool(
+        workers=count,
+        target=functools.partial(run_worker, ready),
+    )
+    pool.start()
+
+    for _ in range(count):
+        ready.get()
+
+    started = time.perf_counter()
+
+    async def dispatch():
+        # Как LongPoll: пачки по 20 событий.
+        for offset in range(0, len(updates), 20):
+            await pool.dispatch(
+                tenant_id='default', updates=updates[offset:offset + 20],
+            )
+
+    asyncio.run(dispatch())
+    pool.stop(timeout=600)
+
+    return len(updates) / (time.perf_counter() - started)
+
+
+def main():
+    updates = [event(number) for number in range(args.events)]
+
+    baseline = in_process(updates=updates)
+
+    print(f'Ядер процессора: {os.cpu_count()}')
+    print(f'В одном процессе      {baseline:10.0f} событий/с')
+
+    for count in args.workers:
+        throughput = sharded(updates=updates, count=count)
+        print(
+            f'Процессов: {count:<11} {throughput:10.0f} событий/с '
+            f'(x{throughput / baseline:.2f})'
+        )
+
+
+if __name__ == '__main__':
+    main()
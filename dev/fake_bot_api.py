@@ -0,0 +1,156 @@
+"""Поддельный Bot API для проверки режима webhook без доступа к Telegram.
+
+Сервер отвечает на основные методы Bot API, запоминает адрес вебхука и
+секретный токен из setWebhook и выводит в консоль все вызовы бота.
+POST-запрос на /_push с телом обновления Telegram перешлет его на
+зарегистрированный вебхук с правильным заголовком секретного токена,
+а если вебхука нет, отдаст обновление боту в ответ на getUpdates.
+
+Запуск из корня проекта:
+
+    python dev/fake_bot_api.py --port 8081
+
+    TELEGRAM_BOT_API_URL=http://127.0.0.1:8081 \\
+    TELEGRAM_UPDATE_MODE=webhook \\
+    TELEGRAM_WEBHOOK_URL=http://127.0.0.1:8080/tg \\
+    python connector.py
+
+    curl http://127.0.0.1:8081/_push -d '{"message": {"text": "/help"}}'
+
+В отправленном обновлении можно указать только отличающиеся поля:
+недостающие update_id, message_id, date, chat и from будут добавлены.
+Бот выбирается параметром token (/_push?token=...), по умолчанию --token.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=8081)
+parser.add_argument('--chat-id', type=int, default=1)
+parser.add_argument('--token', default='1:x')
+args = parser.parse_args()
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+BOT_USER = {
+    'id': 1000,
+    'is_bot': True,
+    'first_name': 'vk-tg connector',
+    'username': 'fake_connector_bot',
+}
+
+webhooks = defaultdict(lambda: {'url': None, 'secret_token': ''})
+pending_updates = defaultdict(list)
+update_ids = itertools.count(1)
+message_ids = itertools.count(1)
+
+
+def chat():
+    return {'id': args.chat_id, 'type': 'private', 'first_name': 'Тест'}
+
+
+def sent_message(params):
+    return {
+        'message_id': next(message_ids),
+        'date': int(time.time()),
+        'chat': {'id': int(params.get('chat_id', args.chat_id)),
+                 'type': 'private'},
+        'from': BOT_USER,
+        'text': params.get('text', ''),
+    }
+
+
+async def read_params(request):
+    if request.content_type == 'application/json':
+        return await request.json()
+
+    return dict(await request.post())
+
+
+async def bot_method(request):
+    token = request.match_info['token']
+    method = request.match_info['method']
+    params = await read_params(request)
+    webhook = webhooks[token]
+    updates = pending_updates[token]
+
+    print(
+        f'{token} {method}: '
+        f'{json.dumps(params, ensure_ascii=False, default=str)}'
+    )
+
+    if method == 'getMe':
+        result = BOT_USER
+    elif method == 'setWebhook':
+        webhook['url'] = params.get('url')
+        webhook['secret_token'] = params.get('secret_token', '')
+        result = True
+    elif method == 'deleteWebhook':
+        webhook['url'] = None
+        result = True
+    elif method == 'getUpdates':
+        if not updates:
+            await asyncio.sleep(min(float(params.get('timeout', 0)), 1))
+
+        result = updates.copy()
+        updates.clear()
+    elif method in ('sendMessage', 'editMessageText'):
+        result = sent_message(params)
+    else:
+        result = True
+
+    return web.json_response({'ok': True, 'result': result})
+
+
+async def push(request):
+    token = request.query.get('token', args.token)
+    webhook = webhooks[token]
+    update = await request.json()
+    update.setdefault('update_id', next(update_ids))
+
+    message = update.get('message')
+    if message is not None:
+        message.setdefault('message_id', next(message_ids))
+        message.setdefault('date', int(time.time()))
+        message.setdefault('chat', chat())
+        message.setdefault('from', {'id': args.chat_id, 'is_bot': False,
+                                    'first_name': 'Тест'})
+        if message.get('text', '').startswith('/'):
+            command = message['text'].split()[0]
+            message.setdefault('entities', [{
+                'type': 'bot_command', 'offset': 0, 'length': len(command),
+            }])
+
+    if not webhook['url']:
+        pending_updates[token].append(update)
+
+        return web.json_response({'ok': True, 'status': 'queued'})
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+                webhook['url'],
+                json=update,
+                headers={SECRET_HEADER: webhook['secret_token']},
+        ) as response:
+            status = response.status
+
+    return web.json_response({'ok': status == 200, 'status': status})
+
+
+def main():
+    app = web.Application()
+    app.router.add_post('/_push', push)
+    app.router.add_post('/bot{token}/{method}', bot_method)
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -28,3 +28,19 @@ class NoInterlocutorError(Exception):
 
 class NoMessageForReply(Exception):
     pass
+
+
+class MediaTooLargeError(Exception):
+    pass
+
+
+class MediaTransferError(Exception):
+    pass
+
+
+class LeadershipLostError(Exception):
+    pass
+
+
+class WorkerError(Exception):
+    pass
@@ -1,13 +1,10 @@
-import urllib.request
 from io import BytesIO
 
 from PIL import Image
 
 
-def render(base_image_url):
-    response = urllib.request.urlopen(base_image_url)
-    img_data = response.read()
-    base_image = Image.open(BytesIO(img_data))
+def render(base_image):
+    base_image = Image.open(BytesIO(base_image))
 
     overlay = Image.open("images/play.png")
 
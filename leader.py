@@ -0,0 +1,231 @@
+import asyncio
+import os
+import socket
+from typing import Optional
+
+import sqlalchemy as db
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from constants import ConnectorConstant
+from db import Database, LongPollState, insert
+from exceptions import LeadershipLostError
+from logger import run_logger
+from metrics import metrics
+
+logger = run_logger('leader')
+
+TRY_LOCK = db.text('SELECT pg_try_advisory_lock(:namespace, :key)')
+UNLOCK = db.text('SELECT pg_advisory_unlock(:namespace, :key)')
+# Завершит сеанс лидера, который держит блокировку, но перестал
+# продлевать аренду (процесс завис или потерял сеть).
+TERMINATE_STALE_LEADER = (
+    """
+    SELECT pg_terminate_backend(locks.pid)
+    FROM pg_locks AS locks
+    JOIN {table} AS state ON state.vk_id = :vk_id
+    WHERE locks.locktype = 'advisory'
+      AND locks.classid = :namespace
+      AND locks.objid = :key
+      AND locks.objsubid = 2
+      AND locks.granted
+      AND state.heartbeat_at < now() - make_interval(secs => :lease)
+    """
+)
+
+
+class LeaderElection:
+    """Выбор единственного читателя LongPoll среди нескольких реплик.
+
+    В PostgreSQL лидером становится реплика, получившая рекомендательную
+    блокировку pg_try_advisory_lock. Блокировка живет, пока открыто
+    выделенное соединение, поэтому при падении лидера она освобождается
+    сама. Лидер раз в секунду продлевает аренду в long_poll_state; реплика,
+    чья аренда истекла, принудительно отключается. С каждым новым лидером
+    увеличивается term: запись ts с чужим term отклоняется (fencing).
+
+    В SQLite реплика одна, и лидером сразу становится текущий процесс.
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.vk_id = database.tenant.vk_id
+        self.key = self.vk_id % 2 ** 31
+        self.namespace = ConnectorConstant.LEADER_LOCK_NAMESPACE.value
+        self.instance = f'{socket.gethostname()}:{os.getpid()}'
+        self.use_lock = database.async_engine.dialect.name == 'postgresql'
+        self.connection: Optional[AsyncConnection] = None
+        self.term: Optional[int] = None
+
+        table = LongPollState.__tablename__
+        self.terminate_stale_leader = db.text(
+            TERMINATE_STALE_LEADER.format(
+                table=f'{database.schema}.{table}' if database.schema
+                else table,
+            )
+        )
+
+    @property
+    def is_leader(self) -> bool:
+        return self.term is not None
+
+    async def acquire(self) -> None:
+        """Дождется, пока текущая реплика станет лидером."""
+        logger.info(f'Реплика {self.instance} ожидает лидерства.')
+
+        while not await self.try_acquire():
+            await asyncio.sleep(ConnectorConstant.LEADER_RETRY_INTERVAL.value)
+
+        metrics.increment('leader_elected')
+
+        logger.info(
+            f'Реплика {self.instance} стала лидером (term {self.term}).'
+        )
+
+    async def try_acquire(self) -> bool:
+        try:
+            if self.use_lock and not await self.lock():
+                return False
+
+            await self.start_term()
+
+        except db.exc.DBAPIError as error:
+            logger.error(f'Ошибка при выборе лидера: {error}')
+            await self.release()
+
+            return False
+
+        return True
+
+    async def lock(self) -> bool:
+        if self.connection is None:
+            self.connection = await self.db.async_engine.connect()
+            # Блокировка уровня сеанса: транзакция не должна ее держать.
+            await self.connection.execution_options(
+                isolation_level='AUTOCOMMIT',
+            )
+
+        params = {'namespace': self.namespace, 'key': self.key}
+        await self.connection.execute(
+            self.terminate_stale_leader,
+            {
+                **params,
+                'vk_id': self.vk_id,
+                'lease': ConnectorConstant.LEADER_LEASE_TIMEOUT.value,
+            },
+        )
+
+        return await self.connection.scalar(TRY_LOCK, params)
+
+    async def start_term(self) -> None:
+        """Увеличит term и запишет себя лидером."""
+        table = LongPollState.__table__
+        statement = insert(table).values(
+            vk_id=self.vk_id,
+            term=1,
+            leader=self.instance,
+            heartbeat_at=db.func.now(),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.vk_id],
+            set_={
+                'term': table.c.term + 1,
+                'leader': statement.excluded.leader,
+                'heartbeat_at': statement.excluded.heartbeat_at,
+            },
+        ).returning(table.c.term)
+
+        async with self.db.WriteSession.begin() as session:
+            self.term = (await session.execute(statement)).scalar_one()
+
+    async def update_state(self, **values) -> None:
+        """Обновит состояние, если term все еще принадлежит этой реплике."""
+        if not self.is_leader:
+            raise LeadershipLostError('Реплика не является лидером.')
+
+        table = LongPollState.__table__
+        statement = (
+            db.update(table)
+            .where(table.c.vk_id == self.vk_id, table.c.term == self.term)
+            .values(**values)
+        )
+
+        async with self.db.WriteSession.begin() as session:
+            result = await session.execute(statement)
+
+        if result.rowcount == 0:
+            self.term = None
+
+            raise LeadershipLostError(
+                'Лидерство перешло к другой реплике.'
+            )
+
+    async def confirm(self) -> None:
+        """Проверит перед пересылкой пачки, что лидер не сменился."""
+        await self.update_state(heartbeat_at=db.func.now())
+
+    async def save_ts(self, ts: int) -> None:
+        await self.update_state(ts=ts)
+
+    async def load_ts(self) -> Optional[int]:
+        table = LongPollState.__table__
+
+        async with self.db.AsyncSession() as session:
+            return await session.scalar(
+                db.select(table.c.ts).where(table.c.vk_id == self.vk_id)
+            )
+
+    async def heartbeat(self) -> None:
+        """Продлевает аренду, пока реплика остается лидером.
+
+        Завершается, когда лидерство потеряно: соединение с блокировкой
+        разорвано или term сменился.
+        """
+        interval = ConnectorConstant.LEADER_HEARTBEAT_INTERVAL.value
+
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                if self.use_lock:
+                    await asyncio.wait_for(
+                        self.connection.execute(db.text('SELECT 1')),
+                        timeout=interval,
+                    )
+
+                await asyncio.wait_for(self.confirm(), timeout=interval * 2)
+
+            except LeadershipLostError as error:
+                logger.warning(str(error))
+                break
+
+            except (db.exc.DBAPIError, asyncio.TimeoutError) as error:
+                logger.warning(f'Аренда лидера не продлена: {error}')
+                break
+
+        await self.release()
+
+    async def release(self) -> None:
+        if self.is_leader:
+            logger.info(f'Реплика {self.instance} больше не лидер.')
+            metrics.increment('leader_lost')
+
+        self.term = None
+
+        if self.connection is not None:
+            try:
+                await self.connection.execute(
+                    UNLOCK, {'namespace': self.namespace, 'key': self.key},
+                )
+            except db.exc.DBAPIError:
+                pass
+
+        await self.close_connection()
+
+    async def close_connection(self) -> None:
+        if self.connection is not None:
+            try:
+                await self.connection.close()
+            except db.exc.DBAPIError:
+                pass
+
+            self.connection = None
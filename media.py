@@ -0,0 +1,342 @@
+import asyncio
+import secrets
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from constants import MediaConstant
+from exceptions import MediaTooLargeError, MediaTransferError
+from logger import run_logger
+from metrics import metrics
+
+logger = run_logger('media')
+
+
+class ByteBudget:
+    """Общий лимит байтов, одновременно находящихся в передаче.
+
+    Новая передача ждет, пока в бюджете не освободится место под ее
+    начальный резерв. Уже идущая передача увеличивает резерв без
+    ожидания: иначе две передачи, ждущие друг друга, остановились бы
+    навсегда. Превышение лимита задерживает только новые передачи.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        """Дождется свободного места в бюджете и займет его на время работы."""
+        reservation = BudgetReservation(
+            budget=self, size=min(size, self.limit),
+        )
+
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight + reservation.size <= self.limit
+            )
+            self.in_flight += reservation.size
+            metrics.gauge('media_bytes_in_flight', self.in_flight)
+
+        try:
+            yield reservation
+        finally:
+            async with self._condition:
+                self.in_flight -= reservation.size
+                metrics.gauge('media_bytes_in_flight', self.in_flight)
+                self._condition.notify_all()
+
+
+class BudgetReservation:
+    """Место, занятое одной передачей в ByteBudget."""
+
+    def __init__(self, budget: ByteBudget, size: int):
+        self.budget = budget
+        self.size = size
+
+    def grow(self, size: int) -> None:
+        """Увеличит резерв до size байт, не дожидаясь свободного места."""
+        if size <= self.size:
+            return
+
+        self.budget.in_flight += size - self.size
+        self.size = size
+        metrics.gauge('media_bytes_in_flight', self.budget.in_flight)
+
+
+class MediaDownloader:
+    """Общий загрузчик медиа с пулом соединений и ограничениями.
+
+    Число одновременных запросов к одному хосту и суммарный объем
+    загружаемых данных ограничены, поэтому всплеск сообщений с медиа
+    не приводит к неконтролируемому росту памяти.
+    """
+
+    def __init__(self):
+        self.budget = ByteBudget(
+            limit=MediaConstant.MAX_BYTES_IN_FLIGHT.value,
+        )
+        self.host_limits = defaultdict(
+            lambda: asyncio.Semaphore(
+                MediaConstant.PER_HOST_CONCURRENCY.value,
+            )
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(
+                    MediaConstant.TRANSFER_TIMEOUT.value,
+                    connect=MediaConstant.CONNECT_TIMEOUT.value,
+                ),
+                limits=httpx.Limits(
+                    max_connections=MediaConstant.MAX_CONNECTIONS.value,
+                    max_keepalive_connections=(
+                        MediaConstant.MAX_CONNECTIONS.value
+                    ),
+                ),
+                follow_redirects=True,
+            )
+
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def stream(self, url: str, size: Optional[int] = None):
+        """Откроет загрузку файла и вернет поток его частей.
+
+        Место в бюджете занимается до подключения: по размеру из
+        метаданных файла, а если он неизвестен - небольшой начальный резерв,
+        который растет до Content-Length или по мере чтения. Файл целиком
+        нигде не хранится, части передаются по мере чтения.
+        """
+        max_size = MediaConstant.MAX_TRANSFER_SIZE.value
+        host = urlparse(url).hostname
+
+        if size and size > max_size:
+            raise MediaTooLargeError(
+                f'размер файла ({size} байт) превышает лимит '
+                f'{max_size} байт.'
+            )
+
+        async with AsyncExitStack() as stack:
+            reservation = await stack.enter_async_context(
+                self.budget.reserve(
+                    size=size or MediaConstant.INITIAL_RESERVE.value,
+                )
+            )
+            await stack.enter_async_context(self.host_limits[host])
+
+            response = await stack.enter_async_context(
+                self.client.stream('GET', url)
+            )
+
+            if response.status_code != 200:
+                metrics.increment('media_download_errors')
+                raise MediaTransferError(
+                    f'сервер вернул статус {response.status_code} '
+                    f'для {url}.'
+                )
+
+            media_stream = MediaStream(
+                url=url, response=response, reservation=reservation,
+            )
+
+            if (media_stream.length or 0) > max_size:
+                raise MediaTooLargeError(
+                    f'размер файла ({media_stream.length} байт) превышает '
+                    f'лимит {max_size} байт.'
+                )
+
+            reservation.grow(size=media_stream.length or 0)
+
+            yield media_stream
+
+    async def fetch(self, url: str) -> bytes:
+        """Скачает небольшой файл (изображение, стикер) целиком."""
+        async with self.stream(url=url) as media_stream:
+            return b''.join([chunk async for chunk in media_stream.chunks()])
+
+
+class MediaStream:
+    """Части скачиваемого файла с контролем размера и метриками."""
+
+    def __init__(
+            self,
+            url: str,
+            response: httpx.Response,
+            reservation: BudgetReservation,
+    ):
+        self.url = url
+        self.response = response
+        self.reservation = reservation
+        self.received = 0
+        self.started = time.monotonic()
+
+        # Размер известен заранее, только если тело не сжато: httpx отдает
+        # уже распакованные части.
+        content_length = response.headers.get('Content-Length')
+        encoding = response.headers.get('Content-Encoding', 'identity')
+        self.length = (
+            int(content_length)
+            if content_length and encoding == 'identity' else None
+        )
+
+    async def chunks(self):
+        max_size = MediaConstant.MAX_TRANSFER_SIZE.value
+
+        async for chunk in self.response.aiter_bytes(
+                MediaConstant.CHUNK_SIZE.value
+        ):
+            self.received += len(chunk)
+
+            if self.received > max_size:
+                raise MediaTooLargeError(
+                    f'размер файла превышает лимит {max_size} байт.'
+                )
+
+            self.reservation.grow(size=self.received)
+
+            yield chunk
+
+        metrics.observe(
+            'media_download_latency', time.monotonic() - self.started,
+        )
+        metrics.increment('media_downloaded_bytes', self.received)
+
+        logger.debug(f'Файл {self.url} получен ({self.received} байт).')
+
+
+def form_field(
+        boundary: str,
+        name: str,
+        file_name: Optional[str] = None,
+) -> bytes:
+    """Заголовок поля multipart/form-data."""
+    disposition = f'form-data; name="{quote_header(name)}"'
+    content_type = ''
+
+    if file_name is not None:
+        disposition += f'; filename="{quote_header(file_name)}"'
+        content_type = 'Content-Type: application/octet-stream\r\n'
+
+    return (
+        f'--{boundary}\r\nContent-Disposition: {disposition}\r\n'
+        f'{content_type}\r\n'
+    ).encode()
+
+
+def quote_header(value: str) -> str:
+    """Экранирует кавычки и переводы строк, как это делают браузеры."""
+    return (
+        value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+    )
+
+
+downloader = MediaDownloader()
+
+
+class MediaStreamer:
+    """Потоковая передача файлов между Vk и Telegram."""
+
+    def __init__(self, media_downloader: MediaDownloader = downloader):
+        self.downloader = media_downloader
+
+    async def upload(
+            self,
+            source_url: str,
+            target_url: str,
+            field: str,
+            file_name: str,
+            size: Optional[int] = None,
+            data: Optional[dict] = None,
+    ) -> dict:
+        """Перекачает файл с source_url на target_url частями.
+
+        Тело multipart/form-data собирается на лету: каждая прочитанная
+        часть файла сразу уходит получателю. Вернет ответ сервера,
+        принявшего файл.
+        """
+        boundary = secrets.token_hex(16)
+        head = b''.join(
+            form_field(boundary=boundary, name=name) + f'{value}\r\n'.encode()
+            for name, value in (data or {}).items()
+        ) + form_field(boundary=boundary, name=field, file_name=file_name)
+        tail = f'\r\n--{boundary}--\r\n'.encode()
+
+        async with self.downloader.stream(
+                url=source_url, size=size,
+        ) as media_stream:
+            async def body():
+                yield head
+
+                async for chunk in media_stream.chunks():
+                    yield chunk
+
+                yield tail
+
+            headers = {
+                'Content-Type': f'multipart/form-data; boundary={boundary}',
+            }
+
+            # Без известной длины тело уйдет с chunked transfer encoding.
+            if media_stream.length is not None:
+                headers['Content-Length'] = str(
+                    len(head) + media_stream.length + len(tail)
+                )
+
+            response = await self.downloader.client.post(
+                url=target_url,
+                content=body(),
+                headers=headers,
+            )
+
+        return response.json()
+
+    async def send_to_telegram(
+            self,
+            base_url: str,
+            kind: str,
+            chat_id: int,
+            url: str,
+            file_name: str,
+            size: Optional[int] = None,
+            data: Optional[dict] = None,
+    ) -> int:
+        """Перешлет файл из CDN в Telegram, не загружая его целиком в память.
+
+        Вернет id отправленного сообщения.
+        """
+        method, field = MediaConstant.TG_UPLOAD_METHODS.value[kind]
+        form = {'chat_id': chat_id}
+        form.update(
+            {key: value for key, value in (data or {}).items() if value}
+        )
+
+        result = await self.upload(
+            source_url=url,
+            target_url=f'{base_url}/{method}',
+            field=field,
+            file_name=file_name,
+            size=size,
+            data=form,
+        )
+
+        if not result.get('ok'):
+            raise MediaTransferError(
+                f'Telegram отклонил {method}: {result.get("description")}'
+            )
+
+        return result['result']['message_id']
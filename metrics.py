@@ -0,0 +1,117 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from statistics import quantiles
+
+from constants import MetricsConstant
+from logger import run_logger
+
+logger = run_logger('metrics')
+
+
+class LatencyStat:
+    """Статистика задержек по скользящему окну последних замеров."""
+
+    def __init__(self, window: int = MetricsConstant.WINDOW.value):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._window = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._window.append(seconds)
+
+    def snapshot(self) -> dict:
+        result = {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+
+        if len(self._window) > 1:
+            percentiles = quantiles(self._window, n=100)
+            result['p50'] = percentiles[49]
+            result['p95'] = percentiles[94]
+
+        return result
+
+
+class Metrics:
+    """Счетчики, текущие значения и задержки внутри процесса."""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.latencies = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        if name not in self.latencies:
+            self.latencies[name] = LatencyStat()
+
+        self.latencies[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def snapshot(self) -> dict:
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'latencies': {
+                name: stat.snapshot()
+                for name, stat in self.latencies.items()
+            },
+        }
+
+    def report(self) -> str:
+        lines = [
+            f'{name}: {value}'
+            for name, value in sorted(self.counters.items())
+        ]
+        lines += [
+            f'{name}: {value}'
+            for name, value in sorted(self.gauges.items())
+        ]
+
+        for name, stat in sorted(self.latencies.items()):
+            values = ', '.join(
+                f'{key}={value:.3f}' if isinstance(value, float)
+                else f'{key}={value}'
+                for key, value in stat.snapshot().items()
+            )
+            lines.append(f'{name}: {values}')
+
+        return '\n'.join(lines)
+
+
+metrics = Metrics()
+
+
+async def log_metrics(interval: int = MetricsConstant.LOG_INTERVAL.value):
+    """Периодически выводит метрики в лог."""
+    if not interval:
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+
+        report = metrics.report()
+
+        if report:
+            logger.info(f'Метрики:\n{report}')
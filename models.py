@@ -0,0 +1,158 @@
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from constants import VkEventKind
+
+
+def render_text(head: str, text: str, video_urls: list[str]) -> str:
+    """Соберет HTML-текст сообщения для Telegram."""
+    rendered = f'{head}\n'
+
+    if text:
+        rendered += f'{text}\n'
+
+    if video_urls:
+        formatted_videos = '\n\n'.join(video_urls)
+        rendered += f'\n<b>Видео:</b>\n{formatted_videos}'
+
+    return rendered
+
+
+@dataclass(slots=True)
+class Sender:
+    """Автор сообщения или поста: пользователь (id > 0) или группа (id < 0)."""
+
+    id: int
+    name: str
+    avatar: Optional[str] = None
+
+    def signature(self, post_id: Optional[int] = None) -> str:
+        if post_id:
+            url = f'https://vk.com/wall{self.id}_{post_id}'
+        elif self.id > 0:
+            url = f'https://vk.com/im?sel={self.id}'
+        else:
+            url = f'https://vk.com/club{-self.id}'
+
+        return f'<a href="{url}"><b>{self.name}</b></a>'
+
+
+@dataclass(slots=True)
+class Media:
+    """Вложения сообщения."""
+
+    images: list[str] = field(default_factory=list)
+    video_urls: list[str] = field(default_factory=list)
+    video_frames: list[bytes] = field(default_factory=list)
+    files: list[dict] = field(default_factory=list)
+    # file_id действителен только для бота, который его получил, поэтому
+    # они хранятся по id владельца бота.
+    file_ids: dict[str, list[str]] = field(default_factory=dict)
+
+    def photos(self, tenant_id: str) -> list:
+        """Изображения для отправки альбомом.
+
+        После первой отправки ботом владельца используются file_id,
+        полученные этим ботом от Telegram.
+        """
+        return (
+            self.file_ids.get(tenant_id)
+            or self.images + self.video_frames
+        )
+
+    def is_empty(self) -> bool:
+        return not (self.images or self.video_urls or self.files)
+
+    def size(self) -> int:
+        return (
+            sum(len(url) for url in self.images)
+            + sum(len(url) for url in self.video_urls)
+            + sum(len(frame) for frame in self.video_frames)
+        )
+
+
+@dataclass(slots=True)
+class WallPost:
+    """Репост записи со стены.
+
+    Объект хранится в кэше репостов, поэтому подготовленный текст и file_id
+    изображений переиспользуются при повторной пересылке.
+    """
+
+    cache_key: str
+    post_id: int
+    author: Sender
+    text: str = ''
+    media: Media = field(default_factory=Media)
+    _rendered_text: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False,
+    )
+
+    @property
+    def rendered_text(self) -> str:
+        if self._rendered_text is None:
+            signature = self.author.signature(post_id=self.post_id)
+            self._rendered_text = render_text(
+                head=f'<b>Переслано от {signature}</b>',
+                text=self.text,
+                video_urls=self.media.video_urls,
+            )
+
+        return self._rendered_text
+
+    def text_for_tg(self, head_signature: Optional[str] = None) -> str:
+        if head_signature:
+            return f'<b>{head_signature}</b>\n\n{self.rendered_text}'
+
+        return self.rendered_text
+
+    def size(self) -> int:
+        return (
+            len(self.text)
+            + len(self._rendered_text or '')
+            + self.media.size()
+        )
+
+
+@dataclass(slots=True)
+class Message:
+    """Сообщение Vk, подготовленное к пересылке."""
+
+    message_id: int
+    sender: Sender
+    text: str = ''
+    media: Media = field(default_factory=Media)
+    sticker_url: Optional[str] = None
+    wall: Optional[WallPost] = None
+    _rendered_text: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False,
+    )
+
+    @property
+    def rendered_text(self) -> str:
+        if self._rendered_text is None:
+            self._rendered_text = render_text(
+                head=self.sender.signature(),
+                text=self.text,
+                video_urls=self.media.video_urls,
+            )
+
+        return self._rendered_text
+
+    def has_content(self) -> bool:
+        return bool(self.text) or not self.media.is_empty()
+
+
+@dataclass(slots=True)
+class VkEvent:
+    """Событие Vk, приведенное к общему виду для всех источников.
+
+    peer_id - собеседник, к которому относится событие. У нового сообщения
+    item - полный объект сообщения, как в ответе messages.getById; если
+    источник его не передал, коннектор запросит сообщения пачкой.
+    """
+
+    kind: VkEventKind
+    peer_id: int
+    message_id: int = 0
+    item: Optional[dict[str, Any]] = None
@@ -0,0 +1,177 @@
+import abc
+from typing import Any, Optional
+
+from constants import ConnectorConstant, VkConstant, VkEventKind
+from models import VkEvent
+from tenants import Tenant
+from vkapi import VkApiBase
+
+
+class VkEventSource(abc.ABC):
+    """Источник событий Vk на основе LongPoll.
+
+    Источник хранит сервер, ключ и ts LongPoll и отдает события в общем
+    виде VkEvent, поэтому коннектор обрабатывает их одинаково, откуда бы
+    они ни пришли. Методы выполняют блокирующие запросы и вызываются
+    из отдельного потока.
+    """
+
+    def __init__(self, api: VkApiBase, tenant: Tenant):
+        self.api = api
+        self.tenant = tenant
+        self.server: str = ''
+        self.key: str = ''
+        self.timestamp: Optional[int] = None
+
+    @abc.abstractmethod
+    def get_server(self) -> dict[str, Any]:
+        """Вернет ответ API с сервером, ключом и ts LongPoll."""
+
+    def server_url(self, server: str) -> str:
+        return server
+
+    def check_params(self) -> dict[str, Any]:
+        """Дополнительные параметры запроса событий."""
+        return {}
+
+    @abc.abstractmethod
+    def normalize(self, update: Any) -> Optional[VkEvent]:
+        """Приведет событие источника к VkEvent или отбросит его."""
+
+    def connect(self, timestamp: Optional[int] = None) -> None:
+        """Получит новый LongPoll-сервер.
+
+        Если передан timestamp, чтение продолжится с него, а не с текущего
+        момента.
+        """
+        response = self.get_server()['response']
+
+        self.server = self.server_url(server=response['server'])
+        self.key = response['key']
+        self.timestamp = timestamp or int(response['ts'])
+
+    def check(self, wait: int) -> list[VkEvent]:
+        """Дождется событий и вернет их в общем виде."""
+        response = self.api.connect_vk_long_poll_server(
+            server=self.server,
+            data={
+                'act': 'a_check',
+                'wait': wait,
+                'key': self.key,
+                'ts': self.timestamp,
+                **self.check_params(),
+            },
+        )
+        self.timestamp = int(response.get('ts'))
+
+        return [
+            event for event in map(self.normalize, response.get('updates'))
+            if event
+        ]
+
+
+class UserLongPoll(VkEventSource):
+    """LongPoll пользователя (messages.getLongPollServer).
+
+    События приходят компактными массивами без вложений, поэтому
+    сообщения запрашиваются отдельно через messages.getById.
+    """
+
+    def get_server(self) -> dict[str, Any]:
+        return self.api.get_vk_long_pol_server()
+
+    def server_url(self, server: str) -> str:
+        return f'https://{server}'
+
+    def check_params(self) -> dict[str, Any]:
+        return {
+            'mode': VkConstant.LONG_POLL_MODE.value,
+            'version': VkConstant.LONG_POLL_VERSION.value,
+        }
+
+    def normalize(self, update: list) -> Optional[VkEvent]:
+        code = update[0]
+
+        if (
+            code == ConnectorConstant.NEW_MSG_CODE.value
+            and update[2] not in ConnectorConstant.OUTGOING_MSG_CODE.value
+        ):
+            return VkEvent(
+                kind=VkEventKind.NEW_MESSAGE,
+                peer_id=update[3],
+                message_id=update[1],
+            )
+        elif code == ConnectorConstant.READ_MSG_CODE.value:
+            return VkEvent(
+                kind=VkEventKind.READ,
+                peer_id=update[1],
+                message_id=update[2],
+            )
+        elif code in ConnectorConstant.TYPING_CODES.value:
+            return VkEvent(kind=VkEventKind.TYPING, peer_id=update[1])
+
+        return None
+
+
+class CommunityLongPoll(VkEventSource):
+    """Bots LongPoll сообщества (groups.getLongPollServer).
+
+    Событие message_new содержит полный объект сообщения с вложениями и
+    ответом, поэтому дополнительные запросы к Vk не нужны. В настройках
+    сообщества должны быть включены Bots LongPoll с версией API не ниже
+    5.103 и события message_new, message_read и message_typing_state.
+    """
+
+    def get_server(self) -> dict[str, Any]:
+        return self.api.get_group_long_poll_server(
+            group_id=self.tenant.vk_group_id,
+        )
+
+    def normalize(self, update: dict[str, Any]) -> Optional[VkEvent]:
+        event_type = update.get('type')
+        data = update.get('object', {})
+
+        if event_type == 'message_new':
+            item = data['message']
+
+            if item.get('out'):
+                return None
+
+            return VkEvent(
+                kind=VkEventKind.NEW_MESSAGE,
+                peer_id=item['peer_id'],
+                message_id=item['id'],
+                item=item,
+            )
+        elif event_type == 'message_read':
+            return VkEvent(
+                kind=VkEventKind.READ,
+                peer_id=data['peer_id'],
+                message_id=data['read_message_id'],
+            )
+        elif (
+            event_type == 'message_typing_state'
+            and data.get('state') == 'typing'
+        ):
+            return VkEvent(kind=VkEventKind.TYPING, peer_id=data['from_id'])
+
+        return None
+
+
+EVENT_SOURCES = {
+    'user': UserLongPoll,
+    'community': CommunityLongPoll,
+}
+
+
+def create_event_source(api: VkApiBase, tenant: Tenant) -> VkEventSource:
+    """Создаст источник событий, выбранный для владельца."""
+    source = EVENT_SOURCES.get(tenant.vk_event_source)
+
+    if source is None:
+        raise ValueError(
+            f'Неизвестный источник событий Vk "{tenant.vk_event_source}": '
+            f'допустимы {", ".join(EVENT_SOURCES)}.'
+        )
+
+    return source(api=api, tenant=tenant)
@@ -0,0 +1,99 @@
+import abc
+from typing import Any, Hashable, Optional
+
+from cache import LruCache
+from constants import StateConstant
+
+
+class StateStore(abc.ABC):
+    """Хранилище состояния интерфейса бота.
+
+    Значения адресуются парой (namespace, key) и живут не дольше ttl
+    секунд. Хранилище принадлежит базе данных владельца, поэтому
+    состояние разных владельцев не пересекается.
+    """
+
+    @abc.abstractmethod
+    async def get(
+            self,
+            namespace: str,
+            key: Hashable,
+            default: Any = None,
+    ) -> Any:
+        """Вернет значение или default, если его нет или оно истекло."""
+
+    @abc.abstractmethod
+    async def set(
+            self,
+            namespace: str,
+            key: Hashable,
+            value: Any,
+            ttl: Optional[float] = None,
+    ) -> None:
+        """Сохранит значение на ttl секунд или на срок хранилища."""
+
+    @abc.abstractmethod
+    async def delete(self, namespace: str, key: Hashable) -> None:
+        """Удалит значение, если оно есть."""
+
+
+class MemoryStateStore(StateStore):
+    """Состояние в памяти процесса с вытеснением LRU и сроком жизни."""
+
+    def __init__(
+            self,
+            max_entries: int = StateConstant.MAX_ENTRIES.value,
+            ttl: float = StateConstant.TTL.value,
+    ):
+        self.cache = LruCache(max_entries=max_entries, ttl=ttl)
+
+    async def get(self, namespace, key, default=None):
+        return self.cache.get((namespace, key), default)
+
+    async def set(self, namespace, key, value, ttl=None):
+        self.cache.set((namespace, key), value, ttl=ttl)
+
+    async def delete(self, namespace, key):
+        self.cache.pop((namespace, key))
+
+
+class DatabaseStateStore(StateStore):
+    """Состояние в таблице bot_state, общее для процессов и реплик.
+
+    Истекшие записи не возвращаются и удаляются задачей очистки БД.
+    """
+
+    def __init__(self, database, ttl: float = StateConstant.TTL.value):
+        self.db = database
+        self.ttl = ttl
+
+    async def get(self, namespace, key, default=None):
+        value = await self.db.get_state(namespace=namespace, key=str(key))
+
+        return default if value is None else value
+
+    async def set(self, namespace, key, value, ttl=None):
+        await self.db.set_state(
+            namespace=namespace,
+            key=str(key),
+            value=value,
+            ttl=ttl or self.ttl,
+        )
+
+    async def delete(self, namespace, key):
+        await self.db.delete_state(namespace=namespace, key=str(key))
+
+
+def create_state_store(database) -> StateStore:
+    """Создаст хранилище состояния, выбранное в BOT_STATE_BACKEND."""
+    backend = StateConstant.BACKEND.value
+
+    if backend == 'db':
+        return DatabaseStateStore(database=database)
+    elif backend == 'memory':
+        return MemoryStateStore()
+
+    raise ValueError(
+        f'Неизвестное хранилище состояния бота "{backend}": '
+        'допустимы memory и db.'
+    )
@@ -0,0 +1,120 @@
+import functools
+import json
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from constants import (ConnectorConstant, TenantConstant, TgConstant,
+                       VkConstant, parse_vk_token)
+
+TENANT_ID_PATTERN = re.compile(r'^[a-z0-9_]{1,32}$')
+
+
+@dataclass(slots=True, frozen=True)
+class Tenant:
+    """Владелец: аккаунт Vk, его бот и чат в Telegram.
+
+    Данные владельца по умолчанию хранятся в таблицах без префикса, данные
+    остальных - в отдельной схеме PostgreSQL или отдельном файле SQLite.
+    """
+
+    tenant_id: str
+    vk_id: int
+    vk_access_token: str
+    tg_chat_id: int
+    bot_token: str
+    vk_event_source: str = VkConstant.EVENT_SOURCE.value
+    vk_group_id: int = VkConstant.GROUP_ID.value
+
+    @property
+    def is_default(self) -> bool:
+        return self.tenant_id == TenantConstant.DEFAULT_ID.value
+
+    @property
+    def schema(self) -> Optional[str]:
+        if self.is_default:
+            return None
+
+        return f'tenant_{self.tenant_id}'
+
+    @property
+    def webhook_path(self) -> str:
+        if self.is_default:
+            return ''
+
+        return f'/{self.tenant_id}'
+
+
+@functools.cache
+def default_tenant() -> Tenant:
+    """Владелец, заданный переменными окружения."""
+    return Tenant(
+        tenant_id=TenantConstant.DEFAULT_ID.value,
+        vk_id=ConnectorConstant.VK_ID.value,
+        vk_access_token=VkConstant.ACCESS_TOKEN.value,
+        tg_chat_id=TgConstant.TELEGRAM_CHAT_ID.value,
+        bot_token=TgConstant.TELEGRAM_BOT_TOKEN.value,
+    )
+
+
+def load_tenants(path: str = TenantConstant.FILE.value) -> list[Tenant]:
+    """Прочитает реестр владельцев.
+
+    Без файла реестра работает один владелец из переменных окружения.
+    Файл - JSON-список объектов с ключами id, vk_id, vk_access_token,
+    telegram_chat_id и telegram_bot_token, а для сообщества еще
+    vk_event_source ("community") и vk_group_id. Владелец с id default
+    использует существующие таблицы без префикса.
+    """
+    if not path:
+        return [default_tenant()]
+
+    with open(path, encoding='utf-8') as file:
+        entries = json.load(file)
+
+    tenants = list()
+
+    for entry in entries:
+        tenant_id = str(entry['id']).lower()
+
+        if not TENANT_ID_PATTERN.match(tenant_id):
+            raise ValueError(
+                f'Недопустимый id владельца "{tenant_id}": разрешены '
+                f'латинские буквы, цифры и _ (до 32 символов).'
+            )
+
+        tenants.append(
+            Tenant(
+                tenant_id=tenant_id,
+                vk_id=int(entry['vk_id']),
+                vk_access_token=parse_vk_token(entry['vk_access_token']),
+                tg_chat_id=int(entry['telegram_chat_id']),
+                bot_token=entry['telegram_bot_token'],
+                vk_event_source=entry.get(
+                    'vk_event_source', VkConstant.EVENT_SOURCE.value,
+                ).lower(),
+                vk_group_id=int(
+                    entry.get('vk_group_id', VkConstant.GROUP_ID.value),
+                ),
+            )
+        )
+
+    tenant_ids = [tenant.tenant_id for tenant in tenants]
+
+    if len(set(tenant_ids)) != len(tenant_ids):
+        raise ValueError('В реестре владельцев повторяются id.')
+
+    return tenants
+
+
+current_tenant: ContextVar[Tenant] = ContextVar('current_tenant')
+
+
+def tenant() -> Tenant:
+    """Вернет владельца, в контексте которого выполняется код.
+
+    Контекст задается при запуске задач владельца и наследуется
+    порожденными задачами и asyncio.to_thread.
+    """
+    return current_tenant.get(None) or default_tenant()
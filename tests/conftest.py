@@ -0,0 +1,48 @@
+import asyncio
+import os
+import sys
+
+# Настройки читаются при импорте constants, поэтому задаются до него.
+os.environ.update({
+    'VK_ID': '1',
+    'VK_ACCESS_TOKEN': 'test',
+    'TELEGRAM_CHAT_ID': '1',
+    'TELEGRAM_BOT_TOKEN': '1:test',
+    'READ_NOTIFICATION_MODE': '2',
+    'READ_NOTIFICATION_DEBOUNCE_MS': '50',
+    'USE_POSTGRES': 'False',
+    'ARCHIVE_ENABLED': 'True',
+    'MAX_MESSAGES_PER_USER': '3',
+    'MESSAGE_MAX_AGE_DAYS': '30',
+    'TENANTS_FILE': '',
+})
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    """Выполнит корутину в цикле событий, общем для всего теста."""
+    loop = asyncio.new_event_loop()
+
+    yield loop.run_until_complete
+
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+@pytest.fixture
+def database(run, tmp_path):
+    """База владельца по умолчанию в отдельном файле SQLite."""
+    from db import Database
+
+    database = Database(url=f'sqlite:///{tmp_path / "test.sqlite3"}')
+
+    yield database
+
+    if database.flush_task:
+        database.flush_task.cancel()
+
+    run(database.close())
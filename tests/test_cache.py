@@ -0,0 +1,95 @@
+import pytest
+
+import cache
+from cache import LruCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Часы кэша, которые двигаются только вручную."""
+    now = [1000.0]
+
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+
+    return now
+
+
+def test_evicts_least_recently_used_entry():
+    lru = LruCache(max_entries=2)
+
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+
+    assert lru.get('a') == 1
+    assert lru.get('b') is None
+    assert lru.get('c') == 3
+    assert len(lru) == 2
+
+
+def test_evicts_by_total_size():
+    lru = LruCache(max_entries=10, max_bytes=10, sizeof=len)
+
+    lru.set('a', 'xxxx')
+    lru.set('b', 'yyyy')
+    lru.set('c', 'zzzz')
+
+    assert 'a' not in lru
+    assert lru.get('c') == 'zzzz'
+    assert lru.bytes == 8
+
+
+def test_skips_value_larger_than_limit():
+    lru = LruCache(max_entries=10, max_bytes=10, sizeof=len)
+
+    lru.set('a', 'xxxx')
+    lru.set('big', 'x' * 11)
+
+    assert 'big' not in lru
+    assert lru.get('a') == 'xxxx'
+
+
+def test_replacing_value_updates_size():
+    lru = LruCache(max_entries=10, max_bytes=10, sizeof=len)
+
+    lru.set('a', 'xxxx')
+    lru.set('a', 'xx')
+
+    assert lru.bytes == 2
+    assert lru.pop('a') == 'xx'
+    assert lru.bytes == 0
+
+
+def test_expires_entries_after_ttl(clock):
+    lru = LruCache(max_entries=10, ttl=5)
+
+    lru.set('a', 1)
+    clock[0] += 4.9
+
+    assert lru.get('a') == 1
+
+    clock[0] += 0.1
+
+    assert lru.get('a', 'default') == 'default'
+    assert len(lru) == 0
+
+
+def test_entry_ttl_overrides_cache_ttl(clock):
+    lru = LruCache(max_entries=10, ttl=5)
+
+    lru.set('short', 1, ttl=1)
+    lru.set('long', 2, ttl=60)
+    clock[0] += 10
+
+    assert lru.get('short') is None
+    assert lru.get('long') == 2
+
+
+def test_entries_without_ttl_never_expire(clock):
+    lru = LruCache(max_entries=10)
+
+    lru.set('a', 1)
+    clock[0] += 10 ** 6
+
+    assert lru.get('a') == 1
@@ -0,0 +1,238 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as db
+
+from db import Message
+
+
+def add_messages(run, database, vk_user_id, count):
+    async def scenario():
+        await database.add_or_update_chat(
+            vk_user=f'user{vk_user_id}',
+            vk_user_id=vk_user_id,
+            tg_chat_id=vk_user_id * 10,
+        )
+
+        for number in range(1, count + 1):
+            await database.add_message(
+                vk_user_id=vk_user_id,
+                tg_message_id=number,
+                vk_message_id=number,
+                tg_chat_id=vk_user_id * 10,
+            )
+
+        await database.flush_messages()
+
+    run(scenario())
+
+
+def vk_message_ids(database, vk_user_id):
+    with database.Session() as session:
+        return session.execute(
+            db.select(Message.vk_message_id)
+            .where(Message.vk_user_id == vk_user_id)
+            .order_by(Message.vk_message_id)
+        ).scalars().all()
+
+
+def test_created_at_is_utc(run, database):
+    add_messages(run, database, vk_user_id=1, count=1)
+
+    with database.Session() as session:
+        created_at = session.execute(db.select(Message.created_at)).scalar()
+
+    assert abs(created_at - datetime.utcnow()) < timedelta(minutes=1)
+
+
+def test_prune_keeps_latest_messages_per_user(run, database):
+    add_messages(run, database, vk_user_id=1, count=5)
+    add_messages(run, database, vk_user_id=2, count=2)
+
+    deleted = run(database.prune_messages())
+
+    assert deleted == 2
+    assert vk_message_ids(database, vk_user_id=1) == [3, 4, 5]
+    assert vk_message_ids(database, vk_user_id=2) == [1, 2]
+
+
+def test_prune_removes_messages_older_than_max_age(run, database):
+    add_messages(run, database, vk_user_id=1, count=3)
+
+    with database.Session() as session:
+        for vk_message_id, age in ((1, 31), (2, 29)):
+            session.execute(
+                db.update(Message)
+                .where(Message.vk_message_id == vk_message_id)
+                .values(created_at=datetime.utcnow() - timedelta(days=age))
+            )
+        session.commit()
+
+    deleted = run(database.prune_messages())
+
+    assert deleted == 1
+    assert vk_message_ids(database, vk_user_id=1) == [2, 3]
+
+
+def archive(run, database, messages):
+    async def scenario():
+        for vk_message_id, (vk_user_id, text, attachments) in enumerate(
+                messages, start=1,
+        ):
+            await database.archive_message(
+                vk_user_id=vk_user_id,
+                vk_message_id=vk_message_id,
+                sender_id=vk_user_id,
+                sender_name=f'user{vk_user_id}',
+                date=datetime(2024, 1, vk_message_id),
+                text=text,
+                attachments=attachments,
+            )
+
+        await database.flush_messages()
+
+    run(scenario())
+
+
+def found_texts(found):
+    return [message.content['text'] for message in found]
+
+
+def test_search_archive_finds_text_and_attachment_titles(run, database):
+    archive(run, database, [
+        (1, 'Встречаемся завтра у метро', []),
+        (1, 'Смотри файл', [{'type': 'doc', 'title': 'отчет.pdf'}]),
+        (2, 'Совсем другое сообщение', []),
+    ])
+
+    found, has_more = run(database.search_archive(query='метро'))
+
+    assert found_texts(found) == ['Встречаемся завтра у метро']
+    assert not has_more
+
+    found, _ = run(database.search_archive(query='отчет'))
+
+    assert found_texts(found) == ['Смотри файл']
+    assert found[0].content['attachments'][0]['title'] == 'отчет.pdf'
+
+
+def test_search_archive_filters_by_user(run, database):
+    archive(run, database, [
+        (1, 'привет от первого', []),
+        (2, 'привет от второго', []),
+    ])
+
+    found, _ = run(database.search_archive(query='привет', vk_user_id=2))
+
+    assert found_texts(found) == ['привет от второго']
+
+
+def test_search_archive_pages_results(run, database):
+    archive(run, database, [
+        (1, f'отпуск {number}', []) for number in range(7)
+    ])
+
+    first_page, has_more = run(
+        database.search_archive(query='отпуск', limit=5),
+    )
+    last_page, has_more_after = run(
+        database.search_archive(query='отпуск', offset=5, limit=5),
+    )
+
+    assert len(first_page) == 5
+    assert has_more
+    assert len(last_page) == 2
+    assert not has_more_after
+    assert not {message.id for message in first_page} & {
+        message.id for message in last_page
+    }
+
+
+def test_search_archive_treats_query_as_plain_words(run, database):
+    archive(run, database, [(1, 'цитата "в кавычках" OR NOT', [])])
+
+    found, _ = run(database.search_archive(query='"кавычках OR'))
+
+    assert found_texts(found) == ['цитата "в кавычках" OR NOT']
+    assert run(database.search_archive(query='   ')) == ([], False)
+
+
+@pytest.fixture
+def slow_write(database, monkeypatch):
+    """Задержит запись связей, пока тест не откроет release."""
+    release = asyncio.Event()
+    write_messages = database.write_messages
+
+    async def write(session, rows):
+        await release.wait()
+        await write_messages(session=session, rows=rows)
+
+    monkeypatch.setattr(database, 'write_messages', write)
+
+    return release
+
+
+def test_rows_stay_visible_while_flush_is_running(run, database, slow_write):
+    async def scenario():
+        await database.add_or_update_chat(
+            vk_user='user1', vk_user_id=1, tg_chat_id=10,
+        )
+        await database.add_message(
+            vk_user_id=1, tg_message_id=2, vk_message_id=3, tg_chat_id=10,
+        )
+        flush = asyncio.create_task(database.flush_messages())
+        await asyncio.sleep(0.01)
+
+        assert not len(database.pending_messages)
+        found = await database.get_message(vk_user_id=1, vk_message_id=3)
+        assert found.tg_message_id == 2
+
+        slow_write.set()
+        await flush
+
+        assert not database.pending_messages.in_flight
+        found = await database.get_message(vk_user_id=1, vk_message_id=3)
+        assert found.tg_message_id == 2
+
+    run(scenario())
+
+
+def test_failed_flush_returns_rows_to_buffer(run, database, monkeypatch):
+    async def fail(session, rows):
+        raise db.exc.OperationalError('INSERT', {}, Exception('locked'))
+
+    monkeypatch.setattr(database, 'write_messages', fail)
+
+    async def scenario():
+        await database.add_message(
+            vk_user_id=1, tg_message_id=2, vk_message_id=3, tg_chat_id=10,
+        )
+        await database.flush_messages()
+
+        assert len(database.pending_messages) == 1
+        assert not database.pending_messages.in_flight
+        assert await database.get_message(vk_message_id=3)
+
+    run(scenario())
+
+
+def test_delete_waits_for_running_flush(run, database, slow_write):
+    async def scenario():
+        await database.add_or_update_chat(
+            vk_user='user1', vk_user_id=1, tg_chat_id=10,
+        )
+        await database.add_message(
+            vk_user_id=1, tg_message_id=2, vk_message_id=3, tg_chat_id=10,
+        )
+        flush = asyncio.create_task(database.flush_messages())
+        await asyncio.sleep(0.01)
+        delete = asyncio.create_task(database.delete_messages(vk_user_id=1))
+        await asyncio.sleep(0.01)
+
+        slow_write.set()
+        await asyncio.gather(flush, delete)
+
+        assert await database.get_message(vk_message_id=3) is None
+
+    run(scenario())
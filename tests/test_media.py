@@ -0,0 +1,238 @@
+import asyncio
+import email
+
+import httpx
+import pytest
+
+from exceptions import MediaTooLargeError, MediaTransferError
+from constants import MediaConstant
+from media import ByteBudget, MediaDownloader, MediaStreamer
+
+CONTENT = bytes(range(256)) * 800
+
+
+def test_budget_reserves_and_releases(run):
+    budget = ByteBudget(limit=100)
+
+    async def scenario():
+        async with budget.reserve(size=60):
+            assert budget.in_flight == 60
+
+            async with budget.reserve(size=40):
+                assert budget.in_flight == 100
+
+        assert budget.in_flight == 0
+
+    run(scenario())
+
+
+def test_budget_waits_for_free_space(run):
+    budget = ByteBudget(limit=100)
+    events = []
+
+    async def transfer(name, size, duration):
+        async with budget.reserve(size=size):
+            events.append(f'{name} start')
+            await asyncio.sleep(duration)
+            events.append(f'{name} end')
+
+    async def scenario():
+        first = asyncio.create_task(transfer('first', 80, 0.05))
+        await asyncio.sleep(0)
+        await asyncio.gather(first, transfer('second', 30, 0))
+
+    run(scenario())
+
+    assert events == ['first start', 'first end', 'second start', 'second end']
+
+
+def test_budget_clamps_size_to_limit(run):
+    budget = ByteBudget(limit=100)
+
+    async def scenario():
+        async with budget.reserve(size=1000):
+            assert budget.in_flight == 100
+
+    run(scenario())
+
+
+def test_budget_grows_reservation_without_waiting(run):
+    budget = ByteBudget(limit=100)
+
+    async def scenario():
+        async with budget.reserve(size=60):
+            async with budget.reserve(size=40) as reservation:
+                reservation.grow(size=70)
+                reservation.grow(size=50)
+
+                assert reservation.size == 70
+                assert budget.in_flight == 130
+
+        assert budget.in_flight == 0
+
+    run(scenario())
+
+
+@pytest.fixture
+def cdn():
+    """Загрузчик, который ходит в поддельный CDN и сервер загрузки."""
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+
+        if request.method == 'GET' and request.url.path == '/chunked':
+            async def body():
+                for start in range(0, len(CONTENT), 5000):
+                    yield CONTENT[start:start + 5000]
+
+            return httpx.Response(200, content=body())
+        elif request.method == 'GET' and request.url.path == '/missing':
+            return httpx.Response(404)
+        elif request.method == 'GET':
+            return httpx.Response(200, content=CONTENT)
+
+        await request.aread()
+
+        return httpx.Response(200, json={'ok': True})
+
+    downloader = MediaDownloader()
+    downloader._client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler),
+    )
+
+    yield downloader, requests
+
+
+def parse_form(request):
+    message = email.message_from_bytes(
+        b'Content-Type: ' + request.headers['Content-Type'].encode()
+        + b'\r\n\r\n' + request.content
+    )
+
+    return {
+        part.get_param('name', header='content-disposition'):
+            part.get_payload(decode=True)
+        for part in message.get_payload()
+    }
+
+
+@pytest.mark.parametrize('path', ['/file', '/chunked'])
+def test_upload_streams_file_into_form(run, cdn, path):
+    downloader, requests = cdn
+    streamer = MediaStreamer(media_downloader=downloader)
+
+    result = run(streamer.upload(
+        source_url=f'https://cdn.test{path}',
+        target_url='https://upload.test/',
+        field='document',
+        file_name='file.pdf',
+        data={'chat_id': 1, 'caption': 'подпись'},
+    ))
+    upload = requests[-1]
+    form = parse_form(upload)
+
+    assert result == {'ok': True}
+    assert form['document'] == CONTENT
+    assert form['chat_id'] == b'1'
+    assert form['caption'].decode() == 'подпись'
+
+    if path == '/file':
+        assert int(upload.headers['Content-Length']) == len(upload.content)
+    else:
+        assert upload.headers['Transfer-Encoding'] == 'chunked'
+
+
+def test_fetch_returns_whole_file(run, cdn):
+    downloader, _ = cdn
+
+    assert run(downloader.fetch(url='https://cdn.test/file')) == CONTENT
+    assert downloader.budget.in_flight == 0
+
+
+def test_stream_reserves_budget_before_connecting(run, cdn):
+    downloader, requests = cdn
+    downloader.budget = ByteBudget(limit=100)
+    connected = []
+
+    async def hold():
+        async with downloader.stream(url='https://cdn.test/file', size=80):
+            connected.append(len(requests))
+            await asyncio.sleep(0.05)
+
+    async def scenario():
+        await asyncio.gather(hold(), hold())
+
+    run(scenario())
+
+    # Второй запрос уходит только после того, как первый освободил бюджет.
+    assert connected == [1, 2]
+
+
+def test_stream_rejects_known_oversized_file(run, cdn):
+    downloader, requests = cdn
+
+    async def scenario():
+        async with downloader.stream(url='https://cdn.test/file', size=10**12):
+            pass
+
+    with pytest.raises(MediaTooLargeError):
+        run(scenario())
+
+    assert not requests
+
+
+def test_stream_rejects_error_status(run, cdn):
+    downloader, _ = cdn
+
+    with pytest.raises(MediaTransferError):
+        run(downloader.fetch(url='https://cdn.test/missing'))
+
+    assert downloader.budget.in_flight == 0
+
+
+@pytest.mark.parametrize('path', ['/file', '/chunked'])
+def test_unknown_size_reserves_what_is_received(run, cdn, path):
+    downloader, _ = cdn
+    reserved = []
+
+    async def scenario():
+        async with downloader.stream(url=f'https://cdn.test{path}') as stream:
+            reserved.append(downloader.budget.in_flight)
+
+            async for _ in stream.chunks():
+                pass
+
+            reserved.append(downloader.budget.in_flight)
+
+    run(scenario())
+
+    initial = MediaConstant.INITIAL_RESERVE.value
+
+    if path == '/file':
+        # Размер известен из Content-Length сразу после ответа.
+        assert reserved == [max(initial, len(CONTENT))] * 2
+    else:
+        assert reserved == [initial, max(initial, len(CONTENT))]
+
+
+def test_transfers_of_unknown_size_run_concurrently(run, cdn):
+    downloader, _ = cdn
+    downloader.budget = ByteBudget(limit=MediaConstant.MAX_TRANSFER_SIZE.value)
+    active = [0, 0]
+
+    async def hold(number):
+        async with downloader.stream(url=f'https://cdn{number}.test/file'):
+            active[0] += 1
+            active[1] = max(active)
+            await asyncio.sleep(0.05)
+            active[0] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(hold(number) for number in range(8)))
+
+    run(scenario())
+
+    # Прежде каждая передача неизвестного размера занимала весь лимит.
+    assert active[1] == 8
+    assert downloader.budget.in_flight == 0
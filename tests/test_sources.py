@@ -0,0 +1,168 @@
+import pytest
+
+from constants import VkEventKind
+from models import VkEvent
+from sources import (CommunityLongPoll, UserLongPoll, VkEventSource,
+                     create_event_source)
+from tenants import Tenant
+
+
+def make_tenant(**kwargs):
+    return Tenant(
+        tenant_id='default',
+        vk_id=1,
+        vk_access_token='test',
+        tg_chat_id=1,
+        bot_token='1:test',
+        **kwargs,
+    )
+
+
+class FakeApi:
+    """API Vk, отвечающий заранее заданными данными LongPoll."""
+
+    def __init__(self, updates):
+        self.updates = updates
+        self.requests = []
+
+    def get_vk_long_pol_server(self):
+        return {'response': {'server': 'lp.vk.test/im', 'key': 'k', 'ts': 10}}
+
+    def get_group_long_poll_server(self, group_id):
+        self.requests.append(('group', group_id))
+
+        return {'response': {
+            'server': 'https://lp.vk.test/group', 'key': 'k', 'ts': '10',
+        }}
+
+    def connect_vk_long_poll_server(self, server, data):
+        self.requests.append((server, data))
+
+        return {'ts': data['ts'] + 1, 'updates': self.updates}
+
+
+@pytest.mark.parametrize('update, event', [
+    (
+        [4, 100, 1, 555, 1700000000, 'текст', {}],
+        VkEvent(kind=VkEventKind.NEW_MESSAGE, peer_id=555, message_id=100),
+    ),
+    ([4, 101, 51, 555, 1700000000, 'исходящее', {}], None),
+    ([4, 102, 35, 555, 1700000000, 'исходящее', {}], None),
+    (
+        [7, 555, 99],
+        VkEvent(kind=VkEventKind.READ, peer_id=555, message_id=99),
+    ),
+    ([61, 555, 1], VkEvent(kind=VkEventKind.TYPING, peer_id=555)),
+    ([63, 2000000001, [555], 1, 1700000000], VkEvent(
+        kind=VkEventKind.TYPING, peer_id=2000000001,
+    )),
+    ([80, 3, 0], None),
+])
+def test_user_long_poll_normalize(update, event):
+    source = UserLongPoll(api=None, tenant=make_tenant())
+
+    assert source.normalize(update) == event
+
+
+MESSAGE = {
+    'id': 100,
+    'peer_id': 555,
+    'from_id': 555,
+    'text': 'текст',
+    'attachments': [{'type': 'sticker', 'sticker': {}}],
+}
+
+
+@pytest.mark.parametrize('update, event', [
+    (
+        {'type': 'message_new', 'object': {'message': MESSAGE}},
+        VkEvent(
+            kind=VkEventKind.NEW_MESSAGE,
+            peer_id=555,
+            message_id=100,
+            item=MESSAGE,
+        ),
+    ),
+    (
+        {'type': 'message_new', 'object': {'message': {**MESSAGE, 'out': 1}}},
+        None,
+    ),
+    (
+        {
+            'type': 'message_read',
+            'object': {'peer_id': 555, 'read_message_id': 99},
+        },
+        VkEvent(kind=VkEventKind.READ, peer_id=555, message_id=99),
+    ),
+    (
+        {
+            'type': 'message_typing_state',
+            'object': {'state': 'typing', 'from_id': 555, 'to_id': -1},
+        },
+        VkEvent(kind=VkEventKind.TYPING, peer_id=555),
+    ),
+    (
+        {
+            'type': 'message_typing_state',
+            'object': {'state': 'audiomessage', 'from_id': 555},
+        },
+        None,
+    ),
+    ({'type': 'wall_post_new', 'object': {}}, None),
+])
+def test_community_long_poll_normalize(update, event):
+    source = CommunityLongPoll(api=None, tenant=make_tenant())
+
+    assert source.normalize(update) == event
+
+
+def test_check_returns_normalized_events_and_advances_ts():
+    api = FakeApi(updates=[[4, 100, 1, 555], [80, 3, 0], [7, 555, 100]])
+    source = UserLongPoll(api=api, tenant=make_tenant())
+
+    source.connect()
+    events = source.check(wait=25)
+    server, data = api.requests[-1]
+
+    assert server == 'https://lp.vk.test/im'
+    assert data['ts'] == 10
+    assert data['wait'] == 25
+    assert 'mode' in data
+    assert source.timestamp == 11
+    assert [event.kind for event in events] == [
+        VkEventKind.NEW_MESSAGE, VkEventKind.READ,
+    ]
+
+
+def test_connect_resumes_from_saved_ts():
+    api = FakeApi(updates=[])
+    source = CommunityLongPoll(
+        api=api, tenant=make_tenant(vk_group_id=42),
+    )
+
+    source.connect(timestamp=7)
+    source.check(wait=25)
+    server, data = api.requests[-1]
+
+    assert api.requests[0] == ('group', 42)
+    assert server == 'https://lp.vk.test/group'
+    assert data['ts'] == 7
+    assert 'mode' not in data
+
+
+def test_create_event_source():
+    tenant = make_tenant(vk_event_source='community', vk_group_id=42)
+
+    assert isinstance(
+        create_event_source(api=None, tenant=tenant), CommunityLongPoll,
+    )
+
+    with pytest.raises(ValueError):
+        create_event_source(
+            api=None, tenant=make_tenant(vk_event_source='callback'),
+        )
+
+
+def test_event_source_is_abstract():
+    with pytest.raises(TypeError):
+        VkEventSource(api=None, tenant=make_tenant())
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache
+import db as db_module
+from state import DatabaseStateStore, MemoryStateStore, StateStore
+
+
+@pytest.fixture
+def later(monkeypatch):
+    """Сдвинет время БД на заданное число секунд вперед."""
+    def shift(seconds):
+        class ShiftedDatetime(datetime):
+            @classmethod
+            def utcnow(cls):
+                return datetime.utcnow() + timedelta(seconds=seconds)
+
+        monkeypatch.setattr(db_module, 'datetime', ShiftedDatetime)
+
+    return shift
+
+
+@pytest.fixture(params=['memory', 'db'])
+def store(request):
+    if request.param == 'memory':
+        return MemoryStateStore(max_entries=100, ttl=3600)
+
+    return DatabaseStateStore(
+        database=request.getfixturevalue('database'), ttl=3600,
+    )
+
+
+def test_set_get_delete(run, store):
+    async def scenario():
+        assert await store.get('interfaces', 1) is None
+        assert await store.get('interfaces', 1, 'default') == 'default'
+
+        await store.set('interfaces', 1, {'message_id': 5, 'text': 'txt'})
+        await store.set('chats_wait_id', 1, True)
+
+        assert await store.get('interfaces', 1) == {
+            'message_id': 5, 'text': 'txt',
+        }
+        assert await store.get('chats_wait_id', 1) is True
+
+        await store.set('interfaces', 1, {'message_id': 6, 'text': 'new'})
+        await store.delete('chats_wait_id', 1)
+        await store.delete('chats_wait_id', 2)
+
+        assert (await store.get('interfaces', 1))['message_id'] == 6
+        assert await store.get('chats_wait_id', 1) is None
+
+    run(scenario())
+
+
+def test_memory_store_expires_entries(run, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    store = MemoryStateStore(max_entries=100, ttl=60)
+
+    async def scenario():
+        await store.set('interfaces', 1, 'default ttl')
+        await store.set('interfaces', 2, 'short ttl', ttl=5)
+        now[0] += 10
+
+        assert await store.get('interfaces', 1) == 'default ttl'
+        assert await store.get('interfaces', 2) is None
+
+        now[0] += 60
+
+        assert await store.get('interfaces', 1) is None
+
+    run(scenario())
+
+
+def test_memory_store_is_bounded(run):
+    store = MemoryStateStore(max_entries=2, ttl=60)
+
+    async def scenario():
+        for key in range(3):
+            await store.set('interfaces', key, key)
+
+        return [await store.get('interfaces', key) for key in range(3)]
+
+    assert run(scenario()) == [None, 1, 2]
+
+
+def test_database_store_expires_and_prunes_entries(run, database, later):
+    store = DatabaseStateStore(database=database, ttl=3600)
+
+    async def scenario():
+        await store.set('interfaces', 1, 'default ttl')
+        await store.set('interfaces', 2, 'short ttl', ttl=5)
+
+        later(10)
+
+        assert await store.get('interfaces', 1) == 'default ttl'
+        assert await store.get('interfaces', 2) is None
+        assert await database.prune_state() == 1
+
+        later(0)
+
+        # Запись удалена, а не просто скрыта сроком.
+        assert await store.get('interfaces', 2) is None
+
+    run(scenario())
+
+
+def test_database_store_is_shared_between_instances(run, database):
+    writer = DatabaseStateStore(database=database)
+    reader = DatabaseStateStore(database=database)
+
+    async def scenario():
+        await writer.set('read_notifications', 555, {'message_id': 1})
+
+        return await reader.get('read_notifications', '555')
+
+    assert run(scenario()) == {'message_id': 1}
+
+
+def test_state_store_is_abstract():
+    with pytest.raises(TypeError):
+        StateStore()
@@ -0,0 +1,162 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import tgbot
+from constants import StateConstant, TgConstant
+from state import MemoryStateStore
+from tgbot import TgBotNotification
+
+DEBOUNCE = TgConstant.READ_NOTIFICATION_DEBOUNCE.value
+NOTICES = StateConstant.READ_NOTIFICATIONS.value
+
+
+class FakeBot:
+    """Бот, который запоминает запросы к Telegram."""
+
+    def __init__(self):
+        self.calls = []
+        self.next_message_id = 100
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.next_message_id += 1
+        self.calls.append(('send', chat_id, self.next_message_id))
+
+        return SimpleNamespace(message_id=self.next_message_id)
+
+    async def edit_message_text(self, chat_id, message_id, text):
+        self.calls.append(('edit', chat_id, message_id))
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(('delete', chat_id, message_id))
+
+
+class FakeDatabase:
+    """База с одной связью: сообщение Vk 7 - сообщение Telegram 50."""
+
+    def __init__(self):
+        self.state = MemoryStateStore(max_entries=100, ttl=3600)
+
+    async def get_message(self, vk_user_id, vk_message_id):
+        if vk_message_id == 7:
+            return SimpleNamespace(tg_message_id=50)
+
+        return None
+
+
+@pytest.fixture
+def notificator():
+    bot = FakeBot()
+    notificator = TgBotNotification(
+        app=SimpleNamespace(bot=bot), database=FakeDatabase(),
+    )
+    notificator.sent = []
+
+    async def send_read_notification(vk_user_id, vk_message_id, events=1):
+        notificator.sent.append((vk_user_id, vk_message_id, events))
+
+    notificator.send_read_notification = send_read_notification
+
+    return notificator
+
+
+def test_read_events_of_one_peer_are_coalesced(run, notificator):
+    async def scenario():
+        for vk_user_id, vk_message_id in ((1, 5), (1, 7), (2, 3), (1, 6)):
+            await notificator.read(
+                vk_user_id=vk_user_id, vk_message_id=vk_message_id,
+            )
+
+        assert notificator.sent == []
+
+        await asyncio.sleep(DEBOUNCE * 2)
+
+    run(scenario())
+
+    # Одно уведомление на собеседника о самом позднем прочитанном.
+    assert sorted(notificator.sent) == [(1, 7, 3), (2, 3, 1)]
+    assert not notificator.pending_reads
+    assert not notificator.read_timers
+
+
+def test_read_after_window_starts_new_notification(run, notificator):
+    async def scenario():
+        await notificator.read(vk_user_id=1, vk_message_id=5)
+        await asyncio.sleep(DEBOUNCE * 2)
+        await notificator.read(vk_user_id=1, vk_message_id=6)
+        await asyncio.sleep(DEBOUNCE * 2)
+
+    run(scenario())
+
+    assert notificator.sent == [(1, 5, 1), (1, 6, 1)]
+
+
+def test_flush_sends_pending_notifications_at_once(run, notificator):
+    async def scenario():
+        await notificator.read(vk_user_id=1, vk_message_id=5)
+        await notificator.read(vk_user_id=1, vk_message_id=6)
+        await notificator.flush_read_notifications()
+
+    run(scenario())
+
+    assert notificator.sent == [(1, 6, 2)]
+    assert not notificator.read_tasks
+
+
+@pytest.fixture
+def notice(notificator, monkeypatch):
+    """Обновит уведомление о прочтении в чате 10 в заданное время."""
+    def update(vk_message_id, at='12:00'):
+        monkeypatch.setattr(tgbot.time, 'strftime', lambda fmt: at)
+
+        async def scenario():
+            notice = await notificator.db.state.get(NOTICES, 1)
+            calls = await notificator.update_read_notice(
+                chat_id=10,
+                vk_user_id=1,
+                vk_message_id=vk_message_id,
+                notice=notice,
+            )
+
+            return calls, await notificator.db.state.get(NOTICES, 1)
+
+        return scenario()
+
+    return update
+
+
+def test_read_notice_is_edited_in_place(run, notificator, notice):
+    bot = notificator.app.bot
+
+    calls, state = run(notice(vk_message_id=7))
+
+    assert calls == 1
+    assert bot.calls == [('send', 10, 101)]
+    assert state == {
+        'message_id': 101,
+        'text': 'Ваши сообщения были прочитаны в 12:00.',
+    }
+
+    # Прочитано сообщение 50, стоящее выше уведомления 101.
+    calls, state = run(notice(vk_message_id=7, at='12:05'))
+
+    assert calls == 1
+    assert bot.calls[-1] == ('edit', 10, 101)
+    assert state['message_id'] == 101
+    assert state['text'].endswith('12:05.')
+
+    assert run(notice(vk_message_id=7, at='12:05'))[0] == 0
+    assert len(bot.calls) == 2
+
+
+def test_read_notice_is_moved_below_new_messages(run, notificator, notice):
+    bot = notificator.app.bot
+    run(notice(vk_message_id=7))
+
+    # Сообщения 8 нет среди связей: оно отправлено после уведомления.
+    calls, state = run(notice(vk_message_id=8, at='12:05'))
+
+    assert calls == 2
+    assert bot.calls[-2:] == [('send', 10, 102), ('delete', 10, 101)]
+    assert state['message_id'] == 102
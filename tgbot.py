@@ -1,24 +1,37 @@
 import asyncio
 import functools
+import html
 import io
-from typing import Optional
+import json
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Optional, Union
 
-import requests
+import httpx
 import telegram
 from PIL import Image
 from telegram import (BotCommand, InlineKeyboardButton, InlineKeyboardMarkup,
                       Update)
+from telegram.constants import ChatAction
 from telegram.error import NetworkError, TelegramError
 from telegram.ext import (Application, ApplicationBuilder,
-                          CallbackQueryHandler, CommandHandler, ContextTypes,
-                          MessageHandler, filters)
+                          BaseUpdateProcessor, CallbackQueryHandler,
+                          CommandHandler, ContextTypes, MessageHandler,
+                          filters)
 
 import vkapi
-from constants import TgConstant
+from constants import DbConstant, StateConstant, TgConstant
+from cache import LruCache
 from db import Database
-from exceptions import (MissingUserVkIdError, NoDataInResponseError,
+from exceptions import (MediaTooLargeError, MediaTransferError,
+                        MissingUserVkIdError, NoDataInResponseError,
                         NoInterlocutorError, NoMessageForReply)
 from logger import run_logger
+from media import MediaStreamer, downloader
+from metrics import metrics
+from models import Message, WallPost
+from tenants import tenant
+from webhook import webhook_server
 
 logger = run_logger('tgbot')
 
@@ -35,7 +48,9 @@ def log_method(func):
         update = kwargs.get('update')
 
         try:
-            result = await func(*args, **kwargs)
+            with metrics.timer(f'handler_latency.{method}'):
+                result = await func(*args, **kwargs)
+
             logger.debug(f'Метод {method} вернул {result}')
             return result
 
@@ -104,11 +119,85 @@ def log_method(func):
     return wrapper
 
 
+class TgBotUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка в чате.
+
+    Обновления разных чатов обрабатываются одновременно, обновления одного
+    чата - строго по очереди. Обновления без чата не упорядочиваются.
+    Очередь чата проходится до того, как обновление займет место среди
+    max_concurrent_updates, поэтому ожидающие обновления одного чата не
+    задерживают остальные чаты.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates=max_concurrent_updates)
+        self.chat_locks = {}
+        self.chat_pending = defaultdict(int)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_update(
+            self,
+            update: object,
+            coroutine: Awaitable[Any],
+    ) -> None:
+        chat_id = None
+
+        if isinstance(update, Update) and update.effective_chat:
+            chat_id = update.effective_chat.id
+
+        started = time.monotonic()
+
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+        else:
+            # asyncio.Lock пропускает ожидающих по порядку, а задачи
+            # обновлений запускаются в порядке поступления.
+            lock = self.chat_locks.setdefault(chat_id, asyncio.Lock())
+            self.chat_pending[chat_id] += 1
+
+            try:
+                async with lock:
+                    await super().process_update(update, coroutine)
+            finally:
+                self.chat_pending[chat_id] -= 1
+
+                if not self.chat_pending[chat_id]:
+                    del self.chat_pending[chat_id]
+                    del self.chat_locks[chat_id]
+
+        metrics.observe('tg_update_latency', time.monotonic() - started)
+
+    async def do_process_update(
+            self,
+            update: object,
+            coroutine: Awaitable[Any],
+    ) -> None:
+        await coroutine
+
+
 class TgBotApp:
     """Сборщик базового приложения бота."""
 
     def __init__(self, token: str):
-        self.app = ApplicationBuilder().token(token).build()
+        self.app = (
+            ApplicationBuilder()
+            .token(token)
+            .base_url(f'{TgConstant.BOT_API_URL.value}/bot')
+            .base_file_url(f'{TgConstant.BOT_API_URL.value}/file/bot')
+            .concurrent_updates(
+                TgBotUpdateProcessor(
+                    max_concurrent_updates=(
+                        TgConstant.MAX_CONCURRENT_UPDATES.value
+                    ),
+                ),
+            )
+            .build()
+        )
 
 
 class TgBot:
@@ -118,11 +207,13 @@ class TgBot:
         self.app = app
         self.db = database
         self.chat_handlers = TgBotAddDeleteChatHandler(database=self.db)
+        self.message_handler = TgBotMessageHandler(database=self.db)
+        self.search_handler = TgBotCommandSearch(database=self.db)
 
         self.handlers = [
             CommandHandler(
                 command='start',
-                callback=TgBotCommandStart().start,
+                callback=TgBotCommandStart(database=self.db).start,
             ),
             CommandHandler(
                 command='read',
@@ -132,9 +223,17 @@ class TgBot:
                 command='help',
                 callback=TgBotCommandHelp().help,
             ),
+            CommandHandler(
+                command='search',
+                callback=self.search_handler.search,
+            ),
+            CallbackQueryHandler(
+                pattern=r'^search:\d+$',
+                callback=self.search_handler.turn_page,
+            ),
             CallbackQueryHandler(
                 pattern='Список друзей в Vk',
-                callback=TgBotFriendsHandler().friends,
+                callback=TgBotFriendsHandler(database=self.db).friends,
             ),
             CallbackQueryHandler(
                 pattern='Указать собеседника',
@@ -150,12 +249,15 @@ class TgBot:
             ),
             CallbackQueryHandler(
                 pattern='Отменить',
-                callback=TgBotCancelHandler().cancel,
+                callback=TgBotCancelHandler(database=self.db).cancel,
             ),
             MessageHandler(
                 filters=(filters.TEXT | filters.PHOTO),
-                callback=TgBotMessageHandler(
-                    database=self.db, ).message_from_user,
+                callback=self.message_handler.message_from_user,
+            ),
+            MessageHandler(
+                filters=(filters.VOICE | filters.Document.ALL),
+                callback=self.message_handler.send_msg_tg_vk,
             ),
         ]
 
@@ -165,6 +267,10 @@ class TgBot:
                 description='Пометить сообщения как прочитанные',
             ),
             BotCommand(command='start', description='Вызвать бота', ),
+            BotCommand(
+                command='search',
+                description='Найти сообщения в архиве',
+            ),
             BotCommand(command='help', description='Помощь', )
         ]
 
@@ -179,21 +285,65 @@ class TgBot:
 
         logger.info('Установка команд для управления ботом завершена.')
 
-    def run_polling(self) -> None:
-        try:
+    async def start_updates(self) -> None:
+        """Начнет прием обновлений от Telegram.
+
+        Приложение бота к этому моменту должно быть запущено.
+        """
+        if TgConstant.UPDATE_MODE.value == 'webhook':
+            logger.info('Запускается Telegram Webhook.')
+
+            await webhook_server.register(
+                app=self.app, path=tenant().webhook_path,
+            )
+        else:
             logger.info('Запускается Telegram Polling.')
 
-            self.app.run_polling()
+            await self.app.updater.start_polling()
 
-        except (TelegramError, NetworkError, Exception) as error:
-            logger.error(f'Ошибка при запросе обновлений: {error}')
+    async def stop_updates(self) -> None:
+        """Прекратит прием новых обновлений от Telegram.
+
+        Уже принятые обновления продолжают обрабатываться до app.stop().
+        """
+        webhook_server.unregister(app=self.app)
+
+        if self.app.updater.running:
+            await self.app.updater.stop()
 
 
 class TgBotSharedAttributes:
-    """Общие данные классов."""
+    """Общие данные классов.
+
+    Чаты, ожидающие vk_id собеседника, и id актуального интерфейса бота в
+    чате хранятся в хранилище состояния владельца (Database.state).
+    """
+
+    db: Database
+
+    async def is_waiting_id(self, chat_id: int) -> bool:
+        return await self.db.state.get(
+            StateConstant.CHATS_WAIT_ID.value, chat_id, False,
+        )
+
+    async def wait_id(self, chat_id: int) -> None:
+        await self.db.state.set(
+            StateConstant.CHATS_WAIT_ID.value,
+            chat_id,
+            True,
+            ttl=StateConstant.WAIT_ID_TTL.value,
+        )
 
-    chats_wait_id = set()
-    interfaces = {}
+    async def stop_waiting_id(self, chat_id: int) -> None:
+        await self.db.state.delete(StateConstant.CHATS_WAIT_ID.value, chat_id)
+
+    async def get_interface(self, chat_id: int) -> Optional[int]:
+        return await self.db.state.get(StateConstant.INTERFACES.value, chat_id)
+
+    async def set_interface(self, chat_id: int, interface_id: int) -> None:
+        await self.db.state.set(
+            StateConstant.INTERFACES.value, chat_id, interface_id,
+        )
 
 
 class TgBotKeyboard:
@@ -233,7 +383,7 @@ class TgBotPermissionChecker:
     """Проверка прав доступа."""
 
     def check_user_permission(self, user_id: int) -> bool:
-        return user_id == TgConstant.TELEGRAM_CHAT_ID.value
+        return user_id == tenant().tg_chat_id
 
     async def is_bot_admin(
             self,
@@ -257,11 +407,10 @@ class TgBotInterface(TgBotSharedAttributes):
             chat_id: int,
             context: ContextTypes.DEFAULT_TYPE
     ) -> None:
-        self.chats_wait_id.discard(chat_id)
-
-        if chat_id in self.interfaces:
-            interface_id = self.interfaces.get(chat_id)
+        await self.stop_waiting_id(chat_id=chat_id)
+        interface_id = await self.get_interface(chat_id=chat_id)
 
+        if interface_id:
             await context.bot.delete_message(
                 chat_id=chat_id,
                 message_id=interface_id,
@@ -277,7 +426,7 @@ class TgBotInterface(TgBotSharedAttributes):
         ):
             chat_id = update.effective_chat.id
             msg_id = update.effective_message.id
-            freshness = msg_id in self.interfaces.values()
+            freshness = msg_id == await self.get_interface(chat_id=chat_id)
             error_text = 'Интерфейс устарел. Необходимо вызвать бота снова.'
 
             if not freshness:
@@ -324,7 +473,7 @@ class TgBotCommandReadMark(TgBotPermissionChecker, vkapi.VkApi):
             )
             return
 
-        chat = self.db.get_chat(tg_chat_id=tg_chat_id)
+        chat = await self.db.get_chat(tg_chat_id=tg_chat_id)
 
         if not chat:
             await context.bot.send_message(
@@ -334,7 +483,7 @@ class TgBotCommandReadMark(TgBotPermissionChecker, vkapi.VkApi):
             return
 
         vk_peer_id = chat.vk_user_id
-        self.message_mark_as_read(peer_id=vk_peer_id)
+        await asyncio.to_thread(self.message_mark_as_read, peer_id=vk_peer_id)
 
         await context.bot.send_message(
             chat_id=tg_chat_id,
@@ -350,8 +499,9 @@ class TgBotCommandStart(
 ):
     """Обработчик команды /start."""
 
-    def __init__(self,):
+    def __init__(self, database: Database):
         super().__init__()
+        self.db = database
 
     @log_method
     async def start(
@@ -364,7 +514,7 @@ class TgBotCommandStart(
         chat_id = update.effective_chat.id
 
         if access:
-            if update.effective_chat.id == TgConstant.TELEGRAM_CHAT_ID.value:
+            if update.effective_chat.id == tenant().tg_chat_id:
                 bot_info = await context.bot.get_me()
                 bot_link = f'@{bot_info.username}'
                 text = (
@@ -416,8 +566,10 @@ class TgBotCommandStart(
                     text='Я бот, приветствую вас! Чем могу помочь?',
                     reply_markup=reply_markup,
                 )
-                interface_id = interface.message_id
-                self.interfaces[chat_id] = interface_id
+                await self.set_interface(
+                    chat_id=chat_id,
+                    interface_id=interface.message_id,
+                )
 
         else:
             text = (
@@ -458,11 +610,166 @@ class TgBotCommandHelp:
         )
 
 
+class TgBotCommandSearch(TgBotPermissionChecker):
+    """Обработчик /search для поиска по архиву переписки."""
+
+    def __init__(self, database: Database):
+        self.db = database
+
+    @log_method
+    async def search(
+            self,
+            update: Update,
+            context: ContextTypes.DEFAULT_TYPE
+    ):
+        chat_id = update.effective_chat.id
+
+        if not self.check_user_permission(user_id=update.effective_user.id):
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text='Операция не позволена.',
+            )
+            return
+
+        if not DbConstant.ARCHIVE_ENABLED.value:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text='Архив сообщений отключен (ARCHIVE_ENABLED=False).',
+            )
+            return
+
+        query = ' '.join(context.args)
+
+        if not query:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text='Укажите, что искать: /search <запрос>',
+            )
+            return
+
+        context.chat_data['search_query'] = query
+
+        text, reply_markup = await self.results_page(
+            chat_id=chat_id,
+            query=query,
+            offset=0,
+        )
+
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode='HTML',
+            reply_markup=reply_markup,
+            disable_web_page_preview=True,
+        )
+
+    @log_method
+    async def turn_page(
+            self,
+            update: Update,
+            context: ContextTypes.DEFAULT_TYPE
+    ):
+        chat_id = update.effective_chat.id
+        query = context.chat_data.get('search_query')
+
+        await update.callback_query.answer()
+
+        if not query:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text='Результаты поиска устарели. Повторите /search.',
+            )
+            return
+
+        text, reply_markup = await self.results_page(
+            chat_id=chat_id,
+            query=query,
+            offset=int(update.callback_query.data.split(':')[1]),
+        )
+
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=update.effective_message.id,
+            text=text,
+            parse_mode='HTML',
+            reply_markup=reply_markup,
+            disable_web_page_preview=True,
+        )
+
+    async def results_page(self, chat_id: int, query: str, offset: int):
+        """Сформирует страницу результатов и кнопки для перехода."""
+        page_size = TgConstant.SEARCH_PAGE_SIZE.value
+        vk_user_id = None
+
+        if chat_id != tenant().tg_chat_id:
+            chat = await self.db.get_chat(tg_chat_id=chat_id)
+            vk_user_id = chat.vk_user_id if chat else None
+
+        found, has_more = await self.db.search_archive(
+            query=query,
+            vk_user_id=vk_user_id,
+            offset=offset,
+            limit=page_size,
+        )
+
+        if not found:
+            text = f'По запросу «{html.escape(query)}» ничего не найдено.'
+            return text, None
+
+        text = (
+            f'<b>Поиск: {html.escape(query)}</b> '
+            f'(стр. {offset // page_size + 1})\n'
+        )
+
+        for number, message in enumerate(found, start=offset + 1):
+            text += f'\n{number}. {self.format_result(message=message)}'
+
+        buttons = list()
+
+        if offset:
+            buttons.append(InlineKeyboardButton(
+                '« Назад', callback_data=f'search:{offset - page_size}',
+            ))
+        if has_more:
+            buttons.append(InlineKeyboardButton(
+                'Далее »', callback_data=f'search:{offset + page_size}',
+            ))
+
+        reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+
+        return text, reply_markup
+
+    @staticmethod
+    def format_result(message) -> str:
+        content = message.content
+        snippet = content['text']
+        max_length = TgConstant.SEARCH_SNIPPET_LENGTH.value
+
+        if len(snippet) > max_length:
+            snippet = f'{snippet[:max_length]}…'
+
+        date = message.date.strftime('%d.%m.%Y %H:%M') if message.date else ''
+        text = (
+            f'<b>{html.escape(message.sender_name or "")}</b>, {date} UTC\n'
+            f'{html.escape(snippet)}\n'
+        )
+
+        if content['attachments']:
+            attachments = ', '.join(
+                attachment.get('title') or attachment['type']
+                for attachment in content['attachments']
+            )
+            text += f'<i>Вложения: {html.escape(attachments)}</i>\n'
+
+        return text
+
+
 class TgBotCancelHandler(TgBotKeyboard, TgBotSharedAttributes):
     """Обработчик кнопки отмены."""
 
-    def __init__(self):
+    def __init__(self, database: Database):
         super().__init__()
+        self.db = database
 
     @log_method
     @TgBotInterface.check_interface_freshness
@@ -473,7 +780,7 @@ class TgBotCancelHandler(TgBotKeyboard, TgBotSharedAttributes):
     ):
         chat_id = update.effective_message.chat_id
 
-        self.chats_wait_id.discard(chat_id)
+        await self.stop_waiting_id(chat_id=chat_id)
 
         await context.bot.edit_message_text(
             chat_id=chat_id,
@@ -493,9 +800,9 @@ class TgBotMessageImage(vkapi.VkApi):
         largest_photo = photo_data[-1]
         photo_file_info = await largest_photo.get_file()
         photo_url = photo_file_info.file_path
-        response = requests.get(photo_url)
+        photo_content = await downloader.fetch(url=photo_url)
 
-        photo_bytes = Image.open(io.BytesIO(response.content))
+        photo_bytes = Image.open(io.BytesIO(photo_content))
         image_buffer = io.BytesIO()
         photo_bytes.save(image_buffer, format='JPEG')
         image_buffer.seek(0)
@@ -523,6 +830,57 @@ class TgBotMessageImage(vkapi.VkApi):
         return saved_photo
 
 
+class TgBotMessageFile(vkapi.VkApi):
+    """Загрузит документ или голосовое сообщение на сервер Vk."""
+
+    streamer = MediaStreamer()
+
+    async def save_file_in_vk(
+            self,
+            vk_user_id: int,
+            message: telegram.Message,
+    ) -> str:
+        if message.voice:
+            file_data = message.voice
+            doc_type = 'audio_message'
+            file_name = 'voice.ogg'
+        else:
+            file_data = message.document
+            doc_type = 'doc'
+            file_name = file_data.file_name or 'document'
+
+        tg_file = await file_data.get_file()
+        vk_upload_url = await asyncio.to_thread(
+            self.get_doc_upload_server,
+            peer_id=vk_user_id,
+            doc_type=doc_type,
+        )
+        uploaded_file = await self.streamer.upload(
+            source_url=tg_file.file_path,
+            target_url=vk_upload_url,
+            field='file',
+            file_name=file_name,
+            size=tg_file.file_size,
+        )
+
+        if 'file' not in uploaded_file:
+            raise MediaTransferError(
+                f'сервер Vk не принял файл: {uploaded_file.get("error")}'
+            )
+
+        saved_file = await asyncio.to_thread(
+            self.save_doc,
+            file=uploaded_file['file'],
+            title=file_name,
+        )
+        saved_type = saved_file['response']['type']
+        saved_data = saved_file['response'][saved_type]
+
+        logger.debug('Файл успешно загружен на сервер Vk.')
+
+        return f'doc{saved_data["owner_id"]}_{saved_data["id"]}'
+
+
 class TgBotUserLink(TgBotKeyboard, vkapi.VkApi, TgBotSharedAttributes,):
     """Добавление пользователя Vk в чат."""
 
@@ -564,7 +922,8 @@ class TgBotUserLink(TgBotKeyboard, vkapi.VkApi, TgBotSharedAttributes,):
             return
 
         vk_user_id = int(message)
-        vk_user_info = self.get_user_or_group_info(
+        vk_user_info = await asyncio.to_thread(
+            self.get_user_or_group_info,
             user_or_group_id=vk_user_id,
             name_case='ins',
         )
@@ -577,14 +936,14 @@ class TgBotUserLink(TgBotKeyboard, vkapi.VkApi, TgBotSharedAttributes,):
         else:
             vk_user = vk_user_info.get('group_name')
 
-        self.db.add_or_update_chat(
+        await self.db.add_or_update_chat(
             vk_user_id=vk_user_id,
             vk_user=vk_user,
             tg_chat_id=chat_id,
         )
-        self.db.delete_messages(vk_user_id=vk_user_id)
+        await self.db.delete_messages(vk_user_id=vk_user_id)
 
-        self.chats_wait_id.discard(chat_id)
+        await self.stop_waiting_id(chat_id=chat_id)
 
         if vk_user_info.get('type') == 'user':
             text = (
@@ -606,7 +965,7 @@ class TgBotUserLink(TgBotKeyboard, vkapi.VkApi, TgBotSharedAttributes,):
             disable_web_page_preview=True,
         )
 
-        interface_id = self.interfaces.get(chat_id)
+        interface_id = await self.get_interface(chat_id=chat_id)
         text = (
             'Аккаунт собеседника успешно связан с данным чатом.\n\n'
             'Могу ли я помочь вам чем-нибудь еще?'
@@ -634,7 +993,8 @@ class TgBotUserLink(TgBotKeyboard, vkapi.VkApi, TgBotSharedAttributes,):
             update: Update,
             context: ContextTypes.DEFAULT_TYPE,
     ) -> None:
-        avatar = Image.open(requests.get(avatar_url, stream=True).raw)
+        avatar_content = await downloader.fetch(url=avatar_url)
+        avatar = Image.open(io.BytesIO(avatar_content))
         avatar = avatar.resize((400, 400))
         avatar_bytes = io.BytesIO()
 
@@ -649,16 +1009,142 @@ class TgBotUserLink(TgBotKeyboard, vkapi.VkApi, TgBotSharedAttributes,):
         )
 
 
+class TgBotEphemeralNotices:
+    """Служебные уведомления, которые удаляются в фоне.
+
+    Уведомления удаляются через DEL_NOTIFICATION_OF_SEND секунд. Все,
+    чей срок истек в пределах NOTICE_BATCH_WINDOW, удаляются одним запросом
+    deleteMessages на чат.
+    """
+
+    def __init__(self):
+        self.expiring = deque()
+        self.has_notices = asyncio.Event()
+        self.task = None
+
+    def expire(self, bot: telegram.Bot, chat_id: int, message_id: int):
+        """Запланирует удаление уведомления."""
+        expires_at = (
+            time.monotonic() + TgConstant.DEL_NOTIFICATION_OF_SEND.value
+        )
+        self.expiring.append((expires_at, chat_id, message_id))
+        self.has_notices.set()
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.delete_expired(bot=bot))
+
+    async def delete_expired(self, bot: telegram.Bot) -> None:
+        while True:
+            await self.has_notices.wait()
+
+            expires_at = self.expiring[0][0]
+            await asyncio.sleep(max(expires_at - time.monotonic(), 0))
+
+            deadline = time.monotonic() + TgConstant.NOTICE_BATCH_WINDOW.value
+            expired = defaultdict(list)
+
+            while self.expiring and self.expiring[0][0] <= deadline:
+                _, chat_id, message_id = self.expiring.popleft()
+                expired[chat_id].append(message_id)
+
+            if not self.expiring:
+                self.has_notices.clear()
+
+            for chat_id, message_ids in expired.items():
+                try:
+                    await bot.delete_messages(
+                        chat_id=chat_id,
+                        message_ids=message_ids,
+                    )
+                    metrics.increment('tg_notices_deleted', len(message_ids))
+
+                except TelegramError as error:
+                    logger.error(f'Не удалось удалить уведомления: {error}')
+
+
+class TgBotTypingForwarder:
+    """Покажет в Telegram, что собеседник Vk набирает сообщение.
+
+    Telegram показывает действие typing около TYPING_INTERVAL секунд,
+    поэтому в чат уходит не больше одного запроса за это время. Запросы
+    выполняются отдельной задачей из ограниченной очереди: при переполнении
+    события отбрасываются, а пересылка сообщений их не ждет.
+    """
+
+    def __init__(self, app: Application, database: Database):
+        self.app = app
+        self.db = database
+        self.queue = asyncio.Queue(
+            maxsize=TgConstant.TYPING_QUEUE_SIZE.value,
+        )
+        self.sent = LruCache(
+            max_entries=1024, ttl=TgConstant.TYPING_INTERVAL.value,
+        )
+        self.received = LruCache(
+            max_entries=1024, ttl=TgConstant.TYPING_INTERVAL.value,
+        )
+        self.task = None
+
+    def typing(self, vk_user_id: int) -> None:
+        """Поставит действие в очередь, не дожидаясь отправки."""
+        try:
+            self.queue.put_nowait((vk_user_id, time.monotonic()))
+        except asyncio.QueueFull:
+            metrics.increment('tg_typing_dropped')
+            return
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.forward())
+
+    def message_received(self, vk_user_id: int) -> None:
+        """Отметит новое сообщение: набор до него уже закончен."""
+        self.received.set(vk_user_id, time.monotonic())
+
+    async def forward(self) -> None:
+        while True:
+            vk_user_id, queued_at = await self.queue.get()
+
+            # Набор уже закончился сообщением или действие устарело, пока
+            # ждало в очереди.
+            if (
+                queued_at <= self.received.get(vk_user_id, 0)
+                or time.monotonic() - queued_at
+                > TgConstant.TYPING_INTERVAL.value
+            ):
+                continue
+
+            chat = await self.db.get_chat(vk_user_id=vk_user_id)
+            chat_id = chat.tg_chat_id if chat else tenant().tg_chat_id
+
+            if chat_id in self.sent:
+                metrics.increment('tg_typing_throttled')
+                continue
+
+            self.sent.set(chat_id, True)
+
+            try:
+                await self.app.bot.send_chat_action(
+                    chat_id=chat_id,
+                    action=ChatAction.TYPING,
+                )
+                metrics.increment('tg_typing_sent')
+
+            except TelegramError as error:
+                logger.debug(f'Не удалось показать набор текста: {error}')
+
+
 class TgBotMessageHandler(
     TgBotUserLink,
     TgBotKeyboard,
     TgBotMessageImage,
+    TgBotMessageFile,
     TgBotSharedAttributes,
 ):
     """Обработка сообщений пользователя."""
 
     def __init__(self, database: Database):
         super().__init__(database)
+        self.notices = TgBotEphemeralNotices()
 
     @log_method
     async def message_from_user(
@@ -668,7 +1154,7 @@ class TgBotMessageHandler(
     ):
         chat_id = update.effective_message.chat_id
 
-        if chat_id not in self.chats_wait_id:
+        if not await self.is_waiting_id(chat_id=chat_id):
             await self.send_msg_tg_vk(update=update, context=context)
         else:
             await self.link_user_to_chat(
@@ -677,22 +1163,22 @@ class TgBotMessageHandler(
                 context=context,
             )
 
-    def get_vk_user_id_for_msg(self, tg_chat_id: int):
-        if tg_chat_id == TgConstant.TELEGRAM_CHAT_ID.value:
+    async def get_vk_user_id_for_msg(self, tg_chat_id: int):
+        if tg_chat_id == tenant().tg_chat_id:
             raise NoInterlocutorError(
                 'используйте кнопку "Ответить" на входящих сообщениях.'
             )
 
-        chat_in_table = self.db.get_chat(tg_chat_id=tg_chat_id)
+        chat_in_table = await self.db.get_chat(tg_chat_id=tg_chat_id)
 
         if chat_in_table:
             return chat_in_table.vk_user_id
 
         raise MissingUserVkIdError('для данного сообщения нет адресата.')
 
-    def get_data_for_reply(self, tg_chat_id: int, update):
+    async def get_data_for_reply(self, tg_chat_id: int, update):
         tg_msg_id = update.effective_message.reply_to_message.message_id
-        message_in_db = self.db.get_message(
+        message_in_db = await self.db.get_message(
             tg_message_id=tg_msg_id,
             tg_chat_id=tg_chat_id,
         )
@@ -700,7 +1186,7 @@ class TgBotMessageHandler(
         if message_in_db:
             vk_user_id = message_in_db.vk_user_id
             vk_message_id = message_in_db.vk_message_id
-        elif tg_chat_id == TgConstant.TELEGRAM_CHAT_ID.value:
+        elif tg_chat_id == tenant().tg_chat_id:
             raise MissingUserVkIdError(
                 'не могу определить получателя. Возможно, для него '
                 'создан отдельный чат или сообщение слишком старое.'
@@ -713,6 +1199,18 @@ class TgBotMessageHandler(
 
         return vk_user_id, vk_message_id
 
+    @staticmethod
+    def describe_tg_attachments(message) -> list[dict]:
+        """Вернет краткие описания вложений для архива сообщений."""
+        if message.photo:
+            return [{'type': 'photo'}]
+        if message.voice:
+            return [{'type': 'audio_message'}]
+        if message.document:
+            return [{'type': 'doc', 'title': message.document.file_name}]
+
+        return []
+
     @log_method
     async def send_msg_tg_vk(
             self,
@@ -729,29 +1227,51 @@ class TgBotMessageHandler(
         vk_msg_id_for_reply = None
 
         if update.effective_message.reply_to_message:
-            vk_user_id, vk_message_id = self.get_data_for_reply(
+            vk_user_id, vk_message_id = await self.get_data_for_reply(
                 tg_chat_id=tg_chat_id, update=update,
             )
 
-            if tg_chat_id != TgConstant.TELEGRAM_CHAT_ID.value:
+            if tg_chat_id != tenant().tg_chat_id:
                 vk_msg_id_for_reply = vk_message_id
         else:
-            vk_user_id = self.get_vk_user_id_for_msg(tg_chat_id=tg_chat_id)
+            vk_user_id = await self.get_vk_user_id_for_msg(
+                tg_chat_id=tg_chat_id,
+            )
 
         photo_data = update.effective_message.photo
 
         if photo_data:
             photo = await self.get_photo(photo_data=photo_data)
-            saved_photo = self.save_photo_in_vk(photo=photo)
+            saved_photo = await asyncio.to_thread(
+                self.save_photo_in_vk, photo=photo,
+            )
 
-            response = self.send_message_to_vk(
+            response = await asyncio.to_thread(
+                self.send_message_to_vk,
                 user_id=vk_user_id,
                 message=update.effective_message.caption,
                 uploaded_photo=saved_photo,
                 reply_to=vk_msg_id_for_reply,
             )
+        elif (
+                update.effective_message.voice
+                or update.effective_message.document
+        ):
+            attachment = await self.save_file_in_vk(
+                vk_user_id=vk_user_id,
+                message=update.effective_message,
+            )
+
+            response = await asyncio.to_thread(
+                self.send_message_to_vk,
+                user_id=vk_user_id,
+                message=update.effective_message.caption,
+                attachment=attachment,
+                reply_to=vk_msg_id_for_reply,
+            )
         else:
-            response = self.send_message_to_vk(
+            response = await asyncio.to_thread(
+                self.send_message_to_vk,
                 user_id=vk_user_id,
                 message=update.effective_message.text,
                 reply_to=vk_msg_id_for_reply,
@@ -763,13 +1283,29 @@ class TgBotMessageHandler(
         tg_message_id = update.effective_message.id
         chat_id = update.effective_chat.id
 
-        self.db.add_message(
+        await self.db.add_message(
             vk_user_id=vk_user_id,
             vk_message_id=vk_message_id,
             tg_message_id=tg_message_id,
             tg_chat_id=tg_chat_id,
         )
 
+        await self.db.archive_message(
+            vk_user_id=vk_user_id,
+            vk_message_id=vk_message_id,
+            sender_id=tenant().vk_id,
+            sender_name=update.effective_user.full_name,
+            date=update.effective_message.date.replace(tzinfo=None),
+            text=(
+                update.effective_message.text
+                or update.effective_message.caption
+                or ''
+            ),
+            attachments=self.describe_tg_attachments(
+                message=update.effective_message,
+            ),
+        )
+
         logger.debug(
             'Исходящее сообщение добавлено в БД.\n'
             f'user: {vk_user_id}, '
@@ -778,17 +1314,24 @@ class TgBotMessageHandler(
             f'tg_chat_id: {chat_id}'
         )
 
-        notification = await context.bot.send_message(
-            chat_id=chat_id,
-            text='Сообщение отправлено.',
-        )
-
-        await asyncio.sleep(TgConstant.DEL_NOTIFICATION_OF_SEND.value)
+        if TgConstant.SEND_NOTIFICATION_MODE.value == 1:
+            await context.bot.set_message_reaction(
+                chat_id=chat_id,
+                message_id=tg_message_id,
+                reaction='👍',
+            )
+        elif TgConstant.SEND_NOTIFICATION_MODE.value == 2:
+            notification = await context.bot.send_message(
+                chat_id=chat_id,
+                text='Сообщение отправлено.',
+                disable_notification=True,
+            )
 
-        await context.bot.delete_message(
-            chat_id=chat_id,
-            message_id=notification.message_id,
-        )
+            self.notices.expire(
+                bot=context.bot,
+                chat_id=chat_id,
+                message_id=notification.message_id,
+            )
 
 
 class TgBotAddDeleteChatHandler(TgBotKeyboard, TgBotSharedAttributes):
@@ -812,7 +1355,7 @@ class TgBotAddDeleteChatHandler(TgBotKeyboard, TgBotSharedAttributes):
             'Сюда будут перенаправляться все его сообщения.'
         )
 
-        self.chats_wait_id.add(chat_id)
+        await self.wait_id(chat_id=chat_id)
 
         await context.bot.edit_message_text(
             chat_id=chat_id,
@@ -829,7 +1372,7 @@ class TgBotAddDeleteChatHandler(TgBotKeyboard, TgBotSharedAttributes):
             context: ContextTypes.DEFAULT_TYPE = ContextTypes.DEFAULT_TYPE
     ):
         chat_id = update.effective_chat.id
-        chat = self.db.get_chat(tg_chat_id=chat_id)
+        chat = await self.db.get_chat(tg_chat_id=chat_id)
 
         if chat:
             text = f'Удалить связь данного чата с {chat.vk_user}?'
@@ -869,7 +1412,7 @@ class TgBotAddDeleteChatHandler(TgBotKeyboard, TgBotSharedAttributes):
             'Могу ли я помочь вам чем-нибудь еще?'
         )
 
-        self.db.delete_chat(tg_chat_id=chat_id)
+        await self.db.delete_chat(tg_chat_id=chat_id)
 
         await context.bot.edit_message_text(
             chat_id=chat_id,
@@ -882,8 +1425,9 @@ class TgBotAddDeleteChatHandler(TgBotKeyboard, TgBotSharedAttributes):
 class TgBotFriendsHandler(TgBotKeyboard, TgBotSharedAttributes, vkapi.VkApi):
     """Сгенерирует список друзей в Vk."""
 
-    def __init__(self):
+    def __init__(self, database: Database):
         super().__init__()
+        self.db = database
 
     @log_method
     @TgBotInterface.check_interface_freshness
@@ -893,7 +1437,7 @@ class TgBotFriendsHandler(TgBotKeyboard, TgBotSharedAttributes, vkapi.VkApi):
             context: ContextTypes.DEFAULT_TYPE = ContextTypes.DEFAULT_TYPE
     ):
         chat_id = update.effective_chat.id
-        response = self.get_friends()
+        response = await asyncio.to_thread(self.get_friends)
         friends = response.get('response').get('items')
 
         text = str()
@@ -949,31 +1493,34 @@ class VkTgMessage:
     def __init__(self, app, database):
         self.db = database
         self.app = app
+        self.streamer = MediaStreamer()
 
     @log_method
     async def send_msg_vk_tg(
             self,
             vk_sender_id: int,
-            message: dict = None,
+            vk_message_id: int,
+            message: Union[Message, WallPost],
+            text: Optional[str] = None,
             reply_to_message_id: int = None,
     ) -> Optional[int]:
         logger.info(f'Отправка сообщения в Telegram.')
 
-        chat = self.db.get_chat(vk_user_id=vk_sender_id)
+        chat = await self.db.get_chat(vk_user_id=vk_sender_id)
         chat_id = (
             chat.tg_chat_id if chat
-            else TgConstant.TELEGRAM_CHAT_ID.value
+            else tenant().tg_chat_id
         )
+        text = text or message.rendered_text
 
-        if 'sticker_url' in message:
-            response = requests.get(message.get('sticker_url'))
-            sticker_img = response.content
+        if isinstance(message, Message) and message.sticker_url:
+            sticker_img = await downloader.fetch(url=message.sticker_url)
 
             await self.app.bot.send_sticker(chat_id, sticker_img, )
 
             await self.app.bot.send_message(
                 chat_id=chat_id,
-                text=message.get('text'),
+                text=text,
                 parse_mode='HTML',
                 reply_to_message_id=reply_to_message_id,
                 connect_timeout=TgConstant.SEND_MSG_CONN_TIMEOUT.value,
@@ -982,10 +1529,8 @@ class VkTgMessage:
             return
 
         media_group = list()
-        images = (
-            message.get('images', [])
-            + message.get('videos', {}).get('video_frames', [])
-        )
+        tenant_id = tenant().tenant_id
+        images = message.media.photos(tenant_id=tenant_id)
 
         if images:
             for image in images:
@@ -993,8 +1538,8 @@ class VkTgMessage:
 
             orig_message = await self.app.bot.send_media_group(
                 chat_id=chat_id,
-                caption=message.get('text'),
-                caption_entities=message.get('text'),
+                caption=text,
+                caption_entities=text,
                 parse_mode='HTML',
                 media=media_group,
                 reply_to_message_id=reply_to_message_id,
@@ -1002,10 +1547,14 @@ class VkTgMessage:
                 read_timeout=TgConstant.READ_TIMEOUT.value,
             )
             orig_message_id = orig_message[0].message_id
+            message.media.file_ids[tenant_id] = [
+                media_message.photo[-1].file_id
+                for media_message in orig_message
+            ]
         else:
             orig_message = await self.app.bot.send_message(
                 chat_id=chat_id,
-                text=message.get('text'),
+                text=text,
                 parse_mode='HTML',
                 reply_to_message_id=reply_to_message_id,
                 connect_timeout=TgConstant.SEND_MSG_CONN_TIMEOUT.value,
@@ -1015,11 +1564,15 @@ class VkTgMessage:
 
         logger.info('Сообщение успешно отправлено в Telegram.')
 
-        message_id = message.get('message_id')
+        await self.send_files(
+            chat_id=chat_id,
+            files=message.media.files,
+            reply_to_message_id=orig_message_id,
+        )
 
-        self.db.add_message(
+        await self.db.add_message(
             vk_user_id=vk_sender_id,
-            vk_message_id=message_id,
+            vk_message_id=vk_message_id,
             tg_message_id=orig_message_id,
             tg_chat_id=chat_id,
         )
@@ -1027,44 +1580,161 @@ class VkTgMessage:
         logger.debug(
             f'Входящее сообщение добавлено в БД.\n'
             f'user: {vk_sender_id}, '
-            f'vk_message_id: {message_id}, '
+            f'vk_message_id: {vk_message_id}, '
             f'tg_message_id: {orig_message_id}.'
             f'tg_chat_id: {chat_id}'
         )
 
         return orig_message_id
 
+    async def send_files(
+            self,
+            chat_id: int,
+            files: list[dict],
+            reply_to_message_id: int,
+    ) -> None:
+        """Перешлет документы, голосовые сообщения и аудио из Vk."""
+        reply_parameters = json.dumps({'message_id': reply_to_message_id})
+
+        for file in files:
+            data = {
+                'reply_parameters': reply_parameters,
+                'duration': file.get('duration'),
+                'performer': file.get('performer'),
+                'title': file.get('title'),
+            }
+
+            try:
+                await self.streamer.send_to_telegram(
+                    base_url=self.app.bot.base_url,
+                    kind=file['kind'],
+                    chat_id=chat_id,
+                    url=file['url'],
+                    file_name=file['file_name'],
+                    size=file.get('size'),
+                    data=data,
+                )
+            except (
+                    MediaTooLargeError,
+                    MediaTransferError,
+                    httpx.HTTPError,
+            ) as error:
+                logger.error(
+                    f'Не удалось переслать файл {file["file_name"]}: {error}'
+                )
+
+                await self.app.bot.send_message(
+                    chat_id=chat_id,
+                    text=(
+                        f'Не удалось переслать файл '
+                        f'<a href="{file["url"]}">'
+                        f'{html.escape(file["file_name"])}</a>: '
+                        f'{html.escape(str(error))}'
+                    ),
+                    parse_mode='HTML',
+                    reply_to_message_id=reply_to_message_id,
+                )
+
 
 class TgBotNotification(vkapi.VkApi):
-    """Отправит уведомление в Telegram о прочитанном сообщении в VK."""
+    """Отправит уведомление в Telegram о прочитанном сообщении в VK.
+
+    Vk присылает событие прочтения на каждую прокрутку переписки, поэтому
+    события одного собеседника копятся READ_NOTIFICATION_DEBOUNCE_MS и
+    превращаются в одно уведомление о самом позднем прочитанном сообщении.
+    """
 
     def __init__(self, app: Application, database: Database):
         super().__init__()
-        self.read_notifications = {}
         self.app = app
         self.db = database
+        self.pending_reads = {}
+        self.read_timers = {}
+        self.read_tasks = set()
+
+    async def read(self, vk_user_id: int, vk_message_id: int) -> None:
+        """Примет событие прочтения от Vk."""
+        if not TgConstant.READ_NOTIFICATION_DEBOUNCE.value:
+            await self.send_read_notification(
+                vk_user_id=vk_user_id,
+                vk_message_id=vk_message_id,
+            )
+            return
+
+        pending = self.pending_reads.get(vk_user_id)
+
+        if pending:
+            pending['vk_message_id'] = max(
+                pending['vk_message_id'], vk_message_id,
+            )
+            pending['events'] += 1
+            metrics.increment('read_events_coalesced')
+            return
+
+        self.pending_reads[vk_user_id] = {
+            'vk_message_id': vk_message_id,
+            'events': 1,
+        }
+
+        task = asyncio.create_task(
+            self.send_read_later(vk_user_id=vk_user_id),
+        )
+        self.read_timers[vk_user_id] = task
+        self.read_tasks.add(task)
+        task.add_done_callback(self.read_tasks.discard)
+
+    async def send_read_later(self, vk_user_id: int) -> None:
+        await asyncio.sleep(TgConstant.READ_NOTIFICATION_DEBOUNCE.value)
+
+        del self.read_timers[vk_user_id]
+        await self.send_pending_read(vk_user_id=vk_user_id)
+
+    async def send_pending_read(self, vk_user_id: int) -> None:
+        pending = self.pending_reads.pop(vk_user_id)
+
+        await self.send_read_notification(
+            vk_user_id=vk_user_id,
+            vk_message_id=pending['vk_message_id'],
+            events=pending['events'],
+        )
+
+    async def flush_read_notifications(self) -> None:
+        """Сразу отправит отложенные уведомления перед остановкой."""
+        timers, self.read_timers = self.read_timers, {}
+
+        for task in timers.values():
+            task.cancel()
+
+        await asyncio.gather(*self.read_tasks, return_exceptions=True)
+
+        for vk_user_id in list(self.pending_reads):
+            await self.send_pending_read(vk_user_id=vk_user_id)
 
     @log_method
     async def send_read_notification(
             self, vk_user_id: int,
-            vk_message_id: int
+            vk_message_id: int,
+            events: int = 1,
     ):
-        chat_in_table = self.db.get_chat(vk_user_id=vk_user_id)
-        response = self.get_user(vk_user_id, name_case='nom').get(
-            'response')[0]
+        chat_in_table = await self.db.get_chat(vk_user_id=vk_user_id)
+        response = (await asyncio.to_thread(
+            self.get_user, vk_user_id, name_case='nom',
+        )).get('response')[0]
         username = f"{response.get('first_name')} {response.get('last_name')}"
-        notification_text = {
-                'text': 'Ваши сообщения были прочитаны.',
-                'ext_text': f'{username} прочитал ваши сообщения.',
-            }
+        ext_text = f'{username} прочитал ваши сообщения.'
 
-        logger.info(notification_text['ext_text'])
+        logger.info(ext_text)
+
+        # Без объединения каждое событие стоило бы столько же запросов.
+        calls = legacy_calls = 1
+        legacy_discount = 0
 
         if chat_in_table:
             chat_id = chat_in_table.tg_chat_id
 
             if TgConstant.READ_NOTIFICATION_MODE.value == 1:
-                vk_message_in_db = self.db.get_message(
+                vk_message_in_db = await self.db.get_message(
+                    vk_user_id=vk_user_id,
                     vk_message_id=vk_message_id,
                 )
 
@@ -1076,25 +1746,105 @@ class TgBotNotification(vkapi.VkApi):
                         message_id=tg_message_id,
                         reaction='👀',
                     )
+                else:
+                    calls = legacy_calls = 0
             elif TgConstant.READ_NOTIFICATION_MODE.value == 2:
-                read_notification = await self.app.bot.send_message(
+                notice = await self.db.state.get(
+                    StateConstant.READ_NOTIFICATIONS.value, vk_user_id,
+                )
+                calls = await self.update_read_notice(
                     chat_id=chat_id,
-                    text=notification_text['text'],
-                    disable_notification=True,
+                    vk_user_id=vk_user_id,
+                    vk_message_id=vk_message_id,
+                    notice=notice,
                 )
+                # Прежде: новое уведомление и удаление предыдущего.
+                legacy_calls = 2
+                legacy_discount = 0 if notice else 1
+            else:
+                calls = legacy_calls = 0
+        else:
+            await self.app.bot.send_message(
+                chat_id=tenant().tg_chat_id,
+                text=ext_text,
+            )
 
-                new_notification_msg_id = read_notification.message_id
-                previous_notification = self.read_notifications.get(vk_user_id)
+        metrics.increment('tg_read_calls', calls)
+        metrics.increment(
+            'tg_read_calls_saved',
+            legacy_calls * events - legacy_discount - calls,
+        )
 
-                if previous_notification:
-                    await self.app.bot.delete_message(
+    async def update_read_notice(
+            self,
+            chat_id: int,
+            vk_user_id: int,
+            vk_message_id: int,
+            notice: Optional[dict[str, Any]],
+    ) -> int:
+        """Обновит уведомление о прочтении в чате собеседника.
+
+        Уведомление, которое стоит ниже прочитанного сообщения, изменяется
+        на месте. Если прочитано сообщение, отправленное после уведомления,
+        старое удаляется и отправляется новое. Вернет число запросов к
+        Telegram.
+        """
+        namespace = StateConstant.READ_NOTIFICATIONS.value
+        text = f'Ваши сообщения были прочитаны в {time.strftime("%H:%M")}.'
+
+        if notice:
+            read_message = await self.db.get_message(
+                vk_user_id=vk_user_id,
+                vk_message_id=vk_message_id,
+            )
+
+            if (
+                read_message
+                and read_message.tg_message_id < notice['message_id']
+            ):
+                if notice['text'] == text:
+                    return 0
+
+                try:
+                    await self.app.bot.edit_message_text(
                         chat_id=chat_id,
-                        message_id=previous_notification,
+                        message_id=notice['message_id'],
+                        text=text,
+                    )
+                except TelegramError as error:
+                    logger.debug(f'Уведомление не изменено: {error}')
+                else:
+                    await self.db.state.set(
+                        namespace,
+                        vk_user_id,
+                        {'message_id': notice['message_id'], 'text': text},
+                        ttl=StateConstant.READ_NOTIFICATION_TTL.value,
                     )
+                    return 1
 
-                self.read_notifications[vk_user_id] = new_notification_msg_id
-        else:
-            await self.app.bot.send_message(
-                chat_id=TgConstant.TELEGRAM_CHAT_ID.value,
-                text=notification_text['ext_text'],
-            )
+        read_notification = await self.app.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            disable_notification=True,
+        )
+        calls = 1
+
+        if notice:
+            try:
+                await self.app.bot.delete_message(
+                    chat_id=chat_id,
+                    message_id=notice['message_id'],
+                )
+            except TelegramError as error:
+                logger.debug(f'Уведомление не удалено: {error}')
+
+            calls += 1
+
+        await self.db.state.set(
+            namespace,
+            vk_user_id,
+            {'message_id': read_notification.message_id, 'text': text},
+            ttl=StateConstant.READ_NOTIFICATION_TTL.value,
+        )
+
+        return calls
@@ -1,31 +1,34 @@
-import json
-from typing import Any, Union
+import asyncio
+from typing import Any, Optional
 
 import requests
 
-from constants import VkConstant
+from cache import LruCache
+from constants import CacheConstant, TenantConstant, VkConstant
 from exceptions import (LongPollConnectionError, LongPollResponseError,
                         NoDataInResponseError, VkApiConnectionError,
                         VkApiError)
 from image_render import render
+from media import downloader
+from models import Media, Message, Sender, WallPost
+from tenants import tenant
 
 
 class VkApiBase:
     """Базовый функционал для работы с API Vk."""
 
-    def __init__(self):
-        self.timestamp: int = 0
-        self.poll_server_url: str = ''
-        self.poll_server_key: str = ''
-
-    def check_response(self, response: requests.Response) -> dict:
+    def check_response(
+            self,
+            response: requests.Response,
+            long_poll: bool = False,
+    ) -> dict:
         """Проверит ответ от API Vk."""
         url = response.url
 
         if response.status_code != 200:
             error_text = f'Эндпоинт {url} недоступен.'
 
-            if url == self.poll_server_url:
+            if long_poll:
                 raise LongPollConnectionError(error_text)
             else:
                 raise VkApiConnectionError(error_text)
@@ -52,51 +55,78 @@ class VkApiBase:
         return result
 
     def make_request_and_check(self, url, data=None, files=None):
-        """Отправит запрос к API Vk и проверит ответ."""
-        response = requests.post(url=url, data=data, files=files,)
+        """Отправит запрос к API Vk и проверит ответ.
+
+        Запрос блокирующий: из асинхронного кода он выполняется через
+        asyncio.to_thread.
+        """
+        try:
+            response = requests.post(
+                url=url,
+                data=data,
+                files=files,
+                timeout=(
+                    VkConstant.CONNECT_TIMEOUT.value,
+                    VkConstant.READ_TIMEOUT.value,
+                ),
+            )
+        except requests.Timeout as error:
+            raise VkApiConnectionError(
+                f'Эндпоинт {url} не ответил вовремя: {error}'
+            )
+
         result = self.check_response(response=response,)
 
         return result
 
-    def update_params(self, params):
-        """Обновит timestamp, URL LongPoll-сервера и его ключ."""
-        self.timestamp = params['response']['ts']
-        self.poll_server_url = f'https://{params["response"]["server"]}'
-        self.poll_server_key = params['response']['key']
-
     def get_vk_long_pol_server(self):
         """Запросит URL LongPoll сервера."""
         endpoint = VkConstant.ENDPOINTS.value['get_lp_server']
         data = {
             'need_pts': VkConstant.NEED_PTS.value,
             'lp_version': VkConstant.LP_VERSION.value,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
 
         return response
 
-    def connect_vk_long_poll_server(self, wait):
-        """Установит связь с LongPoll-сервером."""
-        endpoint = self.poll_server_url
+    def get_group_long_poll_server(self, group_id):
+        """Запросит URL сервера Bots LongPoll сообщества."""
+        endpoint = VkConstant.ENDPOINTS.value['get_group_lp_server']
         data = {
-            'act': 'a_check',
-            'wait': wait,
-            'key': self.poll_server_key,
-            'ts': self.timestamp,
-            'mode': VkConstant.LONG_POLL_MODE.value,
-            'version': VkConstant.LONG_POLL_VERSION.value,
-            }
+            'group_id': group_id,
+            'access_token': tenant().vk_access_token,
+            'v': VkConstant.API_VERSION.value,
+        }
         response = self.make_request_and_check(url=endpoint, data=data, )
 
         return response
 
+    def connect_vk_long_poll_server(self, server, data):
+        """Дождется событий на LongPoll-сервере."""
+        try:
+            response = requests.post(
+                url=server,
+                data=data,
+                timeout=(
+                    VkConstant.CONNECT_TIMEOUT.value,
+                    data['wait'] + VkConstant.READ_TIMEOUT.value,
+                ),
+            )
+        except requests.Timeout as error:
+            raise LongPollConnectionError(
+                f'LongPoll-сервер не ответил вовремя: {error}'
+            )
+
+        return self.check_response(response=response, long_poll=True, )
+
     def get_photo_upload_server(self):
         """Вернет URL сервера для загрузки изображения."""
         endpoint = VkConstant.ENDPOINTS.value['get_photo_upload_server']
         data = {
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -118,7 +148,34 @@ class VkApiBase:
             'server': server_id,
             'photo': photo,
             'hash': resp_hash,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
+            'v': VkConstant.API_VERSION.value,
+        }
+        response = self.make_request_and_check(url=endpoint, data=data, )
+
+        return response
+
+    def get_doc_upload_server(self, peer_id, doc_type='doc'):
+        """Вернет URL сервера для загрузки документа или голосового."""
+        endpoint = VkConstant.ENDPOINTS.value['get_doc_upload_server']
+        data = {
+            'peer_id': peer_id,
+            'type': doc_type,
+            'access_token': tenant().vk_access_token,
+            'v': VkConstant.API_VERSION.value,
+        }
+        response = self.make_request_and_check(url=endpoint, data=data, )
+        upload_server_url = response['response']['upload_url']
+
+        return upload_server_url
+
+    def save_doc(self, file, title=None):
+        """Сохранит загруженный документ или голосовое сообщение."""
+        endpoint = VkConstant.ENDPOINTS.value['save_doc']
+        data = {
+            'file': file,
+            'title': title,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -131,10 +188,10 @@ class VkApiBase:
             message,
             reply_to=None,
             uploaded_photo=None,
+            attachment=None,
     ):
         """Отправит сообщение пользователю Vk."""
         endpoint = VkConstant.ENDPOINTS.value['send_message']
-        attachment = None
 
         if uploaded_photo:
             owner_id = uploaded_photo['response'][0]['owner_id']
@@ -147,7 +204,7 @@ class VkApiBase:
             'attachment': attachment,
             'reply_to': reply_to,
             'random_id': 0,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -161,7 +218,7 @@ class VkApiBase:
             'user_ids': user_id,
             'fields': 'photo_200',
             'name_case': name_case,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -173,7 +230,7 @@ class VkApiBase:
         endpoint = VkConstant.ENDPOINTS.value['get_group']
         data = {
             'group_id': group_id,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -187,7 +244,7 @@ class VkApiBase:
             'fields': 'nickname',
             'order': order,
             'name_case': name_case,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -199,20 +256,42 @@ class VkApiBase:
         endpoint = VkConstant.ENDPOINTS.value['get_message_by_id']
         data = {
             'message_ids': message_id,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
 
         return response
 
+    def get_messages_by_ids(self, message_ids):
+        """Вернет данные нескольких сообщений, запросив их пачками.
+
+        Данные каждого сообщения имеют тот же вид, что и ответ
+        get_message_by_id.
+        """
+        messages = dict()
+        batch = VkConstant.MESSAGES_GET_BATCH.value
+
+        for offset in range(0, len(message_ids), batch):
+            response = self.get_message_by_id(
+                message_id=','.join(
+                    str(message_id)
+                    for message_id in message_ids[offset:offset + batch]
+                ),
+            )
+
+            for item in response['response']['items']:
+                messages[item['id']] = {'response': {'items': [item]}}
+
+        return messages
+
     def short_link(self, url, private=True):
         """Сократит ссылку."""
         endpoint = VkConstant.ENDPOINTS.value['get_short_link']
         data = {
             'url': url,
             'private': 1 if private else 0,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -224,7 +303,7 @@ class VkApiBase:
         endpoint = VkConstant.ENDPOINTS.value['get_video']
         data = {
             'videos': ','.join(param_videos),
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -236,7 +315,7 @@ class VkApiBase:
         endpoint = VkConstant.ENDPOINTS.value['message_mark_as_read']
         data = {
             'peer_id': peer_id,
-            'access_token': VkConstant.ACCESS_TOKEN.value,
+            'access_token': tenant().vk_access_token,
             'v': VkConstant.API_VERSION.value,
         }
         response = self.make_request_and_check(url=endpoint, data=data, )
@@ -244,11 +323,23 @@ class VkApiBase:
         return response
 
 
+def wall_post_size(post: WallPost) -> int:
+    """Оценит объем подготовленного репоста в байтах."""
+    return post.size()
+
+
 class VkApi(VkApiBase):
     """Обработка и дополнение материалов сообщений."""
-    
-    def __init__(self):
-        super().__init__()
+
+    wall_cache = LruCache(
+        max_entries=CacheConstant.WALL_MAX_ENTRIES.value,
+        max_bytes=CacheConstant.WALL_MAX_BYTES.value,
+        sizeof=wall_post_size,
+    )
+    video_cache = LruCache(
+        max_entries=CacheConstant.VIDEO_MAX_ENTRIES.value,
+        ttl=CacheConstant.VIDEO_TTL.value,
+    )
 
     def get_user_or_group_info(
             self,
@@ -281,6 +372,26 @@ class VkApi(VkApiBase):
                 'avatar': group_data.get('photo_200'),
             }
 
+    async def get_sender(self, user_or_group_id: int) -> Sender:
+        """Вернет автора сообщения или поста."""
+        info = await asyncio.to_thread(
+            self.get_user_or_group_info,
+            user_or_group_id=user_or_group_id,
+        )
+
+        if info['type'] == 'user':
+            return Sender(
+                id=user_or_group_id,
+                name=f'{info["first_name"]} {info["last_name"]}',
+                avatar=info['avatar'],
+            )
+
+        return Sender(
+            id=-info['group_id'],
+            name=info['group_name'],
+            avatar=info['avatar'],
+        )
+
     def largest_image(self, images: dict) -> str:
         """Выберет изображение с наибольшим разрешением."""
         largest_image_url = ''
@@ -294,163 +405,307 @@ class VkApi(VkApiBase):
 
         return largest_image_url
 
-    def get_video_url_and_frame(
-            self,
-            attachments: list[dict[str, Any]],
-            get_video_player_url: bool = True,
-    ) -> dict[str, list[Union[str, bytes]]]:
-        """Вернет ссылку на видео и случайный кадр."""
-        param_videos = list()
-        videos = {'video_urls': [], 'video_frames': []}
+    @staticmethod
+    def video_attachments(attachments):
+        """Вернет данные видео из вложений."""
+        return [
+            attachment['video'] for attachment in attachments or []
+            if attachment['type'] == 'video'
+        ]
 
-        for attachment in attachments:
-            if attachment['type'] == 'video':
-                video_data = attachment['video']
-                owner_id = video_data['owner_id']
-                video_id = video_data['id']
-
-                frames = video_data['image']
-                frame = self.largest_image(frames)
-                rendered_frame = render(base_image_url=frame,)
-                videos['video_frames'].append(rendered_frame)
-
-                if get_video_player_url:
-                    access_key = video_data['access_key']
-                    param = f'{owner_id}_{video_id}_{access_key}'
-                    param_videos.append(param)
-                else:
-                    videos['video_urls'].append(
-                        f'https://vk.com/video{owner_id}_{video_id}'
-                    )
-
-        if param_videos:
-            response = self.get_video(param_videos=param_videos,)
-            items = response['response']['items']
-
-            for item in items:
-                video_url = item['player']
-                videos['video_urls'].append(video_url)
-
-        return videos
-
-    def get_images(self, attachments):
-        """Вернет ссылки на изображения во вложениях."""
-        images = list()
+    async def cache_videos(self, videos_data: list[dict[str, Any]]) -> None:
+        """Запросит ссылки на плеер для видео, которых нет в кэше.
 
-        for attachment in attachments:
-            if attachment['type'] == 'photo':
-                photo_data = attachment['photo']
-                photo_sizes = photo_data.get('sizes')
-                photo_url = self.largest_image(photo_sizes)
-                images.append(photo_url)
+        Видео запрашиваются пачками по VIDEO_GET_BATCH штук, access_key
+        передается только если он есть у вложения.
+        """
+        param_videos = dict()
+        requested_videos = dict()
 
-        return images
+        for video_data in videos_data:
+            video_key = f'{video_data["owner_id"]}_{video_data["id"]}'
 
-    def get_sticker(self, short_msg_data):
-        """Вернет ссылку на изображение стикера."""
-        message = dict()
+            if video_key in self.video_cache or video_key in param_videos:
+                continue
 
-        attachments = json.loads(short_msg_data['attachments'])
-        sticker_data = attachments[0]['sticker']
-        sticker_sizes = sticker_data['images_with_background']
-        message['sticker_url'] = self.largest_image(sticker_sizes)
+            access_key = video_data.get('access_key')
+            param_videos[video_key] = (
+                f'{video_key}_{access_key}' if access_key else video_key
+            )
+            requested_videos[video_key] = video_data
 
-        return message
+        params = list(param_videos.values())
+        batch = VkConstant.VIDEO_GET_BATCH.value
 
-    def get_message(self, message_data, short_msg_data):
-        """Сформирует данные сообщения."""
-        message = dict()
+        for offset in range(0, len(params), batch):
+            response = await asyncio.to_thread(
+                self.get_video,
+                param_videos=params[offset:offset + batch],
+            )
 
-        message['message_id'] = message_data['response']['items'][0]['id']
-        user_or_group_id = message_data['response']['items'][0]['from_id']
-        sender_info = self.get_user_or_group_info(
-            user_or_group_id=user_or_group_id,
-        )
+            for item in response['response']['items']:
+                video_key = f'{item["owner_id"]}_{item["id"]}'
+                self.video_cache.set(
+                    video_key,
+                    (item.get('player'), self.largest_image(item['image'])),
+                )
 
-        message.update(sender_info)
+        for video_key, video_data in requested_videos.items():
+            if video_key not in self.video_cache:
+                self.video_cache.set(
+                    video_key,
+                    (None, self.largest_image(video_data['image'])),
+                )
 
-        if short_msg_data:
-            sticker = self.get_sticker(short_msg_data=short_msg_data,)
-            message.update(sticker)
-        else:
-            message['text'] = message_data['response']['items'][0]['text']
+    async def prefetch_videos(self, items: list[dict[str, Any]]) -> None:
+        """Заполнит кэш видео для всех сообщений пачки обновлений."""
+        videos_data = list()
+
+        for item in items:
+            videos_data += self.video_attachments(item.get('attachments'))
+            reply_message = item.get('reply_message') or {}
+            videos_data += self.video_attachments(
+                reply_message.get('attachments'),
+            )
+
+        await self.cache_videos(videos_data=videos_data)
 
-            message_attachments = message_data['response']['items'][0][
-                'attachments']
-            message['images'] = self.get_images(
-                attachments=message_attachments,
+    async def get_video_url_and_frame(
+            self,
+            videos_data: list[dict[str, Any]],
+            get_video_player_url: bool = True,
+    ) -> tuple[list[str], list[bytes]]:
+        """Вернет ссылки на видео и случайные кадры из них."""
+        frame_urls = list()
+        video_urls = list()
+
+        if get_video_player_url:
+            await self.cache_videos(videos_data=videos_data)
+
+        for video_data in videos_data:
+            video_key = f'{video_data["owner_id"]}_{video_data["id"]}'
+            player_url, frame_url = self.video_cache.get(
+                video_key, (None, None),
             )
-            message['videos'] = self.get_video_url_and_frame(
-                attachments=message_attachments,
+            frame_urls.append(
+                frame_url or self.largest_image(video_data['image'])
             )
 
-        return message
+            if not get_video_player_url:
+                video_urls.append(f'https://vk.com/video{video_key}')
+            elif player_url:
+                video_urls.append(player_url)
+
+        frames = await asyncio.gather(
+            *(downloader.fetch(url=frame_url) for frame_url in frame_urls)
+        )
 
-    def get_wall(self, attachments):
-        """Сформирует данные репоста."""
-        wall = dict()
+        return video_urls, [render(base_image=frame) for frame in frames]
 
-        for attachment in attachments:
-            if 'wall' in attachment:
-                wall['message_type'] = 'wall'
-                wall_data = [attachment][0]['wall']
-                wall['post_id'] = wall_data['id']
-                wall['text'] = wall_data['text']
-
-                owner_id = wall_data['from_id']
-                owner_info = self.get_user_or_group_info(
-                    user_or_group_id=owner_id,
+    async def get_media(
+            self,
+            attachments: list[dict[str, Any]],
+            get_video_player_url: bool = True,
+    ) -> Media:
+        """Разберет вложения сообщения за один проход."""
+        media = Media()
+        videos_data = list()
+
+        for attachment in attachments or []:
+            attachment_type = attachment['type']
+
+            if attachment_type == 'photo':
+                media.images.append(
+                    self.largest_image(attachment['photo'].get('sizes'))
                 )
-                wall.update(owner_info)
+            elif attachment_type == 'video':
+                videos_data.append(attachment['video'])
+            else:
+                file = self.get_file(attachment=attachment)
 
-                wall_attachments = wall_data['attachments']
-                wall['images'] = self.get_images(
-                    attachments=wall_attachments,
+                if file:
+                    media.files.append(file)
+
+        if videos_data:
+            media.video_urls, media.video_frames = (
+                await self.get_video_url_and_frame(
+                    videos_data=videos_data,
+                    get_video_player_url=get_video_player_url,
                 )
-                wall['videos'] = self.get_video_url_and_frame(
-                    attachments=wall_attachments,
-                    get_video_player_url=False,
+            )
+
+        return media
+
+    @staticmethod
+    def get_file(attachment: dict[str, Any]) -> Optional[dict[str, Any]]:
+        """Вернет данные документа, голосового сообщения или аудиозаписи."""
+        attachment_type = attachment['type']
+
+        if attachment_type == 'doc':
+            doc_data = attachment['doc']
+            file_name = doc_data.get('title') or 'document'
+            ext = doc_data.get('ext')
+
+            if ext and not file_name.endswith(f'.{ext}'):
+                file_name = f'{file_name}.{ext}'
+
+            return {
+                'kind': 'document',
+                'url': doc_data['url'],
+                'file_name': file_name,
+                'size': doc_data.get('size'),
+            }
+        elif attachment_type == 'audio_message':
+            voice_data = attachment['audio_message']
+
+            return {
+                'kind': 'voice',
+                'url': voice_data['link_ogg'],
+                'file_name': 'voice.ogg',
+                'duration': voice_data.get('duration'),
+            }
+        elif attachment_type == 'audio':
+            audio_data = attachment['audio']
+            audio_url = audio_data.get('url')
+
+            if not audio_url or '.m3u8' in audio_url:
+                return None
+
+            performer = audio_data.get('artist')
+            title = audio_data.get('title')
+
+            return {
+                'kind': 'audio',
+                'url': audio_url,
+                'file_name': f'{performer} - {title}.mp3',
+                'duration': audio_data.get('duration'),
+                'performer': performer,
+                'title': title,
+            }
+
+        return None
+
+    @staticmethod
+    def describe_attachments(attachments):
+        """Вернет краткие описания вложений для архива сообщений."""
+        descriptors = list()
+
+        for attachment in attachments:
+            attachment_type = attachment['type']
+            attachment_data = attachment.get(attachment_type, {})
+            descriptor = {'type': attachment_type}
+
+            if 'owner_id' in attachment_data and 'id' in attachment_data:
+                descriptor['id'] = (
+                    f'{attachment_type}{attachment_data["owner_id"]}'
+                    f'_{attachment_data["id"]}'
                 )
 
-        return wall
+            title = attachment_data.get('title')
 
-    def get_reply_orig_msg_id(self, message_data):
-        """Вернет id сообщения, на которое отправлен ответ."""
-        reply_orig_msg_id = message_data['response']['items'][0][
-            'reply_message']['id']
+            if attachment_type == 'audio' and attachment_data.get('artist'):
+                title = f'{attachment_data["artist"]} - {title}'
 
-        return reply_orig_msg_id
+            if title:
+                descriptor['title'] = title
 
-    def get_reply_original_message(self, message_data):
-        """Сформирует данные сообщения, на которое отправлен ответ."""
-        reply_message = dict()
+            descriptors.append(descriptor)
 
-        reply_orig_msg_data = message_data['response']['items'][0][
-            'reply_message']
+        return descriptors
 
-        author_id = reply_orig_msg_data.get('from_id')
-        author_info = self.get_user_or_group_info(
-            user_or_group_id=author_id,
-        )
+    def get_sticker(self, attachments) -> Optional[str]:
+        """Вернет ссылку на изображение стикера, если он есть во вложениях."""
+        for attachment in attachments or []:
+            if attachment['type'] == 'sticker':
+                return self.largest_image(
+                    attachment['sticker']['images_with_background'],
+                )
 
-        reply_message.update(author_info)
+        return None
 
-        reply_message['message_id'] = message_data['response']['items'][0][
-            'reply_message']['id']
-        reply_message['text'] = reply_orig_msg_data.get('text')
-        reply_attachments = reply_orig_msg_data.get('attachments')
-        reply_message['images'] = self.get_images(
-            attachments=reply_attachments,
+    async def get_message(self, message_data) -> Message:
+        """Сформирует данные сообщения."""
+        item = message_data['response']['items'][0]
+        message = Message(
+            message_id=item['id'],
+            sender=await self.get_sender(user_or_group_id=item['from_id']),
         )
-        reply_message['videos'] = self.get_video_url_and_frame(
-                    attachments=reply_attachments,
+        message.sticker_url = self.get_sticker(
+            attachments=item.get('attachments'),
+        )
+
+        if not message.sticker_url:
+            message.text = item['text']
+            message.media = await self.get_media(
+                attachments=item['attachments'],
+            )
+
+        return message
+
+    async def get_wall(self, attachments) -> Optional[WallPost]:
+        """Сформирует данные репоста.
+
+        Подготовленные репосты кэшируются по ключу wall{owner}_{id}, поэтому
+        повторная пересылка популярного поста не требует запросов к Vk.
+        """
+        for attachment in attachments or []:
+            if 'wall' not in attachment:
+                continue
+
+            wall_data = attachment['wall']
+            cache_key = f'wall{wall_data["owner_id"]}_{wall_data["id"]}'
+            post = self.wall_cache.get(cache_key)
+
+            if not post:
+                post = WallPost(
+                    cache_key=cache_key,
+                    post_id=wall_data['id'],
+                    author=await self.get_sender(
+                        user_or_group_id=wall_data['from_id'],
+                    ),
+                    text=wall_data['text'],
+                    media=await self.get_media(
+                        attachments=wall_data['attachments'],
+                        get_video_player_url=False,
+                    ),
                 )
+                self.wall_cache.set(cache_key, post)
 
-        wall_data = self.get_wall(attachments=reply_attachments,)
+            return post
 
-        if wall_data:
-            reply_message['wall'] = self.get_wall(
-                attachments=reply_attachments,
-            )
+        return None
+
+    def update_cached_wall(self, post: WallPost) -> None:
+        """Обновит репост в кэше после отправки.
 
-        return reply_message
+        Когда изображения уже загружены в Telegram, кадры видео больше
+        не нужны: при повторной отправке используются file_id. Если
+        владельцев несколько, кадры остаются для ботов, которые еще не
+        отправляли этот репост.
+        """
+        if post.media.file_ids and not TenantConstant.FILE.value:
+            post.media.video_frames = []
+
+        self.wall_cache.set(post.cache_key, post)
+
+    def get_reply_orig_msg_id(self, message_data):
+        """Вернет id сообщения, на которое отправлен ответ."""
+        reply_orig_msg_id = message_data['response']['items'][0][
+            'reply_message']['id']
+
+        return reply_orig_msg_id
+
+    async def get_reply_original_message(self, message_data) -> Message:
+        """Сформирует данные сообщения, на которое отправлен ответ."""
+        reply_data = message_data['response']['items'][0]['reply_message']
+        reply_attachments = reply_data.get('attachments')
+
+        return Message(
+            message_id=reply_data['id'],
+            sender=await self.get_sender(
+                user_or_group_id=reply_data.get('from_id'),
+            ),
+            text=reply_data.get('text', ''),
+            media=await self.get_media(attachments=reply_attachments),
+            wall=await self.get_wall(attachments=reply_attachments),
+        )
@@ -0,0 +1,117 @@
+import asyncio
+import hmac
+import secrets
+from urllib.parse import urlparse
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from constants import TgConstant
+from logger import run_logger
+from metrics import metrics
+
+logger = run_logger('webhook')
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class TgWebhookServer:
+    """HTTP-сервер вебхуков Telegram в текущем цикле событий.
+
+    Один сервер обслуживает ботов всех владельцев: бот определяется по
+    пути запроса. Обновления проверяются по секретному токену и сразу
+    передаются в очередь обновлений приложения бота.
+    """
+
+    def __init__(
+            self,
+            url: str = TgConstant.WEBHOOK_URL.value,
+            secret_token: str = TgConstant.WEBHOOK_SECRET.value,
+            listen: str = TgConstant.WEBHOOK_LISTEN.value,
+            port: int = TgConstant.WEBHOOK_PORT.value,
+    ):
+        self.url = url.rstrip('/')
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.listen = listen
+        self.port = port
+        self.apps: dict[str, Application] = {}
+        self.runner = None
+        self.start_lock = asyncio.Lock()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        secret_token = request.headers.get(SECRET_HEADER, '')
+
+        if not hmac.compare_digest(secret_token, self.secret_token):
+            metrics.increment('tg_webhook_rejected')
+            logger.warning(
+                f'Отклонен запрос к вебхуку от {request.remote}: '
+                f'неверный секретный токен.'
+            )
+            return web.Response(status=403)
+
+        app = self.apps.get(request.path)
+
+        if app is None:
+            return web.Response(status=404)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data=data, bot=app.bot)
+        await app.update_queue.put(update)
+        metrics.increment('tg_webhook_updates')
+
+        return web.Response()
+
+    async def start(self) -> None:
+        async with self.start_lock:
+            if self.runner:
+                return
+
+            if not self.url:
+                raise ValueError(
+                    'Для режима webhook нужно указать TELEGRAM_WEBHOOK_URL.'
+                )
+
+            web_app = web.Application()
+            web_app.router.add_post('/{path:.*}', self.handle_update)
+
+            self.runner = web.AppRunner(web_app, access_log=None)
+            await self.runner.setup()
+            await web.TCPSite(
+                self.runner, host=self.listen, port=self.port,
+            ).start()
+
+            logger.info(f'Сервер вебхуков слушает {self.listen}:{self.port}.')
+
+    async def register(self, app: Application, path: str = '') -> None:
+        """Примет обновления бота по адресу TELEGRAM_WEBHOOK_URL + path."""
+        await self.start()
+
+        url = f'{self.url}{path}'
+        self.apps[urlparse(url).path or '/'] = app
+
+        await app.bot.set_webhook(
+            url=url,
+            secret_token=self.secret_token,
+            allowed_updates=Update.ALL_TYPES,
+        )
+
+        logger.info(f'Вебхук {url} зарегистрирован.')
+
+    def unregister(self, app: Application) -> None:
+        self.apps = {
+            path: registered for path, registered in self.apps.items()
+            if registered is not app
+        }
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+webhook_server = TgWebhookServer()
@@ -0,0 +1,179 @@
+import asyncio
+import multiprocessing
+import queue
+from collections import defaultdict
+from typing import Callable, Iterable
+
+from constants import ConnectorConstant
+from exceptions import WorkerError
+from logger import run_logger
+from models import VkEvent
+
+logger = run_logger('workers')
+
+
+class ShardPool:
+    """Распределит события Vk по процессам-обработчикам.
+
+    Событие попадает в процесс с номером vk_user_id % workers. У каждого
+    процесса своя очередь, поэтому события одного собеседника
+    обрабатываются строго по порядку, а разные собеседники - параллельно.
+
+    Упавший процесс перезапускается с новой очередью, в которую переносятся
+    еще не взятые события. Если процесс падает чаще max_restarts раз или
+    не принимает события дольше put_timeout секунд, dispatch выбросит
+    WorkerError.
+    """
+
+    def __init__(
+            self,
+            workers: int,
+            target: Callable[[int, multiprocessing.Queue], None],
+            queue_size: int = ConnectorConstant.WORKER_QUEUE_SIZE.value,
+            put_timeout: float = ConnectorConstant.WORKER_PUT_TIMEOUT.value,
+            max_restarts: int = ConnectorConstant.WORKER_MAX_RESTARTS.value,
+    ):
+        # spawn: процессы не наследуют цикл событий, соединения с БД и
+        # потоки родителя.
+        self.context = multiprocessing.get_context('spawn')
+        self.target = target
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.max_restarts = max_restarts
+        self.restarts = [0] * workers
+
+        self.queues = [
+            self.context.Queue(maxsize=queue_size) for _ in range(workers)
+        ]
+        self.processes = [
+            self.create_process(shard=shard) for shard in range(workers)
+        ]
+
+    def create_process(self, shard: int):
+        return self.context.Process(
+            target=self.target,
+            args=(shard, self.queues[shard]),
+            name=f'vk-worker-{shard}',
+            daemon=True,
+        )
+
+    def start(self) -> None:
+        for process in self.processes:
+            process.start()
+
+        logger.info(f'Запущено процессов-обработчиков: {len(self.processes)}.')
+
+    def ensure_alive(self, shard: int) -> None:
+        """Перезапустит процесс, если он завершился."""
+        process = self.processes[shard]
+
+        if process.is_alive():
+            return
+
+        if self.restarts[shard] >= self.max_restarts:
+            raise WorkerError(
+                f'Процесс {process.name} завершился с кодом '
+                f'{process.exitcode} и уже перезапускался '
+                f'{self.restarts[shard]} раз.'
+            )
+
+        self.restarts[shard] += 1
+        logger.error(
+            f'Процесс {process.name} завершился с кодом {process.exitcode}. '
+            f'Перезапускаем ({self.restarts[shard]}/{self.max_restarts}).'
+        )
+
+        # Процесс мог умереть, держа блокировку очереди: события переносим
+        # в новую очередь, не дожидаясь блокировки.
+        old_queue = self.queues[shard]
+        new_queue = self.context.Queue(maxsize=self.queue_size)
+
+        while True:
+            try:
+                new_queue.put_nowait(old_queue.get_nowait())
+            except (queue.Empty, queue.Full):
+                break
+
+        old_queue.close()
+        self.queues[shard] = new_queue
+        self.processes[shard] = self.create_process(shard=shard)
+        self.processes[shard].start()
+
+    def shard(self, vk_user_id: int) -> int:
+        return abs(vk_user_id) % len(self.queues)
+
+    def split(self, updates: Iterable[VkEvent]) -> dict[int, list]:
+        """Разобьет пачку событий по процессам с сохранением порядка."""
+        shards = defaultdict(list)
+
+        for event in updates:
+            shards[self.shard(vk_user_id=event.peer_id)].append(event)
+
+        return shards
+
+    async def dispatch(
+            self,
+            tenant_id: str,
+            updates: Iterable[VkEvent],
+    ) -> None:
+        for shard, events in self.split(updates=updates).items():
+            await self.put(shard=shard, item=(tenant_id, events))
+
+    async def put(self, shard: int, item: tuple) -> None:
+        # Цикл конечен: ensure_alive выбросит WorkerError, когда
+        # перезапуски закончатся.
+        while True:
+            self.ensure_alive(shard=shard)
+            shard_queue = self.queues[shard]
+
+            try:
+                shard_queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+            # Процесс не успевает: ждем место в очереди, не блокируя цикл
+            # событий, но не дольше put_timeout.
+            try:
+                await asyncio.to_thread(
+                    shard_queue.put, item, timeout=self.put_timeout,
+                )
+                return
+            except queue.Full:
+                if self.processes[shard].is_alive():
+                    raise WorkerError(
+                        f'Процесс {self.processes[shard].name} не принимает '
+                        f'события дольше {self.put_timeout} с.'
+                    )
+
+    def stop(
+            self,
+            timeout: float = ConnectorConstant.WORKER_STOP_TIMEOUT.value,
+    ) -> None:
+        """Дождется обработки очередей и остановит процессы."""
+        for process, shard_queue in zip(self.processes, self.queues):
+            if not process.is_alive():
+                logger.error(
+                    f'Процесс {process.name} уже завершился с кодом '
+                    f'{process.exitcode}, его очередь не обработана.'
+                )
+                continue
+
+            try:
+                shard_queue.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning(
+                    f'Очередь процесса {process.name} не освободилась '
+                    f'за {timeout} с.'
+                )
+
+        for process in self.processes:
+            process.join(timeout=timeout)
+
+            if process.is_alive():
+                logger.warning(
+                    f'Процесс {process.name} не завершился за {timeout} с.'
+                )
+                process.terminate()
+
+        logger.info('Процессы-обработчики остановлены.')